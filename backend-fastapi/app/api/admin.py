@@ -0,0 +1,75 @@
+import os
+import hmac
+import math
+from fastapi import APIRouter, HTTPException, Header
+from app.models.admin import IngestRequest, IngestResponse, DeleteResponse
+from app.services.ingestion import bulk_writer, build_enhanced_document, PendingDocument
+from app.services.admission import OverloadedError
+from app.services.federated_search import resolve_indices, UnknownEventError
+from typing import Optional
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+# X-Admin-Token ヘッダーで一致を確認（未設定の場合は管理APIを受け付けない）
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN')
+
+def require_admin(token: Optional[str]):
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin API is disabled (ADMIN_API_TOKEN is not set)")
+    # 一致する文字数から推測されないように定数時間で比較
+    if token is None or not hmac.compare_digest(token.encode('utf-8'), ADMIN_API_TOKEN.encode('utf-8')):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+def event_index(event: Optional[str]) -> Optional[str]:
+    """イベント名 → 書き込み先のインデックス（省略時は None = BulkWriter の既定のインデックス）"""
+    if not event:
+        return None
+    try:
+        return resolve_indices([event])[event]
+    except UnknownEventError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/documents", response_model=IngestResponse, status_code=202)
+async def ingest_documents(request: IngestRequest, x_admin_token: Optional[str] = Header(default=None)):
+    """セッション・講演要約ドキュメントを受け付けてバルク書き込みの待ち行列に追加（書き込み完了は待たない）"""
+    require_admin(x_admin_token)
+    index_name = event_index(request.event)
+    
+    pending = []
+    for document in request.documents:
+        if document.source is None and not document.transcript_summary:
+            raise HTTPException(status_code=400, detail=f"{document.session_id}: source or transcript_summary is required")
+        source = document.source
+        if source is not None:
+            source = {**source, "session_id": document.session_id}
+            if document.transcript_summary:
+                source = build_enhanced_document(source, document.transcript_summary)
+            pending.append(PendingDocument(document.session_id, source=source, index_name=index_name))
+        else:
+            pending.append(PendingDocument(document.session_id, transcript=document.transcript_summary, index_name=index_name))
+    
+    try:
+        queue_depth = bulk_writer.submit(pending)
+    except OverloadedError as error:
+        raise HTTPException(
+            status_code=503,
+            detail=str(error),
+            headers={"Retry-After": str(math.ceil(error.retry_after))}
+        )
+    print(f"📨 Queued {len(pending)} documents for ingestion into {index_name or bulk_writer.index_name} (queue: {queue_depth})")
+    return IngestResponse(accepted=len(pending), queue_depth=queue_depth)
+
+@router.delete("/documents/{session_id}", response_model=DeleteResponse)
+async def delete_documents(session_id: str, event: Optional[str] = None, x_admin_token: Optional[str] = Header(default=None)):
+    """セッションのドキュメント（元データ・拡張版とも）を削除（各ワーカーへは変更ログで反映、event 省略時は既定のイベント）"""
+    require_admin(x_admin_token)
+    deleted = await bulk_writer.delete([session_id], event_index(event))
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"{session_id}: no documents found")
+    return DeleteResponse(session_id=session_id, deleted=deleted, event=event)
+
+@router.get("/ingestion")
+async def ingestion_status(x_admin_token: Optional[str] = Header(default=None)):
+    """バルク書き込みの待ち行列・書き込み件数・直近のエラー"""
+    require_admin(x_admin_token)
+    return bulk_writer.status()
@@ -1,8 +1,23 @@
-from fastapi import APIRouter, HTTPException
+import math
+import asyncio
+from fastapi import APIRouter, HTTPException, Header, Query
 from app.models.chat import ChatRequest, ChatResponse, Source
-from app.services.opensearch_client import opensearch_client
-from app.services.bedrock_client import bedrock_client
-from typing import List, Tuple
+from app.services.context_renderer import context_renderer, estimate_tokens, CONTEXT_TOKEN_BUDGET
+from app.services.suggest_index import suggest_index
+from app.services.query_filters import filter_vocabulary, merge_filters
+from app.services.keyword_priority import keyword_priority
+from app.services.fact_answer import answer_from_fields
+from app.services.fallback_planner import fallback_planner
+from app.services.federated_search import federated_search, resolve_indices, UnknownEventError, DEFAULT_EVENT, EVENT_INDICES
+from app.services.bedrock_client import bedrock_client, MAX_OUTPUT_TOKENS
+from app.services.llm_usage import start_usage, TokenBudgetExceededError
+from app.services.profiler import set_stage
+from app.services.session_store import session_store
+from app.services.shared_cache import shared_cache
+from app.services.query_log import query_logger
+from app.services.admission import OverloadedError
+from app.services.deadline import start_deadline, stage_allowed, get_deadline, DeadlineExceededError
+from typing import List, Tuple, Optional, Dict, Any
 import os
 import re
 import time
@@ -13,74 +28,61 @@ load_dotenv()
 
 router = APIRouter()
 
+# コンテキスト構築に必要なフィールドのみ取得（転送量・JSONデコード量の削減）
+# data_version・enhanced_timestamp は描画済みコンテキストのキャッシュキー（document_cache_key）に使う
+CONTEXT_SOURCE_FIELDS = [
+    "session_id", "title", "abstract", "speakers", "track", "date", "start_time",
+    "transcript_summary", "has_detailed_content", "data_version", "enhanced_timestamp"
+]
+# transcript_summary を上位N件のハイライト断片で取得（既定の 0 は全文。断片にすると回答に使える内容が変わるので明示的に指定した場合のみ）
+CONTEXT_TRANSCRIPT_FRAGMENTS = int(os.getenv('CONTEXT_TRANSCRIPT_FRAGMENTS', '0'))
+# フォールバック検索はヒット有無の判定とログ出力にしか使わない
+FALLBACK_SOURCE_FIELDS = ["session_id", "title"]
+# 投機的検索: 元の質問での検索結果がこのスコアと網羅率を満たせばキーワード抽出を省略
+SPECULATIVE_RETRIEVAL_ENABLED = os.getenv('SPECULATIVE_RETRIEVAL_ENABLED', 'true').lower() == 'true'
+SPECULATIVE_MIN_SCORE = float(os.getenv('SPECULATIVE_MIN_SCORE', '10.0'))
+SPECULATIVE_MIN_COVERAGE = float(os.getenv('SPECULATIVE_MIN_COVERAGE', '0.6'))
+# 網羅率の計算に使う語（英数字の単語、カタカナ・漢字の2文字以上の連続）
+QUERY_TERM_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9.+#-]+|[ァ-ヶー]{2,}|[一-龯々]{2,}')
+
+# LLMのキーワード解析結果の行（「キーワード（分類）」）と、読み飛ばす行・除外する語
+KEYWORD_LINE_PATTERN = re.compile(r'^([^(（]+)[（(]([^)）]+)[）)]')
+KEYWORD_SKIP_MARKERS = ('解析結果', '質問の', '以下の')
+KEYWORD_STOPWORDS = frozenset(['について', 'を', 'の', 'が', 'は'])
+
+# X-Request-Timeout ヘッダーがない場合のリクエスト締め切り（秒）。各段階はこの残り予算で実行する
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv('CHAT_DEFAULT_TIMEOUT_SECONDS', '30'))
+
 def calculate_priority_score(keyword: str, category: str) -> int:
-    """改良版：完全な企業名を最優先にする優先度スコア計算"""
-    score = 0
-    
-    # 完全な企業名・組織名が最高優先度
-    if '企業名' in category and 'の一部' not in category:
-        score += 1000
-    elif '組織名' in category and 'の一部' not in category:
-        score += 950
-    # 企業名・組織名の一部は中程度優先度
-    elif '企業名の一部' in category:
-        score += 700
-    elif '組織名の一部' in category:
-        score += 650
-    # その他の固有名詞
-    elif '固有名詞' in category:
-        score += 800
-    
-    # サービス名、製品名、ゲーム名（完全形を優先）
-    if any(x in category for x in ['サービス名', 'サービス']) and 'の一部' not in category:
-        score += 900
-    elif any(x in category for x in ['製品名', '製品']) and 'の一部' not in category:
-        score += 900
-    elif any(x in category for x in ['ゲーム名', 'ゲーム']) and 'の一部' not in category:
-        score += 900
-    # 部分的なサービス名・製品名
-    elif any(x in category for x in ['サービス', '製品', 'ゲーム']) and 'の一部' in category:
-        score += 600
-    
-    # 技術用語
-    if '技術' in category:
-        score += 500
-    
-    # 専門用語
-    if '専門' in category:
-        score += 400
-    
-    # 一般名詞は低優先度
-    if category == '名詞':
-        score += 200
-    
-    # 数詞は中程度
-    if '数詞' in category:
-        score += 300
-    
-    # 文字数による微調整（長いほど具体的）
-    score += len(keyword) * 5
-    
-    # 特定の重要キーワードにボーナス（完全一致のみ）
-    important_terms = [
-        'ソニーグループ', 'カプコン', 'リコー', 'atama plus',
-        'Amazon', 'AWS', 'Bedrock', 'Claude',
-        'モンスターハンターワイルズ', 'モンスターハンター',
-        'Agentic AI', '生成AI'
-    ]
-    
-    if keyword in important_terms:
-        score += 100
-    
-    return score
+    """改良版：完全な企業名を最優先にする優先度スコア計算（ルールは config/keyword_priority.json）"""
+    return keyword_priority.score(keyword, category)
 
-async def search_with_score_based_fallback(query: str, keywords_with_scores: list) -> Tuple[list, str, float]:
-    """スコアベースのフォールバック検索システム（実行時間測定付き）"""
+async def search_with_score_based_fallback(query: str, keywords_with_scores: list,
+                                           profile_log: Optional[List[Dict[str, Any]]] = None,
+                                           trace: Optional[Dict[str, Any]] = None,
+                                           events: Optional[List[str]] = None,
+                                           filters: Optional[Dict[str, str]] = None) -> Tuple[list, str, float]:
+    """スコアベースのフォールバック検索システム（実行時間測定付き）
+    
+    trace を渡すと試行回数と採用された候補を記録する
+    events を渡すと検索対象のイベントを限定する（省略時は設定された全イベント）
+    filters は各試行の bool.filter に入る（条件内で一致するキーワードを選ぶ）
+    候補の順序は分類ごとの実績で調整し、最近0件だったキーワードは検索しない（fallback_planner）
+    """
+    set_stage("keyword_fallback_search")
     opensearch_start = time.time()
+    trace = trace if trace is not None else {}
+    trace['search_attempts'] = 0
     
     if not keywords_with_scores:
         print("⚠️ No keywords available, using original query")
-        results = await opensearch_client.search_with_transcript_content("aws_summit_sessions", query, 3)
+        trace['search_attempts'] = 1
+        trace['selected_candidate'] = {'keyword': query, 'position': 0, 'reason': 'original_query'}
+        fallback_planner.finish(1)
+        results = await federated_search(
+            query, 3, events=events, profile_log=profile_log,
+            source_fields=FALLBACK_SOURCE_FIELDS, filters=filters
+        )
         opensearch_time = time.time() - opensearch_start
         return results, query, opensearch_time
     
@@ -94,6 +96,7 @@ async def search_with_score_based_fallback(query: str, keywords_with_scores: lis
         
         search_candidates.append({
             'keyword': keyword,
+            'category': keyword_info.get('category', ''),
             'score': score,
             'reason': 'primary' if score < 1000 else 'high_specificity'
         })
@@ -108,6 +111,7 @@ async def search_with_score_based_fallback(query: str, keywords_with_scores: lis
             if 500 <= keyword_info['priority'] < 1000:
                 search_candidates.append({
                     'keyword': keyword_info['keyword'],
+                    'category': keyword_info.get('category', ''),
                     'score': keyword_info['priority'],
                     'reason': 'fallback_general'
                 })
@@ -120,59 +124,102 @@ async def search_with_score_based_fallback(query: str, keywords_with_scores: lis
             unique_candidates.append(candidate)
             seen_keywords.add(candidate['keyword'])
     
+    # 実績の成功率が低い分類を後回し・除外し、最近0件だったキーワードを省く
+    unique_candidates, skipped_candidates = await fallback_planner.plan(unique_candidates, events, filters)
+    if skipped_candidates:
+        trace['skipped_candidates'] = [
+            {'keyword': candidate['keyword'], 'reason': candidate['skip_reason']} for candidate in skipped_candidates
+        ]
+        skipped_labels = ", ".join(f"{candidate['keyword']} ({candidate['skip_reason']})" for candidate in skipped_candidates)
+        print(f"⏭️ Skipped candidates: {skipped_labels}")
+    
     print(f"🎯 Search strategy: {len(unique_candidates)} candidates")
     for i, candidate in enumerate(unique_candidates):
-        print(f"   {i+1}. '{candidate['keyword']}' (score: {candidate['score']}, reason: {candidate['reason']})")
+        expected = candidate.get('expected_success')
+        expected_label = f", expected success: {expected}" if expected is not None else ""
+        print(f"   {i+1}. '{candidate['keyword']}' (score: {candidate['score']}, reason: {candidate['reason']}{expected_label})")
     
     # 順次検索実行（非構造化データ対応）
     for i, candidate in enumerate(unique_candidates):
         keyword = candidate['keyword']
         reason = candidate['reason']
         
+        # 締め切りの予算が足りない場合は残りの試行を打ち切り、元のクエリで回答検索に進む
+        if not stage_allowed("search"):
+            get_deadline().degrade("capped_fallback_attempts")
+            trace['selected_candidate'] = {'keyword': query, 'position': i, 'reason': 'deadline_capped'}
+            fallback_planner.finish(trace['search_attempts'])
+            return [], query, time.time() - opensearch_start
+        
         print(f"🔍 Search attempt {i+1}: '{keyword}' (score: {candidate['score']}, reason: {reason})")
+        trace['search_attempts'] += 1
         
-        results = await opensearch_client.search_with_transcript_content("aws_summit_sessions", keyword, 3)
+        results = await federated_search(
+            keyword, 3, events=events, profile_log=profile_log,
+            source_fields=FALLBACK_SOURCE_FIELDS, filters=filters
+        )
+        # 一部のイベントが失敗した検索の0件は実際の0件とは限らないので、実績・負のキャッシュに記録しない
+        deadline = get_deadline()
+        if results or deadline is None or "partial_federated_search" not in deadline.degradations:
+            await fallback_planner.record(candidate, i, bool(results), events, filters)
         
         if results and len(results) > 0:
             opensearch_time = time.time() - opensearch_start
             print(f"✅ Success with '{keyword}' - Found {len(results)} results (OpenSearch time: {opensearch_time:.3f}s)")
+            trace['selected_candidate'] = {'keyword': keyword, 'position': i, 'reason': reason}
+            fallback_planner.finish(trace['search_attempts'])
             return results, keyword, opensearch_time
         else:
             print(f"❌ No results with '{keyword}'")
     
     # 最終フォールバック: 元のクエリ（非構造化データ対応）
     print(f"🆘 Final fallback with original query: '{query}'")
-    final_results = await opensearch_client.search_with_transcript_content("aws_summit_sessions", query, 3)
+    trace['search_attempts'] += 1
+    trace['selected_candidate'] = {'keyword': query, 'position': len(unique_candidates), 'reason': 'final_fallback'}
+    final_results = await federated_search(
+        query, 3, events=events, profile_log=profile_log,
+        source_fields=FALLBACK_SOURCE_FIELDS, filters=filters
+    )
+    fallback_planner.finish(trace['search_attempts'])
     opensearch_time = time.time() - opensearch_start
     return final_results, query, opensearch_time
 
+def keyword_cacheable(trace: Dict[str, Any]) -> bool:
+    """選ばれたキーワードを共有キャッシュに保存してよいか
+
+    締め切りで試行を打ち切った・一部のイベントが失敗したなど縮退した結果は
+    本来のキーワードとは限らないので保存しない
+    """
+    deadline = get_deadline()
+    if deadline is not None and deadline.degradations:
+        return False
+    return trace.get('selected_candidate', {}).get('reason') != 'deadline_capped'
+
 def parse_and_prioritize_keywords_advanced(llm_result: str) -> list:
     """キーワード情報を詳細に保持する版"""
-    keywords = []
-    lines = llm_result.strip().split('\n')
-    
-    for line in lines:
+    extracted = []
+    for line in llm_result.strip().split('\n'):
         line = line.strip()
-        if not line or any(skip in line for skip in ['解析結果', '質問の', '以下の']):
+        if not line or any(skip in line for skip in KEYWORD_SKIP_MARKERS):
             continue
-            
-        import re
-        pattern = r'^([^(（]+)[（(]([^)）]+)[）)]'
-        match = re.match(pattern, line)
-        
+
+        match = KEYWORD_LINE_PATTERN.match(line)
         if match:
             keyword = match.group(1).strip()
             category = match.group(2).strip()
-            
-            if len(keyword) > 1 and keyword not in ['について', 'を', 'の', 'が', 'は']:
-                priority_score = calculate_priority_score(keyword, category)
-                keywords.append({
-                    'keyword': keyword,
-                    'category': category,
-                    'priority': priority_score,
-                    'length': len(keyword)
-                })
-                print(f"✅ Keyword: '{keyword}', Category: '{category}', Priority: {priority_score}")
+            if len(keyword) > 1 and keyword not in KEYWORD_STOPWORDS:
+                extracted.append((keyword, category))
+
+    # 抽出したキーワードを同じ版のルールでまとめて採点
+    keywords = []
+    for (keyword, category), priority_score in zip(extracted, keyword_priority.score_many(extracted)):
+        keywords.append({
+            'keyword': keyword,
+            'category': category,
+            'priority': priority_score,
+            'length': len(keyword)
+        })
+        print(f"✅ Keyword: '{keyword}', Category: '{category}', Priority: {priority_score}")
     
     if not keywords:
         print("⚠️ No keywords extracted from advanced parsing")
@@ -188,14 +235,30 @@ def parse_and_prioritize_keywords_advanced(llm_result: str) -> list:
     
     return keywords
 
-async def extract_search_keywords_with_llm(query: str) -> Tuple[str, float]:
+async def extract_search_keywords_with_llm(query: str,
+                                           profile_log: Optional[List[Dict[str, Any]]] = None,
+                                           trace: Optional[Dict[str, Any]] = None,
+                                           events: Optional[List[str]] = None,
+                                           filters: Optional[Dict[str, str]] = None) -> Tuple[str, float]:
     """スコアベースフォールバック対応版（LLM実行時間測定付き）"""
+    trace = trace if trace is not None else {}
     
     # セッションIDは従来通り
     session_id_match = re.search(r'[A-Z]+-\d+', query)
     if session_id_match:
         return session_id_match.group(), 0.0
     
+    # キーワード抽出＋フォールバック検索の結果はワーカー間で共有キャッシュ
+    # 採用されるキーワードは検索対象のイベントとフィルタによって変わる
+    cache_key = shared_cache.make_key(query, sorted(events) if events else None, filters or None)
+    if profile_log is None:
+        cached_keyword = await shared_cache.get_async("keywords", cache_key)
+        if cached_keyword is not None:
+            print(f"💾 Keyword cache hit: '{cached_keyword}'")
+            trace['keyword_cache_hit'] = True
+            return cached_keyword, 0.0
+    
+    set_stage("keyword_extraction")
     llm_keyword_start = time.time()
     
     extraction_prompt = f"""以下のユーザーの質問を形態素解析して、検索に有用なキーワードを抽出してください。
@@ -221,25 +284,31 @@ async def extract_search_keywords_with_llm(query: str) -> Tuple[str, float]:
 解析結果:"""
 
     try:
-        llm_result = await bedrock_client.generate_guarded_response(extraction_prompt)
+        llm_result = (await bedrock_client.generate_guarded_response(extraction_prompt, stage="keyword_extraction")).text
         llm_keyword_time = time.time() - llm_keyword_start
         print(f"🧠 LLM keyword extraction completed in {llm_keyword_time:.3f}s")
         print(f"🧠 LLM analysis result:\n{llm_result}")
         
         # 詳細なキーワード情報を取得
+        set_stage("keyword_parsing")
         keywords_with_scores = parse_and_prioritize_keywords_advanced(llm_result)
+        trace['keywords'] = [k['keyword'] for k in keywords_with_scores]
         
         if keywords_with_scores:
             # スコアベースフォールバック検索を実行（時間測定は内部で実行済み）
             search_results, selected_keyword, opensearch_time = await search_with_score_based_fallback(
-                query, keywords_with_scores
+                query, keywords_with_scores, profile_log, trace, events, filters
             )
             
             total_llm_time = llm_keyword_time  # キーワード抽出時間のみ
             print(f"🎯 Selected keyword after fallback: '{selected_keyword}' (LLM keyword time: {total_llm_time:.3f}s)")
+            if keyword_cacheable(trace):
+                await shared_cache.set_async("keywords", cache_key, selected_keyword)
             return selected_keyword, total_llm_time
         
         print("⚠️ No keywords extracted, using original query")
+        if keyword_cacheable(trace):
+            await shared_cache.set_async("keywords", cache_key, query)
         return query, llm_keyword_time
         
     except Exception as e:
@@ -247,10 +316,101 @@ async def extract_search_keywords_with_llm(query: str) -> Tuple[str, float]:
         print(f"❌ LLM extraction failed: {e} (time: {llm_keyword_time:.3f}s)")
         return query, llm_keyword_time
 
+def evaluate_speculative_results(query: str, results: Optional[list]) -> Tuple[bool, float, float]:
+    """投機的検索の結果を採用するか判定（最上位スコアと質問語の網羅率）"""
+    if not results:
+        return False, 0.0, 0.0
+    
+    top = results[0]
+    top_score = top['score'] or 0.0
+    
+    terms = {term.lower() for term in QUERY_TERM_PATTERN.findall(query)}
+    if not terms:
+        return False, top_score, 0.0
+    
+    source = top['source']
+    text_parts = [source.get('session_id', ''), source.get('title', ''), source.get('abstract', '')]
+    text_parts.extend(top.get('transcript_fragments') or [source.get('transcript_summary') or ''])
+    for speaker in source.get('speakers') or []:
+        text_parts.append(f"{speaker.get('name', '')} {speaker.get('company', '')}")
+    text = " ".join(text_parts).lower()
+    
+    coverage = sum(1 for term in terms if term in text) / len(terms)
+    accepted = top_score >= SPECULATIVE_MIN_SCORE and coverage >= SPECULATIVE_MIN_COVERAGE
+    return accepted, top_score, coverage
+
+async def search_for_answer(search_query: str, profile_log: Optional[List[Dict[str, Any]]], explain: bool,
+                            events: Optional[List[str]] = None,
+                            filters: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+    """回答生成用の検索（コンテキスト構築に必要なフィールドのみ取得）"""
+    return await federated_search(
+        search_query,
+        3,
+        events=events,
+        filters=filters,
+        profile_log=profile_log,
+        explain=explain,
+        source_fields=CONTEXT_SOURCE_FIELDS,
+        transcript_fragments=CONTEXT_TRANSCRIPT_FRAGMENTS
+    )
+
+def build_answer_prompt(context: str, message: str) -> str:
+    return f"""{context}
+
+質問: {message}
+
+以下の点を守って日本語で回答してください：
+- 必ず日本語で回答する
+- 丁寧で分かりやすい表現を使う
+- 参考資料がある場合は、その内容を基に回答する
+- 詳細内容がある場合は、その情報を積極的に活用する
+- 参考資料がない場合は、一般的な知識で回答する
+
+回答:"""
+
+def context_token_budget(message: str, prompt_limit: Optional[int]) -> int:
+    """参考資料に使えるトークン数（リクエストのトークン予算がある場合は質問文・指示文と出力の分を差し引く）"""
+    if prompt_limit is None:
+        return CONTEXT_TOKEN_BUDGET
+    available = max(prompt_limit - estimate_tokens(build_answer_prompt("", message)), 1)
+    return min(CONTEXT_TOKEN_BUDGET, available) if CONTEXT_TOKEN_BUDGET else available
+
+@router.get("/suggest")
+async def suggest_endpoint(q: str = Query(..., min_length=1, max_length=100), limit: int = Query(8, ge=1, le=20)):
+    """入力補完（セッションID・タイトル・講演者・企業）。インメモリの接頭辞インデックスのみを参照"""
+    suggest_start = time.perf_counter()
+    suggestions = suggest_index.suggest(q, limit)
+    return {
+        "query": q,
+        "suggestions": suggestions,
+        "took_ms": round((time.perf_counter() - suggest_start) * 1000, 3)
+    }
+
 @router.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, x_request_timeout: Optional[float] = Header(default=None)):
     # 全体処理時間の測定開始
     total_start = time.time()
+    # リクエストの締め切り: 各OpenSearch/Bedrock呼び出しは残り予算をタイムアウトとして使用し、
+    # 流入制御は待ち時間の見積もりがこれを超える場合に即座に503で返す
+    # X-Request-Timeout は短くする方向のみ有効（既定値を超える指定は既定値に丸める）
+    if x_request_timeout is not None and not (0 < x_request_timeout < math.inf):
+        raise HTTPException(status_code=400, detail="X-Request-Timeout は正の秒数で指定してください")
+    deadline = start_deadline(min(x_request_timeout or DEFAULT_REQUEST_TIMEOUT, DEFAULT_REQUEST_TIMEOUT))
+    # クエリログ用: キーワード・採用候補・試行回数などを記録
+    trace: Dict[str, Any] = {}
+    # プロファイラのサンプルに付ける段階（以降、処理の区切りごとに切り替える）
+    set_stage("request")
+    # LLM呼び出しの使用量（トークン数・費用）とトークン予算
+    usage = start_usage(request.token_budget)
+    
+    # 検索対象のイベント（省略時は設定された全イベント）
+    events = request.events or None
+    try:
+        resolve_indices(events)
+    except UnknownEventError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    if events:
+        trace['events'] = events
     
     try:
         message = request.message.strip()
@@ -260,18 +420,97 @@ async def chat_endpoint(request: ChatRequest):
         
         print(f"💬 User query: \"{message}\"")
         
-        # LLMを使った高度な構造化キーワード抽出（実行時間測定付き）
-        search_query, llm_keyword_time = await extract_search_keywords_with_llm(message)
-        print(f"🔍 Final search query: \"{search_query}\"")
-        
-        # OpenSearch検索の実行時間測定
-        opensearch_start = time.time()
-        search_results = await opensearch_client.search_with_transcript_content(
-            "aws_summit_sessions",
-            search_query,
-            3
+        # 構造化フィルタ: 明示指定を優先し、質問文中のトラック・日付・レベル・企業名で補完
+        filters = merge_filters(
+            request.filters.model_dump() if request.filters else None,
+            filter_vocabulary.parse(message)
         )
-        opensearch_time = time.time() - opensearch_start
+        if filters:
+            trace['filters'] = filters
+            print(f"🧩 Structured filters: {filters}")
+        
+        # プロファイルモード: 各OpenSearch呼び出しの内訳を段階別に記録
+        keyword_profile_log = [] if request.profile else None
+        answer_profile_log = [] if request.profile else None
+        speculative_profile_log = [] if request.profile else None
+        speculative_info = None
+        
+        # セッションID高速パス: ローカルマップから直接取得（キーワード抽出・OpenSearchをスキップ）
+        # セッションマップは既定イベントのみなので、イベントを限定した場合は既定イベントを含む時だけ使う
+        search_results = []
+        session_ids = session_store.extract_session_ids(message) if not events or DEFAULT_EVENT in events else []
+        if session_ids:
+            set_stage("session_lookup")
+            opensearch_start = time.time()
+            for session_id in session_ids:
+                hit = await session_store.lookup(session_id)
+                if hit:
+                    search_results.append(hit.to_dict())
+            opensearch_time = time.time() - opensearch_start
+        
+        if search_results:
+            search_query = ", ".join(result['source']['session_id'] for result in search_results)
+            llm_keyword_time = 0.0
+            search_method = "session_id_lookup"
+            trace['selected_candidate'] = {'keyword': search_query, 'position': 0, 'reason': 'session_id'}
+            print(f"🗂️ Session ID fast path: {search_query} ({opensearch_time * 1000:.3f}ms)")
+        else:
+            search_method = "hybrid_with_transcript"
+            search_results = None
+            speculative_results = None
+            
+            if deadline.allows("keyword_extraction"):
+                # LLMを使った高度な構造化キーワード抽出（実行時間測定付き）
+                keyword_task = asyncio.create_task(
+                    extract_search_keywords_with_llm(message, keyword_profile_log, trace, events, filters)
+                )
+                
+                if SPECULATIVE_RETRIEVAL_ENABLED:
+                    # 投機的検索: キーワード抽出と同時に元の質問で検索を開始
+                    set_stage("speculative_search")
+                    opensearch_start = time.time()
+                    try:
+                        speculative_results = await search_for_answer(message, speculative_profile_log, request.explain, events, filters)
+                    except Exception as e:
+                        print(f"⚠️ Speculative search failed: {e!r}")
+                    opensearch_time = time.time() - opensearch_start
+                    
+                    accepted, top_score, coverage = evaluate_speculative_results(message, speculative_results)
+                    speculative_info = {
+                        "accepted": accepted,
+                        "top_score": round(top_score, 4),
+                        "coverage": round(coverage, 3),
+                        "time": round(opensearch_time, 3)
+                    }
+                    print(f"🎲 Speculative search: accepted={accepted}, top_score={top_score:.4f}, coverage={coverage:.2f}")
+                    
+                    if accepted:
+                        # 十分な結果が得られたのでキーワード抽出を取り消して回答生成へ
+                        keyword_task.cancel()
+                        search_results = speculative_results
+                        search_query, llm_keyword_time = message, 0.0
+                        search_method = "speculative_raw_query"
+                        trace['selected_candidate'] = {'keyword': message, 'position': 0, 'reason': 'speculative'}
+                
+                if search_results is None:
+                    search_query, llm_keyword_time = await keyword_task
+            else:
+                # 予算不足: キーワード抽出を省略して元の質問で検索
+                deadline.degrade("skipped_keyword_extraction")
+                search_query, llm_keyword_time = message, 0.0
+            
+            if search_results is None:
+                print(f"🔍 Final search query: \"{search_query}\"")
+                
+                if search_query == message and speculative_results is not None:
+                    # 元の質問での検索は投機的検索で実行済み
+                    search_results = speculative_results
+                else:
+                    # OpenSearch検索の実行時間測定
+                    set_stage("answer_search")
+                    opensearch_start = time.time()
+                    search_results = await search_for_answer(search_query, answer_profile_log, request.explain, events, filters)
+                    opensearch_time = time.time() - opensearch_start
         
         print(f"📊 Found {len(search_results)} relevant documents (OpenSearch time: {opensearch_time:.3f}s)")
         
@@ -280,77 +519,58 @@ async def chat_endpoint(request: ChatRequest):
         if transcript_count > 0:
             print(f"📄 Including {transcript_count} results with detailed transcript content")
         
-        # 2. コンテキストを構築
-        context = ""
-        sources = []
+        suggest_index.record_hits(result['source'].get('session_id') for result in search_results)
         
-        if search_results:
-            context = "以下の情報を参考にして回答してください：\n\n"
+        sources = []
+        for result in search_results:
+            # transcript有無の情報をSourceに追加
+            source_title = result['source']['title']
+            if result.get('has_transcript'):
+                source_title += " [詳細内容あり]"
             
-            for index, result in enumerate(search_results):
-                context += f"【参考資料{index + 1}】\n"
-                context += f"タイトル: {result['source']['title']}\n"
-                
-                # AWS Summit用データ構造に対応
-                if 'abstract' in result['source']:
-                    context += f"概要: {result['source']['abstract']}\n"
-                
-                # 詳細な講演要約がある場合は優先的に使用
-                if 'transcript_summary' in result['source'] and result['source']['transcript_summary']:
-                    context += f"詳細内容: {result['source']['transcript_summary']}\n"
-                    print(f"📄 Added transcript summary for: {result['source']['title']}")
-                
-                if 'speakers' in result['source'] and result['source']['speakers']:
-                    speaker_names = []
-                    for speaker in result['source']['speakers']:
-                        speaker_names.append(f"{speaker['name']}（{speaker['company']}）")
-                    context += f"講演者: {', '.join(speaker_names)}\n"
-                
-                if 'track' in result['source']:
-                    context += f"トラック: {result['source']['track']}\n"
-                
-                if 'date' in result['source'] and 'start_time' in result['source']:
-                    context += f"開催日時: {result['source']['date']} {result['source']['start_time']}\n"
-                
-                context += "\n"
-                
-                # transcript有無の情報をSourceに追加
-                source_title = result['source']['title']
-                if result.get('has_transcript'):
-                    source_title += " [詳細内容あり]"
-                
-                sources.append(Source(
-                    title=source_title,
-                    score=f"{result['score']:.4f}"
-                ))
+            sources.append(Source(
+                title=source_title,
+                score=f"{result['score']:.4f}"
+            ))
+        
+        # 構造化回答の高速パス: セッションIDの講演者・日時・会場などの質問はフィールドからテンプレートで回答
+        fact_answer = answer_from_fields(message, search_results, session_ids) if search_method == "session_id_lookup" else None
+        
+        if fact_answer:
+            set_stage("fact_answer")
+            final_response = fact_answer.text
+            context_stats = None
+            llm_response_time = 0.0
+            answer_method = "structured_fields"
+            print(f"📇 Structured answer for {', '.join(fact_answer.session_ids)} ({', '.join(fact_answer.intents)}), Bedrock skipped")
         else:
-            context = "関連する参考資料が見つかりませんでした。一般的な知識で回答してください。\n\n"
+            # 2. コンテキストを構築（ドキュメントの版ごとに描画済みの断片を連結）
+            set_stage("context_build")
+            # トークン予算がある場合はキーワード抽出で使った分を差し引いた残りに収まるように削る
+            context, context_stats = context_renderer.build_context(
+                search_results, context_token_budget(message, usage.prompt_limit(MAX_OUTPUT_TOKENS))
+            )
+            if context_stats["trimmed"] or context_stats["dropped"]:
+                get_deadline().degrade("context_token_budget")
+                print(f"✂️ Context over budget: trimmed {context_stats['trimmed']}, dropped {context_stats['dropped']}")
         
-        # 3. LLMプロンプト構築
-        prompt = f"""{context}
-
-質問: {message}
-
-以下の点を守って日本語で回答してください：
-- 必ず日本語で回答する
-- 丁寧で分かりやすい表現を使う
-- 参考資料がある場合は、その内容を基に回答する
-- 詳細内容がある場合は、その情報を積極的に活用する
-- 参考資料がない場合は、一般的な知識で回答する
-
-回答:"""
+            # 3. LLMプロンプト構築
+            prompt = build_answer_prompt(context, message)
         
-        print(f"🤖 Generating response with context from {len(search_results)} sources")
+            print(f"🤖 Generating response with context from {context_stats['documents']} sources (~{context_stats['tokens']} tokens)")
         
-        # 4. LLM回答生成の実行時間測定
-        llm_response_start = time.time()
-        llm_result = await bedrock_client.generate_guarded_response(prompt)
-        llm_response_time = time.time() - llm_response_start
+            # 4. LLM回答生成の実行時間測定
+            set_stage("generation")
+            llm_response_start = time.time()
+            generation = await bedrock_client.generate_guarded_response(prompt)
+            llm_response_time = time.time() - llm_response_start
         
-        print(f"🤖 LLM response generated in {llm_response_time:.3f}s")
+            print(f"🤖 LLM response generated in {llm_response_time:.3f}s")
         
-        # 5. レスポンスの正規化
-        final_response = llm_result.strip() if isinstance(llm_result, str) else str(llm_result)
+            # 5. レスポンスの正規化
+            set_stage("response")
+            final_response = generation.text.strip()
+            answer_method = "llm"
         
         # 全体処理時間の計算
         total_time = time.time() - total_start
@@ -362,31 +582,115 @@ async def chat_endpoint(request: ChatRequest):
         print(f"   - OpenSearch time: {opensearch_time:.3f}s")
         print(f"   - LLM total time: {total_llm_time:.3f}s (keyword: {llm_keyword_time:.3f}s + response: {llm_response_time:.3f}s)")
         print(f"   - Total time: {total_time:.3f}s")
+        print(f"   - LLM tokens: {usage.input_tokens} in / {usage.output_tokens} out (${usage.cost_usd:.6f})")
+        
+        debug_info = {
+            "search_results_count": len(search_results),
+            "transcript_results_count": transcript_count,
+            "guardrail_applied": False,
+            "original_query": message,
+            "optimized_query": search_query,
+            "search_method": search_method,
+            "answer_method": answer_method,
+            "events": events or list(EVENT_INDICES),
+            "filters": filters,
+            "context": context_stats,
+            "performance": {
+                "opensearch_time": round(opensearch_time, 3),
+                "llm_time": round(total_llm_time, 3),
+                "llm_keyword_time": round(llm_keyword_time, 3),
+                "llm_response_time": round(llm_response_time, 3),
+                "total_time": round(total_time, 3),
+                "llm_usage": usage.summary()
+            }
+        }
+        
+        debug_info["deadline"] = {
+            "timeout": deadline.timeout,
+            "remaining": round(deadline.remaining(), 3),
+            "degradations": deadline.degradations
+        }
+        
+        if fact_answer:
+            debug_info["fact_answer"] = {"intents": fact_answer.intents, "session_ids": fact_answer.session_ids}
+        
+        if speculative_info:
+            debug_info["speculative"] = speculative_info
+        
+        if request.profile:
+            debug_info["profile"] = {
+                "speculative_searches": speculative_profile_log,
+                "keyword_fallback_searches": keyword_profile_log,
+                "answer_searches": answer_profile_log,
+                "llm": {
+                    "keyword_extraction_ms": round(llm_keyword_time * 1000, 3),
+                    "response_generation_ms": round(llm_response_time * 1000, 3)
+                }
+            }
+        
+        if request.explain:
+            debug_info["explanations"] = [
+                {"id": result['id'], "explanation": result.get('explanation')}
+                for result in search_results
+            ]
+        
+        trace['search_method'] = search_method
+        trace['answer_method'] = answer_method
+        trace['degradations'] = deadline.degradations
+        trace['llm_tokens'] = {"input": usage.input_tokens, "output": usage.output_tokens}
+        query_logger.record(
+            message,
+            trace,
+            {
+                "opensearch": opensearch_time,
+                "llm_keyword": llm_keyword_time,
+                "llm_response": llm_response_time,
+                "total": total_time
+            },
+            hit_ids=[result['id'] for result in search_results]
+        )
         
         return ChatResponse(
             success=True,
             response=final_response,
             sources=sources,
             context_used=len(search_results) > 0,
-            debug={
-                "search_results_count": len(search_results),
-                "transcript_results_count": transcript_count,
-                "guardrail_applied": False,
-                "original_query": message,
-                "optimized_query": search_query,
-                "search_method": "hybrid_with_transcript",
-                "performance": {
-                    "opensearch_time": round(opensearch_time, 3),
-                    "llm_time": round(total_llm_time, 3),
-                    "llm_keyword_time": round(llm_keyword_time, 3),
-                    "llm_response_time": round(llm_response_time, 3),
-                    "total_time": round(total_time, 3)
-                }
-            }
+            debug=debug_info
+        )
+        
+    except OverloadedError as error:
+        total_time = time.time() - total_start
+        print(f"🚦 Chat API shed: {error} (total time: {total_time:.3f}s)")
+        query_logger.record(request.message, trace, {"total": total_time}, status=503)
+        raise HTTPException(
+            status_code=503,
+            detail=str(error),
+            headers={"Retry-After": str(math.ceil(error.retry_after))}
+        )
+        
+    except TokenBudgetExceededError as error:
+        total_time = time.time() - total_start
+        print(f"🧾 Chat API token budget exceeded: {error} (total time: {total_time:.3f}s)")
+        query_logger.record(request.message, trace, {"total": total_time}, status=413)
+        raise HTTPException(status_code=413, detail=str(error))
+        
+    except (DeadlineExceededError, asyncio.TimeoutError) as error:
+        total_time = time.time() - total_start
+        print(f"⏳ Chat API deadline exceeded: {error!r} (total time: {total_time:.3f}s)")
+        query_logger.record(request.message, trace, {"total": total_time}, status=504)
+        raise HTTPException(
+            status_code=504,
+            detail=f"処理が締め切り（{deadline.timeout}秒）までに完了しませんでした"
         )
         
     except Exception as error:
         total_time = time.time() - total_start
+        query_logger.record(
+            request.message,
+            trace,
+            {"total": total_time},
+            status=error.status_code if isinstance(error, HTTPException) else 500
+        )
         print(f"❌ Chat API error: {error} (total time: {total_time:.3f}s)")
         raise HTTPException(
             status_code=500,
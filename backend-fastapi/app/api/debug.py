@@ -1,8 +1,22 @@
 # app/api/debug.py を修正
 from fastapi import APIRouter, HTTPException
-from app.services.opensearch_client import opensearch_client
-from typing import List, Dict, Any
+from fastapi.responses import PlainTextResponse
+from app.services.opensearch_client import opensearch_client, TRANSCRIPT_QUERY_CLAUSES
+from app.services.shared_cache import shared_cache
+from app.services.admission import admission_controller
+from app.services.vector_store import vector_store
+from app.services.change_feed import change_feed_tailer
+from app.services.context_renderer import context_renderer
+from app.services.suggest_index import suggest_index
+from app.services.query_filters import filter_vocabulary
+from app.services.keyword_priority import keyword_priority
+from app.services.index_schema import schema_manager
+from app.services.fallback_planner import fallback_planner
+from app.services.profiler import profiler, ProfilerBusyError, PROFILE_DEFAULT_INTERVAL_MS, PROFILE_MAX_SECONDS
+from app.services.federated_search import EVENT_INDICES, DEFAULT_INDEX, resolve_indices, UnknownEventError
+from typing import List, Dict, Any, Optional
 import os
+import asyncio
 
 router = APIRouter(prefix="/debug", tags=["debug"])
 
@@ -127,8 +141,8 @@ async def test_sony_search():
         "CUS-03"
     ]
     
-    # 正しいインデックス名を使用
-    index_name = "aws_summit_sessions"
+    # 既定イベントのインデックスを使用
+    index_name = DEFAULT_INDEX
     
     results = {}
     for query in test_queries:
@@ -155,45 +169,58 @@ async def test_sony_search():
     return results
 
 
+def preview(text: str, length: int = 200) -> str:
+    return text[:length] + "..." if len(text) > length else text
+
 @router.get("/search-details")
-async def search_with_details(query: str):
-    """検索結果の詳細情報を返す"""
+async def search_with_details(query: str, explain: bool = False, profile: bool = False, event: Optional[str] = None):
+    """検索結果の詳細情報を返す（チャットと同じハイブリッド検索クエリを使用）"""
     try:
-        index_name = "aws_summit_sessions"  # 正しいインデックス名を直接指定
-        client = await opensearch_client.initialize()
-        
-        search_body = {
-            "query": {
-                "multi_match": {
-                    "query": query,
-                    "fields": ["title", "abstract", "summary", "speakers.name", "speakers.company"],
-                    "type": "best_fields"
-                }
-            },
-            "size": 10,
-            "explain": True
-        }
+        index_name = resolve_indices([event])[event] if event else DEFAULT_INDEX
+    except UnknownEventError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        # チャットで実際に使用するクエリと同じものを構築（質問文から抽出した構造化フィルタを含む）
+        filters = filter_vocabulary.parse(query)
+        search_body = opensearch_client.build_transcript_search_query(query, size=10, filters=filters)
         
-        response = client.search(index=index_name, body=search_body)
+        # explain / profile は高コストなので指定された時だけ有効にする
+        response, profile_summary = await opensearch_client.execute_search(
+            index_name,
+            search_body,
+            profile=profile,
+            explain=explain,
+            clause_labels=TRANSCRIPT_QUERY_CLAUSES
+        )
         
         results = []
         for hit in response['hits']['hits']:
-            results.append({
-                "session_id": hit['_source'].get('session_id'),
-                "title": hit['_source'].get('title'),
+            source = hit.get('_source', {})
+            result = {
+                "session_id": source.get('session_id'),
+                "title": source.get('title'),
                 "score": hit['_score'],
-                "speakers": hit['_source'].get('speakers', []),
-                "summary_preview": hit['_source'].get('summary', '')[:200] + "..." if len(hit['_source'].get('summary', '')) > 200 else hit['_source'].get('summary', ''),
-                "abstract_preview": hit['_source'].get('abstract', '')[:200] + "..." if len(hit['_source'].get('abstract', '')) > 200 else hit['_source'].get('abstract', ''),
-            })
+                "speakers": source.get('speakers', []),
+                "summary_preview": preview(source.get('summary') or ''),
+                "abstract_preview": preview(source.get('abstract') or ''),
+            }
+            if explain:
+                result["explanation"] = hit.get('_explanation')
+            results.append(result)
         
-        return {
+        details = {
             "query": query,
             "index_used": index_name,
+            "filters": filters,
             "total_hits": response['hits']['total']['value'],
             "max_score": response['hits']['max_score'],
             "results": results
         }
+        if profile_summary:
+            details["profile"] = profile_summary
+        
+        return details
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in detailed search: {str(e)}")
 
@@ -202,7 +229,7 @@ async def search_with_details(query: str):
         """インデックスのマッピング構造を確認"""
         try:
             client = await opensearch_client.initialize()
-            mapping = client.indices.get_mapping(index="aws_summit_sessions")
+            mapping = client.indices.get_mapping(index=DEFAULT_INDEX)
             return mapping
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error getting mapping: {str(e)}")
@@ -212,11 +239,22 @@ async def get_index_mapping():
     """インデックスのマッピング構造を確認"""
     try:
         client = await opensearch_client.initialize()
-        mapping = client.indices.get_mapping(index="aws_summit_sessions")
+        mapping = client.indices.get_mapping(index=DEFAULT_INDEX)
         return mapping
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting mapping: {str(e)}")
 
+@router.get("/index-schema")
+async def get_index_schema(refresh: bool = False):
+    """コードで定義したマッピングとの差分・完全一致に使う keyword フィールド（refresh で読み込み直す）"""
+    try:
+        if refresh:
+            client = await opensearch_client.initialize()
+            await asyncio.to_thread(schema_manager.detect, client, EVENT_INDICES.values())
+        return schema_manager.status(EVENT_INDICES.values())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading index schema: {str(e)}")
+
 @router.get("/session-field-test/{session_id}")
 async def test_session_field(session_id: str):
     """セッションIDフィールドの検索テスト"""
@@ -235,7 +273,7 @@ async def test_session_field(session_id: str):
         for i, query in enumerate(test_queries):
             try:
                 response = client.search(
-                    index="aws_summit_sessions",
+                    index=DEFAULT_INDEX,
                     body={"query": query, "size": 5}
                 )
                 results[f"pattern_{i+1}"] = {
@@ -249,3 +287,85 @@ async def test_session_field(session_id: str):
         return results
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error testing session field: {str(e)}")
+
+@router.get("/cache")
+async def get_cache_status():
+    """ワーカー間共有キャッシュの状態"""
+    return shared_cache.summary()
+
+@router.delete("/cache")
+async def clear_cache(namespace: Optional[str] = None):
+    """共有キャッシュを削除（namespace: keywords / search / llm / negative）"""
+    shared_cache.clear(namespace)
+    return {"cleared": namespace or "all"}
+
+@router.get("/admission")
+async def get_admission_status():
+    """段階ごとの同時実行数・待ち行列の状態"""
+    return admission_controller.status()
+
+@router.get("/vector-store")
+async def get_vector_store_status():
+    """ローカルベクトルストアの状態"""
+    return vector_store.summary()
+
+@router.get("/change-feed")
+async def get_change_feed_status():
+    """変更ログの適用状況（このワーカー）"""
+    return change_feed_tailer.status()
+
+@router.get("/context-cache")
+async def get_context_cache_status():
+    """描画済みコンテキストブロックのキャッシュ状態（このワーカー）"""
+    return context_renderer.summary()
+
+@router.get("/events")
+async def get_events():
+    """検索対象のイベントとインデックス（エイリアス）"""
+    return {"events": EVENT_INDICES, "default_index": DEFAULT_INDEX}
+
+@router.get("/suggest-index")
+async def get_suggest_index_status():
+    """入力補完インデックスの状態（このワーカー）"""
+    return suggest_index.summary()
+
+@router.get("/keyword-rules")
+async def get_keyword_rules(keyword: Optional[str] = None, category: Optional[str] = None):
+    """キーワード優先度ルールの状態（keyword・category を指定するとそのスコアも返す）"""
+    result = {"rules": keyword_priority.summary()}
+    if keyword and category:
+        result["score"] = keyword_priority.score(keyword, category)
+    return result
+
+@router.get("/fallback-stats")
+async def get_fallback_stats():
+    """フォールバック検索の分類別・位置別の成功率と1リクエストあたりの試行回数（このワーカー）"""
+    return fallback_planner.summary()
+
+@router.get("/profile")
+async def get_profile_status():
+    """サンプリングプロファイラの状態と段階別・関数別のサンプル数（このワーカー）"""
+    return profiler.summary()
+
+@router.post("/profile/start")
+async def start_profile(interval_ms: float = PROFILE_DEFAULT_INTERVAL_MS, duration: float = PROFILE_MAX_SECONDS,
+                        mode: str = "wall", include_idle: bool = False):
+    """シグナルタイマーによるスタックのサンプリングを開始（duration 秒で自動停止、上限 PROFILE_MAX_SECONDS）"""
+    try:
+        profiler.start(interval_ms, duration, mode, include_idle)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return profiler.summary()
+
+@router.post("/profile/stop", response_class=PlainTextResponse)
+async def stop_profile():
+    """計測を停止して collapsed stack 形式で返す（flamegraph.pl / speedscope にそのまま渡せる）"""
+    profiler.stop()
+    return profiler.collapsed()
+
+@router.get("/profile/collapsed", response_class=PlainTextResponse)
+async def get_profile_collapsed():
+    """計測中・直近の計測結果の collapsed stack"""
+    return profiler.collapsed()
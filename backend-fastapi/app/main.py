@@ -1,7 +1,19 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from app.api.chat import router as chat_router
-from app.api import chat, debug  # debug をインポート
+from app.api import chat, debug, admin  # debug をインポート
+from app.services.session_store import session_store, refresh_interval
+from app.services.change_feed import change_feed_tailer, poll_interval
+from app.services.suggest_index import suggest_index
+from app.services.query_filters import filter_vocabulary
+from app.services.keyword_priority import keyword_priority
+from app.services.index_schema import schema_manager
+from app.services.opensearch_client import opensearch_client
+from app.services.federated_search import EVENT_INDICES
+from app.services.metrics import metrics
+from app.services.ingestion import bulk_writer
 
 # FastAPIアプリを作成
 app = FastAPI(
@@ -31,9 +43,90 @@ async def root():
         "phase": "Phase 2: Advanced RAG"
     }
 
+def rebuild_suggest_index():
+    sources = [hit.session.source for hit in session_store.documents.values()]
+    suggest_index.build(sources)
+    # 質問文から拾う構造化フィルタの値も同じコーパスから更新
+    filter_vocabulary.build(sources)
+
+async def refresh_session_store_periodically():
+    """投入スクリプトが追加した拡張ドキュメントを定期的にセッションマップへ反映"""
+    while True:
+        await asyncio.sleep(refresh_interval())
+        try:
+            updated = await session_store.refresh()
+            # 新しいセッションと人気度の変化を入力補完に反映
+            if updated or suggest_index.dirty:
+                rebuild_suggest_index()
+        except Exception as e:
+            print(f"⚠️ Session store refresh failed: {e}")
+
+async def tail_change_feed():
+    """インジェストが記録した変更を差分としてマップ・キャッシュ・ローカルインデックスへ反映"""
+    while True:
+        await asyncio.sleep(poll_interval())
+        try:
+            await change_feed_tailer.poll()
+        except Exception as e:
+            print(f"⚠️ Change feed poll failed: {e}")
+
+@app.on_event("startup")
+async def detect_index_mappings():
+    """検索対象インデックスの実際のマッピングを読み込み、keyword フィールドの完全一致を term 句にする"""
+    try:
+        client = await opensearch_client.initialize()
+        await asyncio.to_thread(schema_manager.detect, client, EVENT_INDICES.values())
+    except Exception as e:
+        # 読み込めない場合は text / keyword の両方で照合する従来のクエリのまま
+        print(f"⚠️ Index mapping detection failed: {e}")
+
+@app.on_event("startup")
+async def warm_up_session_store():
+    """セッションID高速パス用のマップを起動時に構築"""
+    try:
+        # 全件読み込み中に記録された変更も取りこぼさないよう、読み込み前の位置から追いかける
+        change_feed_tailer.start_from_latest()
+    except Exception as e:
+        print(f"⚠️ Change feed unavailable: {e}")
+    try:
+        await session_store.warm_up()
+    except Exception as e:
+        # 読み込めなくても検索時のフォールバックで動作する
+        print(f"⚠️ Session store warm-up failed: {e}")
+    rebuild_suggest_index()
+    asyncio.create_task(refresh_session_store_periodically())
+    asyncio.create_task(tail_change_feed())
+
+@app.on_event("startup")
+async def load_keyword_priority_rules():
+    """キーワード優先度ルールを起動時に読み込んで参照表を作る（以降はファイル更新時に自動で再読み込み）"""
+    try:
+        keyword_priority.current()
+    except Exception as e:
+        print(f"⚠️ Keyword priority rules load failed: {e}")
+
+@app.on_event("startup")
+async def start_bulk_writer():
+    """管理APIで受け付けたドキュメントのバルク書き込みを開始"""
+    bulk_writer.start()
+
+@app.on_event("shutdown")
+async def stop_bulk_writer():
+    """待ち行列に残っているドキュメントを書き込んでから終了"""
+    try:
+        await bulk_writer.stop()
+    except Exception as e:
+        print(f"⚠️ Bulk writer shutdown flush failed: {e}")
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "fastapi"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus形式のメトリクス（ワーカープロセス単位）"""
+    return metrics.render()
+
 app.include_router(chat.router)
 app.include_router(debug.router)  # この行を追加
+app.include_router(admin.router)
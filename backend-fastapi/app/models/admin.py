@@ -0,0 +1,22 @@
+from pydantic import BaseModel
+from typing import List, Optional, Dict, Any
+
+class IngestDocument(BaseModel):
+    session_id: str
+    # セッションドキュメント全体（_source と同じ形式）。省略時は既存のセッションに講演要約を付けた拡張版を作る
+    source: Optional[Dict[str, Any]] = None
+    transcript_summary: Optional[str] = None
+
+class IngestRequest(BaseModel):
+    documents: List[IngestDocument]
+    # 書き込み先のイベント（OPENSEARCH_INDICES のイベント名）。省略時は既定のイベント
+    event: Optional[str] = None
+
+class IngestResponse(BaseModel):
+    accepted: int
+    queue_depth: int
+
+class DeleteResponse(BaseModel):
+    session_id: str
+    deleted: int
+    event: Optional[str] = None
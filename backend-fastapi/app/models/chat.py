@@ -1,8 +1,25 @@
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 
+class SearchFilters(BaseModel):
+    # 検索対象を絞り込む条件（スコアには影響しない）。値はコーパス上の表記に合わせる
+    track: Optional[str] = None
+    date: Optional[str] = None
+    level: Optional[str] = None
+    company: Optional[str] = None
+
 class ChatRequest(BaseModel):
     message: str
+    # OpenSearchの各検索を profile: true で実行し、段階別の内訳を debug に含める
+    profile: bool = False
+    # 検索スコアの explain を有効にする（高コストなので必要な時だけ）
+    explain: bool = False
+    # 検索対象のイベント（OPENSEARCH_INDICES のイベント名、省略時は全イベント）
+    events: Optional[List[str]] = None
+    # 構造化フィルタ（省略した項目は質問文から抽出した値を使う）
+    filters: Optional[SearchFilters] = None
+    # このリクエストのLLM入出力トークンの上限（省略時は LLM_REQUEST_TOKEN_BUDGET）
+    token_budget: Optional[int] = None
 
 class Source(BaseModel):
     title: str
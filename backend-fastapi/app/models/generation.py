@@ -0,0 +1,28 @@
+from dataclasses import dataclass, asdict
+from typing import Any, Dict
+
+@dataclass(slots=True)
+class GenerationResult:
+    """1回のLLM呼び出しの結果（本文とBedrockの使用量メタデータ）"""
+    text: str
+    model_id: str
+    stage: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    latency: float = 0.0
+    # プライマリモデルが失敗してフォールバックモデルで生成した
+    fallback: bool = False
+    # 共有キャッシュから返した（モデルは呼んでいないので使用量は 0）
+    cached: bool = False
+    cost_usd: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        del data["text"]
+        data["latency"] = round(self.latency, 3)
+        data["cost_usd"] = round(self.cost_usd, 6)
+        return data
@@ -0,0 +1,134 @@
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+@dataclass(slots=True)
+class Speaker:
+    name: str = ""
+    title: str = ""
+    company: str = ""
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Speaker":
+        return cls(data.get('name') or "", data.get('title') or "", data.get('company') or "")
+
+@dataclass(slots=True)
+class Session:
+    """_source を保持するセッション（コピーせずに参照し、よく使うフィールドを型付きで公開）
+
+    encoded（JSONのバイト列）から作った場合は最初にフィールドを参照した時点でデコードする
+    各プロパティは呼び出しを重ねないように _source を直接参照する（デコード前のみ source を経由）
+    """
+    _source: Optional[Dict[str, Any]] = None
+    _encoded: Optional[Union[bytes, memoryview]] = field(default=None, repr=False)
+    _speakers: Optional[Tuple[Speaker, ...]] = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def from_encoded(cls, encoded: Union[bytes, memoryview]) -> "Session":
+        return cls(_encoded=encoded)
+
+    @property
+    def source(self) -> Dict[str, Any]:
+        source = self._source
+        if source is None:
+            source = self._source = json.loads(bytes(self._encoded)) if self._encoded is not None else {}
+            self._encoded = None
+        return source
+
+    def get(self, key: str, default: Any = None) -> Any:
+        source = self._source
+        return (source if source is not None else self.source).get(key, default)
+
+    @property
+    def session_id(self) -> str:
+        source = self._source
+        return (source if source is not None else self.source).get('session_id') or ""
+
+    @property
+    def title(self) -> str:
+        source = self._source
+        return (source if source is not None else self.source).get('title') or ""
+
+    @property
+    def abstract(self) -> Optional[str]:
+        source = self._source
+        return (source if source is not None else self.source).get('abstract')
+
+    @property
+    def track(self) -> Optional[str]:
+        source = self._source
+        return (source if source is not None else self.source).get('track')
+
+    @property
+    def date(self) -> Optional[str]:
+        source = self._source
+        return (source if source is not None else self.source).get('date')
+
+    @property
+    def start_time(self) -> Optional[str]:
+        source = self._source
+        return (source if source is not None else self.source).get('start_time')
+
+    @property
+    def transcript_summary(self) -> Optional[str]:
+        source = self._source
+        return (source if source is not None else self.source).get('transcript_summary')
+
+    @property
+    def speakers(self) -> Tuple[Speaker, ...]:
+        """最初の参照時に1回だけ作る（参照されないヒットには講演者オブジェクトを作らない）"""
+        speakers = self._speakers
+        if speakers is None:
+            speakers = self._speakers = tuple([
+                Speaker(data.get('name') or "", data.get('title') or "", data.get('company') or "")
+                for data in self.get('speakers') or ()
+            ])
+        return speakers
+
+@dataclass(slots=True)
+class SearchHit:
+    """保存済みのドキュメント1件（セッションマップ・ローカルインデックス）
+
+    OpenSearchの検索結果は辞書のまま扱う（デコード済みの _source を包むだけでは割り当て・処理時間とも
+    辞書より多い、scripts/benchmark_search_hits.py）。検索パイプラインには to_dict() で渡す
+    """
+    id: str
+    score: Optional[float]
+    session: Session
+    transcript_fragments: Optional[List[str]] = None
+    has_transcript: bool = False
+    explanation: Optional[Dict[str, Any]] = None
+    # 複数イベントの統合検索時のみ設定
+    event: Optional[str] = None
+    normalized_score: Optional[float] = None
+
+    @classmethod
+    def from_source(cls, doc_id: str, score: Optional[float], source: Dict[str, Any]) -> "SearchHit":
+        return cls(doc_id, score, Session(source), has_transcript=bool(source.get('transcript_summary')))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """キャッシュ・APIレスポンス用（従来の {'id', 'score', 'source'} 形式）"""
+        data: Dict[str, Any] = {'id': self.id, 'score': self.score, 'source': self.session.source}
+        if self.transcript_fragments:
+            data['transcript_fragments'] = self.transcript_fragments
+        if self.has_transcript:
+            data['has_transcript'] = True
+        if self.explanation is not None:
+            data['explanation'] = self.explanation
+        if self.event is not None:
+            data['event'] = self.event
+            data['normalized_score'] = self.normalized_score
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SearchHit":
+        return cls(
+            data['id'],
+            data.get('score'),
+            Session(data.get('source') or {}),
+            transcript_fragments=data.get('transcript_fragments'),
+            has_transcript=bool(data.get('has_transcript')),
+            explanation=data.get('explanation'),
+            event=data.get('event'),
+            normalized_score=data.get('normalized_score')
+        )
@@ -0,0 +1,168 @@
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from app.services.metrics import metrics
+from app.services.deadline import get_deadline
+
+metrics.describe("rag_admission_admitted_total", "Requests admitted per pipeline stage")
+metrics.describe("rag_admission_shed_total", "Requests shed per pipeline stage and reason")
+metrics.describe("rag_admission_queue_depth", "Requests waiting per pipeline stage")
+metrics.describe("rag_admission_in_flight", "Requests executing per pipeline stage")
+metrics.describe("rag_admission_service_time_seconds", "EWMA service time per pipeline stage")
+
+class OverloadedError(Exception):
+    """過負荷のため受け付けられない（503 + Retry-After で返す）"""
+    def __init__(self, stage: str, retry_after: float, reason: str):
+        super().__init__(f"{stage} stage overloaded ({reason})")
+        self.stage = stage
+        self.retry_after = retry_after
+        self.reason = reason
+
+class StageLimiter:
+    """パイプラインの1段階（OpenSearch / Bedrock）の同時実行数と待ち行列を制限"""
+    def __init__(self, name: str, concurrency: int, max_queue: int, initial_service_time: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiters: deque = deque()
+        # 1件あたりの処理時間の指数移動平均（待ち時間の見積もりに使用）
+        self.service_time = initial_service_time
+
+    def estimated_wait(self) -> float:
+        """今から並んだ場合の待ち時間の見積もり"""
+        if self.in_flight < self.concurrency and not self.waiters:
+            return 0.0
+        rounds = math.ceil((len(self.waiters) + 1) / self.concurrency)
+        return rounds * self.service_time
+
+    def _shed(self, reason: str):
+        metrics.inc("rag_admission_shed_total", stage=self.name, reason=reason)
+        retry_after = max(1.0, self.estimated_wait())
+        print(f"🚦 Shedding {self.name} request ({reason}, queue: {len(self.waiters)}, retry after {retry_after:.1f}s)")
+        raise OverloadedError(self.name, retry_after, reason)
+
+    async def acquire(self, deadline: Optional[float] = None):
+        if self.in_flight < self.concurrency and not self.waiters:
+            self.in_flight += 1
+            metrics.inc("rag_admission_admitted_total", stage=self.name)
+            return
+
+        if len(self.waiters) >= self.max_queue:
+            self._shed("queue_full")
+
+        # 待ち時間の見積もりが締め切りを超えるなら並ばずに即座に失敗させる
+        if deadline is not None and time.monotonic() + self.estimated_wait() > deadline:
+            self._shed("deadline")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self._shed("deadline")
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        metrics.inc("rag_admission_admitted_total", stage=self.name)
+
+    def _abandon(self, waiter: asyncio.Future):
+        if waiter.done() and not waiter.cancelled():
+            # 枠を譲り受けた直後にキャンセルされた場合は次へ渡す
+            self.release()
+            return
+        waiter.cancel()
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, service_time: Optional[float] = None):
+        if service_time is not None:
+            self.service_time = 0.8 * self.service_time + 0.2 * service_time
+
+        # 待機中のリクエストに枠をそのまま引き渡す
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+class SlotLease:
+    """確保した実行枠を使っている処理（枠の解放をこれらの完了まで遅らせる）"""
+    def __init__(self):
+        self.futures: List[asyncio.Future] = []
+
+    def hold_until(self, future: asyncio.Future):
+        self.futures.append(future)
+
+class AdmissionController:
+    """段階ごとの流入制御。キャッシュヒットやセッションID高速パスは制限の対象外"""
+    def __init__(self):
+        self.limiters: Dict[str, StageLimiter] = {
+            "opensearch": StageLimiter(
+                "opensearch",
+                concurrency=int(os.getenv('OPENSEARCH_MAX_CONCURRENCY', '20')),
+                max_queue=int(os.getenv('OPENSEARCH_MAX_QUEUE', '100')),
+                initial_service_time=0.1
+            ),
+            "bedrock": StageLimiter(
+                "bedrock",
+                concurrency=int(os.getenv('BEDROCK_MAX_CONCURRENCY', '10')),
+                max_queue=int(os.getenv('BEDROCK_MAX_QUEUE', '50')),
+                initial_service_time=3.0
+            ),
+        }
+        metrics.register_gauge("rag_admission_queue_depth", lambda: self._gauge(lambda l: len(l.waiters)))
+        metrics.register_gauge("rag_admission_in_flight", lambda: self._gauge(lambda l: l.in_flight))
+        metrics.register_gauge("rag_admission_service_time_seconds", lambda: self._gauge(lambda l: round(l.service_time, 4)))
+
+    def _gauge(self, value_of):
+        return {(("stage", name),): float(value_of(limiter)) for name, limiter in self.limiters.items()}
+
+    @asynccontextmanager
+    async def slot(self, stage: str):
+        """段階の実行枠を確保（現在のリクエストの締め切りを考慮）
+
+        SlotLease.hold_until に渡した処理（タイムアウト後も止められないスレッドなど）が
+        終わるまでは、ブロックを抜けても枠を解放しない
+        """
+        limiter = self.limiters[stage]
+        deadline = get_deadline()
+        await limiter.acquire(deadline.expires_at if deadline else None)
+        start = time.time()
+        lease = SlotLease()
+        try:
+            yield lease
+        finally:
+            running = [future for future in lease.futures if not future.done()]
+            if running:
+                print(f"🚦 {stage} slot held until {len(running)} abandoned call(s) finish")
+                asyncio.gather(*running, return_exceptions=True).add_done_callback(
+                    lambda _: limiter.release(time.time() - start)
+                )
+            else:
+                limiter.release(time.time() - start)
+
+    def status(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {
+                "in_flight": limiter.in_flight,
+                "queue_depth": len(limiter.waiters),
+                "concurrency": limiter.concurrency,
+                "max_queue": limiter.max_queue,
+                "service_time": round(limiter.service_time, 4),
+                "estimated_wait": round(limiter.estimated_wait(), 4)
+            }
+            for name, limiter in self.limiters.items()
+        }
+
+# シングルトンインスタンス
+admission_controller = AdmissionController()
@@ -1,25 +1,148 @@
 import os
+import math
 import boto3
 import json
-from typing import Union, Dict, Any
+import time
+import asyncio
+from botocore.config import Config
+from typing import Union, Dict, Any, List, Optional, Sequence, Tuple
+from app.models.generation import GenerationResult
+from app.services.shared_cache import shared_cache
+from app.services.admission import admission_controller, SlotLease
+from app.services.deadline import stage_timeout, stage_allowed, get_deadline, STAGE_MINIMUMS
+from app.services.embedding_cache import embedding_cache, text_hash, normalize_text
+from app.services.context_renderer import estimate_tokens
+from app.services.llm_usage import check_prompt_budget, record_generation, estimate_cost
+from app.services.metrics import metrics
+from app.services.profiler import in_stage
+
+# 回答生成に使用するモデル
+PRIMARY_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+FALLBACK_MODEL_ID = "anthropic.claude-v2:1"
+# 回答の最大トークン数（トークン予算の確認でも出力分として差し引く）
+MAX_OUTPUT_TOKENS = 1000
+# 埋め込みモデル（Phase 1 の TitanEmbeddings と同じ）
+EMBEDDING_MODEL_ID = os.getenv('EMBEDDING_MODEL_ID', "amazon.titan-embed-text-v1")
+EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', '4'))
+BEDROCK_CONNECT_TIMEOUT = float(os.getenv('BEDROCK_CONNECT_TIMEOUT_SECONDS', '3'))
+BEDROCK_READ_TIMEOUT = float(os.getenv('BEDROCK_READ_TIMEOUT_SECONDS', '30'))
 
 class BedrockClient:
     def __init__(self):
         self.client = None
+        # 読み取りタイムアウト（秒） → 締め切りのあるリクエスト用のクライアント
+        self.budget_clients: Dict[int, Any] = {}
+        
+    @staticmethod
+    def _create_client(read_timeout: float, max_attempts: int):
+        return boto3.client(
+            'bedrock-runtime',
+            region_name=os.getenv('AWS_REGION', 'ap-northeast-1'),
+            config=Config(
+                connect_timeout=min(BEDROCK_CONNECT_TIMEOUT, read_timeout),
+                read_timeout=read_timeout,
+                retries={'max_attempts': max_attempts}
+            )
+        )
         
     async def initialize(self):
         if self.client:
             return self.client
             
-        self.client = boto3.client(
-            'bedrock-runtime',
-            region_name=os.getenv('AWS_REGION', 'ap-northeast-1')
-        )
+        # 既定のタイムアウト（60秒 + リトライ）では1リクエストが数分かかりうるので上限を設定
+        self.client = self._create_client(BEDROCK_READ_TIMEOUT, int(os.getenv('BEDROCK_MAX_ATTEMPTS', '2')))
         return self.client
+    
+    def _client_for(self, timeout: Optional[float]):
+        """残り予算を読み取りタイムアウトにしたクライアント（秒単位に切り上げてキャッシュ）
+
+        asyncio のタイムアウトではスレッド上の boto3 の呼び出しを止められないため、
+        呼び出し自体が予算内で終わるようにする（再試行すると予算を超えるので再試行しない）
+        """
+        if timeout is None:
+            return self.client
+        seconds = max(1, min(math.ceil(timeout), math.ceil(BEDROCK_READ_TIMEOUT)))
+        client = self.budget_clients.get(seconds)
+        if client is None:
+            client = self.budget_clients[seconds] = self._create_client(float(seconds), 0)
+        return client
+        
+    async def generate_guarded_response(self, prompt: str, stage: str = "generation") -> GenerationResult:
+        """Claude 3 Haiku を使用した高速回答生成（同一プロンプトの結果はワーカー間で共有キャッシュ）
+        
+        stage はリクエストの締め切りから時間を配分する段階名（keyword_extraction / generation）
+        結果には入出力トークン数・使用モデル・フォールバック有無・所要時間を含め、リクエストの使用量に加算する
+        """
+        cache_key = shared_cache.make_key(PRIMARY_MODEL_ID, prompt)
+        cached_text = await shared_cache.get_async("llm", cache_key)
+        if cached_text is not None:
+            print(f"💾 LLM cache hit ({len(cached_text)} chars)")
+            result = GenerationResult(cached_text, PRIMARY_MODEL_ID, stage, cached=True)
+            record_generation(result, outcome="cache_hit")
+            return result
         
-    async def generate_guarded_response(self, prompt: str) -> str:
-        """Claude 3 Haiku を使用した高速回答生成"""
-        client = await self.initialize()
+        # 予算を超えるプロンプトは送信前に拒否（キャッシュ済みの場合はトークンを消費しないので対象外）
+        check_prompt_budget(stage, estimate_tokens(prompt), MAX_OUTPUT_TOKENS)
+        
+        async with admission_controller.slot("bedrock") as lease:
+            result = await self._invoke_with_fallback(prompt, stage, lease)
+        record_generation(result)
+        print(f"🧾 {stage}: {result.input_tokens} in / {result.output_tokens} out tokens with {result.model_id} "
+              f"(${result.cost_usd:.6f}, {result.latency:.3f}s{', fallback' if result.fallback else ''})")
+        await shared_cache.set_async("llm", cache_key, result.text)
+        return result
+    
+    def _invoke_model(self, model_id: str, body: Dict[str, Any], client=None) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """invoke_model を呼び出してレスポンス本文とHTTPヘッダーを返す（ブロッキング、スレッドで実行）"""
+        response = (client or self.client).invoke_model(
+            modelId=model_id,
+            body=json.dumps(body)
+        )
+        return json.loads(response['body'].read()), response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    
+    def _invoke_model_json(self, model_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        """invoke_model を呼び出してレスポンス本文をデコード（ブロッキング、スレッドで実行）"""
+        return self._invoke_model(model_id, body)[0]
+    
+    async def _invoke_model_with_timeout(self, model_id: str, body: Dict[str, Any], stage: str,
+                                         lease: Optional[SlotLease] = None) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """締め切りの残り予算をタイムアウトとしてモデルを呼び出す
+
+        タイムアウトしてもスレッドは止まらないので、実行枠（lease）はスレッドの終了まで保持する
+        """
+        timeout = stage_timeout(stage)
+        call = asyncio.ensure_future(
+            asyncio.to_thread(in_stage(self._invoke_model), model_id, body, self._client_for(timeout))
+        )
+        # 待つのをやめた呼び出しの例外を回収（未回収の警告を出さない）
+        call.add_done_callback(lambda future: future.cancelled() or future.exception())
+        if lease is not None:
+            lease.hold_until(call)
+        return await asyncio.wait_for(asyncio.shield(call), timeout)
+    
+    @staticmethod
+    def _usage(response_body: Dict[str, Any], headers: Dict[str, str]) -> Tuple[int, int]:
+        """入出力トークン数（Messages API は本文の usage、旧形式はBedrockのレスポンスヘッダー）"""
+        usage = response_body.get('usage') or {}
+        input_tokens = usage.get('input_tokens', headers.get('x-amzn-bedrock-input-token-count', 0))
+        output_tokens = usage.get('output_tokens', headers.get('x-amzn-bedrock-output-token-count', 0))
+        return int(input_tokens), int(output_tokens)
+    
+    def _result(self, text: str, model_id: str, stage: str, response_body: Dict[str, Any],
+                headers: Dict[str, str], started: float, fallback: bool = False) -> GenerationResult:
+        input_tokens, output_tokens = self._usage(response_body, headers)
+        return GenerationResult(
+            text, model_id, stage,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            latency=time.time() - started,
+            fallback=fallback,
+            cost_usd=estimate_cost(model_id, input_tokens, output_tokens)
+        )
+    
+    async def _invoke_with_fallback(self, prompt: str, stage: str = "generation",
+                                    lease: Optional[SlotLease] = None) -> GenerationResult:
+        await self.initialize()
         
         # Claude 3 Haikuのメッセージ形式
         body = {
@@ -29,53 +152,91 @@ class BedrockClient:
                     "content": prompt
                 }
             ],
-            "max_tokens": 1000,
+            "max_tokens": MAX_OUTPUT_TOKENS,
             "temperature": 0.1,
             "top_p": 0.9,
             "anthropic_version": "bedrock-2023-05-31"
         }
         
+        started = time.time()
         try:
             print(f"⚡ Calling Claude 3 Haiku...")
-            response = client.invoke_model(
-                modelId="anthropic.claude-3-haiku-20240307-v1:0",
-                body=json.dumps(body)
-            )
-            
-            response_body = json.loads(response['body'].read())
+            response_body, headers = await self._invoke_model_with_timeout(PRIMARY_MODEL_ID, body, stage, lease)
             
             # Claude 3 Haikuのレスポンス形式
             if 'content' in response_body and len(response_body['content']) > 0:
-                return response_body['content'][0]['text']
+                text = response_body['content'][0]['text']
             else:
                 print(f"⚠️ Unexpected Claude 3 Haiku response format: {response_body}")
-                return str(response_body)
+                text = str(response_body)
+            return self._result(text, PRIMARY_MODEL_ID, stage, response_body, headers, started)
             
         except Exception as error:
-            print(f"❌ Error generating response with Claude 3 Haiku: {error}")
+            print(f"❌ Error generating response with Claude 3 Haiku: {error!r}")
+            metrics.inc("rag_llm_calls_total", model=PRIMARY_MODEL_ID, stage=stage, outcome="error")
+            
+            # フォールバックも呼び出し元の段階の予算内で実行する（後続の段階の分は残す）
+            # 残り時間が少ない場合は低速な Claude v2:1 へのフォールバックを省略
+            if not stage_allowed(stage, STAGE_MINIMUMS["model_fallback"]):
+                get_deadline().degrade("skipped_model_fallback")
+                raise error
+            
             print(f"   Attempting fallback to Claude v2:1...")
             
             # フォールバック: Claude v2:1
             try:
                 fallback_body = {
                     "prompt": f"\n\nHuman: {prompt}\n\nAssistant:",
-                    "max_tokens_to_sample": 1000,
+                    "max_tokens_to_sample": MAX_OUTPUT_TOKENS,
                     "temperature": 0.1,
                     "top_p": 0.9,
                 }
                 
-                fallback_response = client.invoke_model(
-                    modelId="anthropic.claude-v2:1",
-                    body=json.dumps(fallback_body)
+                fallback_response_body, fallback_headers = await self._invoke_model_with_timeout(
+                    FALLBACK_MODEL_ID, fallback_body, stage, lease
                 )
-                
-                fallback_response_body = json.loads(fallback_response['body'].read())
                 print(f"✅ Fallback to Claude v2:1 successful")
-                return fallback_response_body['completion']
+                return self._result(
+                    fallback_response_body['completion'], FALLBACK_MODEL_ID, stage,
+                    fallback_response_body, fallback_headers, started, fallback=True
+                )
                 
             except Exception as fallback_error:
                 print(f"❌ Both Claude 3 Haiku and Claude v2:1 failed: {fallback_error}")
+                metrics.inc("rag_llm_calls_total", model=FALLBACK_MODEL_ID, stage=stage, outcome="error")
                 raise fallback_error
 
+    async def embed_texts(self, texts: Sequence[str], model_id: str = EMBEDDING_MODEL_ID) -> List[List[float]]:
+        """テキストをまとめて埋め込み（キャッシュ済みのテキストはBedrockを呼ばない）"""
+        await self.initialize()
+        
+        cached = embedding_cache.get_many(model_id, texts)
+        missing = {}
+        for text in texts:
+            hash_value = text_hash(text)
+            if hash_value not in cached and hash_value not in missing:
+                missing[hash_value] = normalize_text(text)
+        
+        if missing:
+            print(f"🔤 Embedding {len(missing)} texts with {model_id} ({len(cached)} cached)")
+            semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+            
+            async def embed_one(text: str) -> List[float]:
+                async with semaphore:
+                    response_body = await asyncio.to_thread(self._invoke_model_json, model_id, {"inputText": text})
+                    return response_body['embedding']
+            
+            hash_values = list(missing)
+            vectors = await asyncio.gather(*(embed_one(missing[hash_value]) for hash_value in hash_values))
+            computed = dict(zip(hash_values, vectors))
+            embedding_cache.put_many(model_id, computed)
+            cached.update(computed)
+        
+        return [cached[text_hash(text)] for text in texts]
+    
+    async def embed_query(self, text: str) -> List[float]:
+        """検索クエリの埋め込み（同じ質問の再埋め込みはキャッシュで省略）"""
+        return (await self.embed_texts([text]))[0]
+
 # シングルトンインスタンス  
 bedrock_client = BedrockClient()
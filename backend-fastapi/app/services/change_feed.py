@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from app.services.metrics import metrics
+
+metrics.describe("rag_change_feed_applied_total", "Change feed entries applied by this worker")
+metrics.describe("rag_change_feed_pending_changes", "Change feed entries not yet applied by this worker")
+metrics.describe("rag_change_feed_staleness_seconds", "Age of the oldest change feed entry not yet applied by this worker")
+metrics.describe("rag_change_feed_apply_lag_seconds", "Delay between recording and applying the last change feed batch")
+
+# 古い変更の保持期間（これより長く停止していたワーカーは起動時の全件読み込みで追いつく）
+RETENTION_SECONDS = float(os.getenv('CHANGE_FEED_RETENTION_SECONDS', str(7 * 86400)))
+
+class ChangeFeed:
+    """インジェストが書き込むドキュメント変更ログ（単調増加のシーケンス番号付き、全ワーカーで共有）"""
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv(
+            'CHANGE_FEED_PATH',
+            os.path.join(os.path.dirname(__file__), '..', '..', 'change_feed.sqlite3')
+        )
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection:
+            return self.connection
+
+        connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        # AUTOINCREMENT: 削除後もシーケンス番号を再利用しない
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                op TEXT NOT NULL,
+                index_name TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                session_id TEXT,
+                data_version TEXT,
+                enhanced_timestamp REAL,
+                source TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        self.connection = connection
+        return connection
+
+    def record(self, op: str, index_name: str, doc_id: str, source: Optional[Dict[str, Any]] = None) -> int:
+        """upsert / delete（BulkWriter.delete）を記録してシーケンス番号を返す"""
+        return self.record_many(op, index_name, [(doc_id, source)])
+
+    def record_many(self, op: str, index_name: str, entries: List[Tuple[str, Optional[Dict[str, Any]]]]) -> int:
+        """複数ドキュメントの変更を1トランザクションで記録して最後のシーケンス番号を返す"""
+        if op not in ("upsert", "delete"):
+            raise ValueError(f"Unknown change feed operation: {op}")
+        now = time.time()
+        rows = []
+        for doc_id, source in entries:
+            source = source or {}
+            rows.append((
+                op, index_name, doc_id,
+                source.get('session_id'), source.get('data_version'), source.get('enhanced_timestamp'),
+                json.dumps(source, ensure_ascii=False) if op == "upsert" else None,
+                now
+            ))
+        with self.lock:
+            connection = self._connect()
+            connection.execute("BEGIN")
+            try:
+                connection.executemany(
+                    "INSERT INTO changes (op, index_name, doc_id, session_id, data_version, enhanced_timestamp, source, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                connection.execute("DELETE FROM changes WHERE created_at < ?", (now - RETENTION_SECONDS,))
+                seq = connection.execute("SELECT MAX(seq) FROM changes").fetchone()[0] or 0
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return seq
+
+    def latest_seq(self) -> int:
+        with self.lock:
+            row = self._connect().execute("SELECT MAX(seq) FROM changes").fetchone()
+        return row[0] or 0
+
+    def read_since(self, seq: int, limit: int = 500) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self._connect().execute(
+                "SELECT seq, op, index_name, doc_id, session_id, source, created_at FROM changes "
+                "WHERE seq > ? ORDER BY seq LIMIT ?",
+                (seq, limit)
+            ).fetchall()
+        return [
+            {
+                "seq": row[0], "op": row[1], "index_name": row[2], "doc_id": row[3],
+                "session_id": row[4], "source": json.loads(row[5]) if row[5] else None, "created_at": row[6]
+            }
+            for row in rows
+        ]
+
+    def pending(self, seq: int) -> Dict[str, float]:
+        """seq より後の未適用件数と最古の未適用変更の記録時刻"""
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT COUNT(*), MIN(created_at) FROM changes WHERE seq > ?", (seq,)
+            ).fetchone()
+        return {"count": row[0], "oldest_created_at": row[1] or 0.0}
+
+class ChangeFeedTailer:
+    """変更ログを追いかけてワーカー内のマップ・キャッシュ・ローカルインデックスに差分を反映
+
+    poll はイベントループ上で1つずつ実行する（定期的な追跡とインジェスト直後の反映が同じ変更を
+    重ねて適用しないように、またマップの更新が参照中の処理と競合しないように）
+    """
+    def __init__(self, feed: ChangeFeed):
+        self.feed = feed
+        self.lock: Optional[asyncio.Lock] = None
+        self.applied_seq = 0
+        self.last_poll = 0.0
+        self.stats = {"applied": 0, "batches": 0, "errors": 0}
+        metrics.register_gauge("rag_change_feed_pending_changes", lambda: {(): self._pending()["count"]})
+        metrics.register_gauge("rag_change_feed_staleness_seconds", lambda: {(): self.staleness()})
+
+    def _pending(self) -> Dict[str, float]:
+        try:
+            return self.feed.pending(self.applied_seq)
+        except sqlite3.Error:
+            return {"count": 0, "oldest_created_at": 0.0}
+
+    def staleness(self) -> float:
+        oldest = self._pending()["oldest_created_at"]
+        return round(time.time() - oldest, 3) if oldest else 0.0
+
+    def start_from_latest(self):
+        """全件読み込みの直前に呼び、読み込み以降の変更だけを追いかける"""
+        self.applied_seq = self.feed.latest_seq()
+
+    async def poll(self, batch_size: int = 500) -> int:
+        """未適用の変更を適用して件数を返す（ファイル・SQLiteの読み書きのみスレッドで実行）"""
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            return await self._poll(batch_size)
+
+    async def _poll(self, batch_size: int) -> int:
+        # 循環インポートを避けるため遅延インポート
+        from app.services.session_store import session_store
+        from app.services.shared_cache import shared_cache
+        from app.services.vector_store import vector_store
+        from app.services.context_renderer import context_renderer
+        from app.services.suggest_index import suggest_index
+        from app.services.query_filters import filter_vocabulary
+
+        self.last_poll = time.time()
+        applied = 0
+        while True:
+            changes = await asyncio.to_thread(self.feed.read_since, self.applied_seq, batch_size)
+            if not changes:
+                break
+
+            for change in changes:
+                if change["index_name"] == session_store.index_name:
+                    if change["op"] == "upsert":
+                        if session_store.upsert(change["doc_id"], change["source"]):
+                            # 新しい版のコンテキストを事前に描画しておく
+                            context_renderer.prerender([session_store.get(change["session_id"]).to_dict()])
+                    else:
+                        current = session_store.get(change["session_id"]) if change["session_id"] else None
+                        if current and current.id == change["doc_id"]:
+                            session_store.remove(change["session_id"])
+                self.applied_seq = change["seq"]
+
+            applied += len(changes)
+            self.stats["batches"] += 1
+            metrics.set_gauge("rag_change_feed_apply_lag_seconds", round(time.time() - changes[0]["created_at"], 3))
+            if len(changes) < batch_size:
+                break
+
+        if applied:
+            # 検索結果のキャッシュは変更前のドキュメントを含みうるので破棄（0件だったキーワードも一致しうる、
+            # フォールバック検索で選んだキーワードも変わりうる）
+            for namespace in ("search", "negative", "keywords"):
+                await asyncio.to_thread(shared_cache.clear, namespace)
+            sources = [hit.session.source for hit in session_store.documents.values()]
+            suggest_index.build(sources)
+            filter_vocabulary.build(sources)
+            try:
+                await asyncio.to_thread(vector_store.load)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"⚠️ Local index reload after change feed failed: {e}")
+            self.stats["applied"] += applied
+            metrics.inc("rag_change_feed_applied_total", applied)
+            print(f"🔁 Applied {applied} document changes (seq {self.applied_seq})")
+        return applied
+
+    def status(self) -> Dict[str, Any]:
+        pending = self._pending()
+        return {
+            "path": self.feed.path,
+            "applied_seq": self.applied_seq,
+            "pending_changes": pending["count"],
+            "staleness_seconds": self.staleness(),
+            "last_poll": self.last_poll,
+            "stats": self.stats
+        }
+
+def poll_interval() -> float:
+    return float(os.getenv('CHANGE_FEED_POLL_SECONDS', '2'))
+
+# シングルトンインスタンス
+change_feed = ChangeFeed()
+change_feed_tailer = ChangeFeedTailer(change_feed)
@@ -0,0 +1,161 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from app.models.search import Session
+from app.services.metrics import metrics
+
+metrics.describe("rag_context_block_cache_total", "Rendered context block cache lookups by outcome")
+
+# プロンプトに入れる参考資料全体のトークン上限（0 の場合は無制限）
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '12000'))
+CONTEXT_BLOCK_CACHE_SIZE = int(os.getenv('CONTEXT_BLOCK_CACHE_SIZE', '2000'))
+
+CONTEXT_HEADER = "以下の情報を参考にして回答してください：\n\n"
+NO_CONTEXT = "関連する参考資料が見つかりませんでした。一般的な知識で回答してください。\n\n"
+
+# 日本語（かな・漢字・全角記号）は1文字≒1トークン、英数字・空白は4文字≒1トークンで見積もる
+WIDE_CHAR_PATTERN = re.compile(r'[^\x00-\x7f]')
+
+def estimate_tokens(text: str) -> int:
+    wide = len(WIDE_CHAR_PATTERN.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+@dataclass(slots=True)
+class RenderedText:
+    text: str
+    tokens: int
+
+    @classmethod
+    def of(cls, text: str) -> "RenderedText":
+        return cls(text, estimate_tokens(text))
+
+@dataclass(slots=True)
+class ContextBlock:
+    """1ドキュメント分の描画済みコンテキスト（講演要約の前後は版ごとに固定なのでキャッシュする）"""
+    head: RenderedText
+    transcript: Optional[RenderedText]
+    tail: RenderedText
+
+def document_cache_key(result: Dict[str, Any]) -> Tuple[str, Any, Any, bool]:
+    # 検索時の _source の絞り込み（CONTEXT_SOURCE_FIELDS）にも data_version・enhanced_timestamp を含めること
+    # ハイライト断片で取得した場合は _source に全文が含まれないので別の版として扱う
+    source = result['source']
+    return (result['id'], source.get('data_version'), source.get('enhanced_timestamp'), bool(source.get('transcript_summary')))
+
+def render_block(session: Session) -> ContextBlock:
+    head = [f"タイトル: {session.title}\n"]
+    # AWS Summit用データ構造に対応
+    if session.abstract is not None:
+        head.append(f"概要: {session.abstract}\n")
+
+    transcript = None
+    if session.transcript_summary:
+        transcript = RenderedText.of(f"詳細内容: {session.transcript_summary}\n")
+
+    tail = []
+    speakers = session.speakers
+    if speakers:
+        tail.append(f"講演者: {', '.join(f'{speaker.name}（{speaker.company}）' for speaker in speakers)}\n")
+    if session.track is not None:
+        tail.append(f"トラック: {session.track}\n")
+    if session.date is not None and session.start_time is not None:
+        tail.append(f"開催日時: {session.date} {session.start_time}\n")
+    tail.append("\n")
+
+    return ContextBlock(RenderedText.of("".join(head)), transcript, RenderedText.of("".join(tail)))
+
+class ContextRenderer:
+    """ドキュメントの版（ID + data_version + enhanced_timestamp）ごとに描画結果とトークン数をキャッシュ
+
+    検索結果は {'id', 'score', 'source', ...} の辞書（保存済みのドキュメントは SearchHit.to_dict()）
+    """
+    def __init__(self, max_entries: int = CONTEXT_BLOCK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.blocks: "OrderedDict[Tuple[str, Any, Any, bool], ContextBlock]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def block(self, result: Dict[str, Any]) -> ContextBlock:
+        key = document_cache_key(result)
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is not None:
+                self.blocks.move_to_end(key)
+        if block is not None:
+            metrics.inc("rag_context_block_cache_total", outcome="hit")
+            return block
+
+        metrics.inc("rag_context_block_cache_total", outcome="miss")
+        block = render_block(Session(result['source']))
+        with self.lock:
+            self.blocks[key] = block
+            while len(self.blocks) > self.max_entries:
+                self.blocks.popitem(last=False)
+        return block
+
+    def prerender(self, results: List[Dict[str, Any]]):
+        """インジェスト・変更ログ適用時に事前描画"""
+        for result in results:
+            self.block(result)
+
+    def build_context(self, results: List[Dict[str, Any]], token_budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[str, Dict[str, Any]]:
+        """キャッシュ済みの断片を連結して参考資料を組み立てる
+
+        トークン数は描画時に計算済みなので、予算を超える場合は講演要約を省いた版に落とし、
+        それでも入らないドキュメントは含めない（先頭のドキュメントは常に含める）
+        """
+        if not results:
+            return NO_CONTEXT, {"tokens": estimate_tokens(NO_CONTEXT), "documents": 0, "trimmed": [], "dropped": []}
+
+        parts = [CONTEXT_HEADER]
+        used = estimate_tokens(CONTEXT_HEADER)
+        trimmed: List[str] = []
+        dropped: List[str] = []
+        included = 0
+        for index, result in enumerate(results):
+            block = self.block(result)
+            label = RenderedText.of(f"【参考資料{included + 1}】\n")
+            # ハイライト断片がある場合は全文の代わりに断片を使う（検索ごとに異なるのでキャッシュしない）
+            transcript = (
+                RenderedText.of(f"詳細内容: {' … '.join(result['transcript_fragments'])}\n")
+                if result.get('transcript_fragments') else block.transcript
+            )
+            base_tokens = label.tokens + block.head.tokens + block.tail.tokens
+            transcript_tokens = transcript.tokens if transcript else 0
+
+            if token_budget and index > 0 and used + base_tokens + transcript_tokens > token_budget:
+                if used + base_tokens > token_budget:
+                    dropped.append(result['id'])
+                    continue
+                trimmed.append(result['id'])
+                transcript = None
+                transcript_tokens = 0
+
+            parts.append(label.text)
+            parts.append(block.head.text)
+            if transcript:
+                parts.append(transcript.text)
+            parts.append(block.tail.text)
+            used += base_tokens + transcript_tokens
+            included += 1
+
+        return "".join(parts), {
+            "tokens": used,
+            "documents": included,
+            "trimmed": trimmed,
+            "dropped": dropped
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.blocks),
+            "max_entries": self.max_entries,
+            "token_budget": CONTEXT_TOKEN_BUDGET,
+            "hits": metrics.get("rag_context_block_cache_total", outcome="hit"),
+            "misses": metrics.get("rag_context_block_cache_total", outcome="miss")
+        }
+
+# シングルトンインスタンス
+context_renderer = ContextRenderer()
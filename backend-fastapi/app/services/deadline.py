@@ -0,0 +1,92 @@
+import os
+import time
+import contextvars
+from typing import List, Optional
+
+# 後続の段階のために残しておく時間（秒）
+GENERATION_RESERVE = float(os.getenv('DEADLINE_GENERATION_RESERVE_SECONDS', '8'))
+SEARCH_RESERVE = float(os.getenv('DEADLINE_SEARCH_RESERVE_SECONDS', '1'))
+
+# 各段階の後に確保しておく時間（短い締め切りでは下の割合を上限とする）
+STAGE_RESERVES = {
+    "keyword_extraction": GENERATION_RESERVE + SEARCH_RESERVE,
+    "search": GENERATION_RESERVE,
+    "generation": 0.0,
+}
+STAGE_RESERVE_FRACTIONS = {
+    "keyword_extraction": 0.7,
+    "search": 0.5,
+}
+
+# 段階を実行する価値がある最低限の残り時間（これを下回る場合は意図的に省略・縮退する）
+# model_fallback は独立した段階ではなく、呼び出し元の段階の予算内でフォールバックを試す最低時間
+STAGE_MINIMUMS = {
+    "keyword_extraction": float(os.getenv('DEADLINE_KEYWORD_MIN_SECONDS', '2')),
+    "search": float(os.getenv('DEADLINE_SEARCH_MIN_SECONDS', '0.3')),
+    "generation": float(os.getenv('DEADLINE_GENERATION_MIN_SECONDS', '2')),
+    "model_fallback": float(os.getenv('DEADLINE_MODEL_FALLBACK_MIN_SECONDS', '5')),
+}
+
+class DeadlineExceededError(Exception):
+    """締め切りまでに処理を完了できない（504 で返す）"""
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded before {stage}")
+        self.stage = stage
+
+class Deadline:
+    """1リクエストの締め切りと段階ごとの時間配分"""
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+        self.degradations: List[str] = []
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def stage_timeout(self, stage: str) -> float:
+        """この段階に使える時間（後続の段階の分を差し引いた残り時間）"""
+        reserve = min(
+            STAGE_RESERVES.get(stage, 0.0),
+            self.timeout * STAGE_RESERVE_FRACTIONS.get(stage, 1.0)
+        )
+        return max(self.remaining() - reserve, 0.0)
+
+    def allows(self, stage: str, minimum: Optional[float] = None) -> bool:
+        if minimum is None:
+            minimum = STAGE_MINIMUMS.get(stage, 0.0)
+        return self.stage_timeout(stage) >= minimum
+
+    def degrade(self, reason: str):
+        """予算不足で意図的に省略した処理を記録"""
+        if reason not in self.degradations:
+            self.degradations.append(reason)
+        print(f"⏳ Degrading: {reason} (remaining: {self.remaining():.3f}s)")
+
+current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar('current_deadline', default=None)
+
+def start_deadline(timeout: float) -> Deadline:
+    deadline = Deadline(timeout)
+    current_deadline.set(deadline)
+    return deadline
+
+def get_deadline() -> Optional[Deadline]:
+    return current_deadline.get()
+
+def stage_timeout(stage: str, default: Optional[float] = None) -> Optional[float]:
+    """現在のリクエストの締め切りから段階のタイムアウトを計算（締め切りがない場合は default）
+
+    使える時間が残っていない場合は DeadlineExceededError
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return default
+
+    timeout = deadline.stage_timeout(stage)
+    if timeout <= 0:
+        raise DeadlineExceededError(stage)
+    return timeout if default is None else min(timeout, default)
+
+def stage_allowed(stage: str, minimum: Optional[float] = None) -> bool:
+    """段階を実行できるだけの予算が残っているか（minimum で段階の最低時間を上書きできる）"""
+    deadline = current_deadline.get()
+    return deadline is None or deadline.allows(stage, minimum)
@@ -0,0 +1,105 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+def normalize_text(text: str) -> str:
+    """埋め込み対象テキストの正規化（全角・半角と空白の揺れを吸収）"""
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    """モデルID + 正規化テキストのハッシュをキーにした永続埋め込みキャッシュ（インジェストとクエリで共有）"""
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv(
+            'EMBEDDING_CACHE_PATH',
+            os.path.join(os.path.dirname(__file__), '..', '..', 'embedding_cache.sqlite3')
+        )
+        self.connection = None
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "inserts": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection:
+            return self.connection
+
+        connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model_id TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (model_id, text_hash)
+            ) WITHOUT ROWID
+        """)
+        self.connection = connection
+        return connection
+
+    def get_many(self, model_id: str, texts: Sequence[str]) -> Dict[str, List[float]]:
+        """まとめて検索し、ヒットした分を テキストハッシュ → ベクトル で返す"""
+        hashes = list({text_hash(text) for text in texts})
+        found: Dict[str, List[float]] = {}
+
+        with self.lock:
+            connection = self._connect()
+            # SQLiteのパラメータ数上限を超えないように分割
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model_id = ? AND text_hash IN ({placeholders})",
+                    [model_id, *chunk]
+                ).fetchall()
+                for hash_value, blob in rows:
+                    vector = array('f')
+                    vector.frombytes(blob)
+                    found[hash_value] = vector.tolist()
+
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(hashes) - len(found)
+        return found
+
+    def put_many(self, model_id: str, items: Dict[str, Sequence[float]]):
+        """テキストハッシュ → ベクトル をまとめて保存（float32で格納）"""
+        now = time.time()
+        rows = [
+            (model_id, hash_value, len(vector), array('f', vector).tobytes(), now)
+            for hash_value, vector in items.items()
+        ]
+        with self.lock:
+            connection = self._connect()
+            connection.execute("BEGIN")
+            try:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model_id, text_hash, dim, vector, created_at) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+        self.stats["inserts"] += len(rows)
+
+    def summary(self) -> Dict[str, object]:
+        with self.lock:
+            rows = self._connect().execute(
+                "SELECT model_id, COUNT(*) FROM embeddings GROUP BY model_id"
+            ).fetchall()
+        return {
+            "path": self.path,
+            "entries": {model_id: count for model_id, count in rows},
+            "stats": self.stats
+        }
+
+# シングルトンインスタンス
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,164 @@
+import os
+import re
+import unicodedata
+from datetime import date as Date
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from app.models.search import Session
+from app.services.metrics import metrics
+from app.services.session_store import SESSION_ID_IN_TEXT_PATTERN
+
+# セッションIDを含む事実確認の質問（講演者・日時・会場など）をLLMを使わずにテンプレートで回答する
+FACT_ANSWER_ENABLED = os.getenv('FACT_ANSWER_ENABLED', 'true').lower() == 'true'
+
+metrics.describe("rag_fact_answers_total", "Chat answers rendered from structured session fields without Bedrock, by intent")
+
+# 質問の意図 → 判定パターン（セッションIDを除いた質問文に対して照合、上から順に回答する）
+# 「誰」「いつ」「どこで」のような一語は「誰向け」「録画はいつ公開」のような内容の質問にも現れるので、
+# 質問全体が意図の語句と QUESTION_FILLER_PATTERN だけで書かれている場合に限りテンプレートで回答する
+FACT_INTENTS: List[Tuple[str, re.Pattern]] = [
+    ("title", re.compile(r'タイトル|題名|セッション名')),
+    ("speakers", re.compile(r'講演者|登壇者|スピーカー|発表者|講師|誰が?(登壇|講演|発表|話)?')),
+    ("company", re.compile(r'企業|会社|所属|どこの')),
+    # 「講演時間」「何分」「何時間」は長さ（「何時何分から」のような時刻は schedule のみ）
+    ("schedule", re.compile(r'何時何分|何時(?!間)|いつ|何日|日時|日程|開始|終了|始ま|終わ|(?<!講演)(?<!所要)(?<!何)時間')),
+    ("duration", re.compile(r'講演時間|所要時間|何時間|(?<!何時)何分(?!から|まで|に)|長さ')),
+    ("room", re.compile(r'会場|部屋|場所|ルーム|どこで(開催|講演|発表|行われ)?')),
+    ("track", re.compile(r'トラック')),
+    ("level", re.compile(r'レベル|難易度')),
+]
+# 意図の語句を除いた残りがこれだけなら事実確認の質問（助詞・疑問詞・文末表現・記号）
+QUESTION_FILLER_PATTERN = re.compile(
+    r'でしょうか|ですか|です|しますか|します|する|されますか|されます|される|ますか|ます|る|'
+    r'教えてください|教えて下さい|教えて|知りたい|セッション|から|まで|何|なに|なん|どこ|どれ|'
+    r'[はのがをともでにかへ]|[\s\W_]'
+)
+# 内容の説明・要約・比較・講演者の経歴など、構造化フィールドだけでは答えられない質問（LLMで回答する）
+OPEN_ENDED_PATTERN = re.compile(
+    r'内容|概要|要約|まとめ|詳し|説明|について|どんな|どのよう|どう|なぜ|何を|学べ|ポイント|おすすめ|違い|比較|感想|特徴'
+    r'|経歴|略歴|プロフィール|経験|人物'
+)
+WEEKDAYS = "月火水木金土日"
+
+@dataclass(slots=True)
+class FactAnswer:
+    """テンプレートで作った回答と、判定した意図"""
+    text: str
+    intents: List[str]
+    session_ids: List[str]
+
+def detect_intents(message: str) -> List[str]:
+    """事実確認の意図（自由回答が必要な質問、意図が判定できない質問は空）"""
+    text = SESSION_ID_IN_TEXT_PATTERN.sub(' ', unicodedata.normalize('NFKC', message))
+    if OPEN_ENDED_PATTERN.search(text):
+        return []
+    intents: List[str] = []
+    rest = text
+    for name, pattern in FACT_INTENTS:
+        if pattern.search(text):
+            intents.append(name)
+            rest = pattern.sub(' ', rest)
+    # 意図の語句以外が残る質問（「誰向け」「スライドはどこで見られる」など）は判定できないのでLLMで回答
+    if QUESTION_FILLER_PATTERN.sub('', rest):
+        return []
+    # 講演者の一覧に所属企業も含めるので、両方ある場合は一覧のみ
+    if "speakers" in intents and "company" in intents:
+        intents.remove("company")
+    return intents
+
+def format_date(value: str) -> str:
+    """「2025-06-25」→「2025年6月25日（水）」（形式が違う場合はそのまま）"""
+    try:
+        day = Date.fromisoformat(str(value))
+    except ValueError:
+        return str(value)
+    return f"{day.year}年{day.month}月{day.day}日（{WEEKDAYS[day.weekday()]}）"
+
+def _label(session: Session) -> str:
+    return f"「{session.title}」（{session.session_id}）" if session.title else session.session_id
+
+def _speakers(session: Session) -> Optional[str]:
+    speakers = [speaker for speaker in session.speakers if speaker.name]
+    if not speakers:
+        return None
+    lines = [f"{_label(session)}の講演者は以下の{len(speakers)}名です。"]
+    for speaker in speakers:
+        affiliation = " ".join(part for part in (speaker.company, speaker.title) if part)
+        lines.append(f"- {speaker.name}（{affiliation}）" if affiliation else f"- {speaker.name}")
+    return "\n".join(lines)
+
+def _company(session: Session) -> Optional[str]:
+    companies: List[str] = []
+    for speaker in session.speakers:
+        if speaker.company and speaker.company not in companies:
+            companies.append(speaker.company)
+    if not companies:
+        return None
+    return f"{_label(session)}の講演者の所属企業は{'、'.join(companies)}です。"
+
+def _schedule(session: Session) -> Optional[str]:
+    if not session.date or not session.start_time:
+        return None
+    end_time = session.get('end_time')
+    period = f"{session.start_time}〜{end_time}" if end_time else f"{session.start_time}から"
+    return f"{_label(session)}は{format_date(session.date)} {period}に開催されます。"
+
+def _duration(session: Session) -> Optional[str]:
+    duration = session.get('duration')
+    if not duration:
+        return None
+    end_time = session.get('end_time')
+    period = f"（{session.start_time}〜{end_time}）" if session.start_time and end_time else ""
+    return f"{_label(session)}の講演時間は{duration}分です{period}。"
+
+def _room(session: Session) -> Optional[str]:
+    room = session.get('room')
+    return f"{_label(session)}の会場は{room}です。" if room else None
+
+def _track(session: Session) -> Optional[str]:
+    return f"{_label(session)}は{session.track}トラックのセッションです。" if session.track else None
+
+def _level(session: Session) -> Optional[str]:
+    level = session.get('level')
+    return f"{_label(session)}のレベルは{level}です。" if level else None
+
+def _title(session: Session) -> Optional[str]:
+    return f"{session.session_id}のタイトルは「{session.title}」です。" if session.title else None
+
+RENDERERS: Dict[str, Callable[[Session], Optional[str]]] = {
+    "title": _title,
+    "speakers": _speakers,
+    "company": _company,
+    "schedule": _schedule,
+    "duration": _duration,
+    "room": _room,
+    "track": _track,
+    "level": _level,
+}
+
+def answer_from_fields(message: str, results: Sequence[Dict[str, Any]], session_ids: Sequence[str]) -> Optional[FactAnswer]:
+    """質問されたすべてのセッションについて、判定した意図のフィールドが揃っている場合のみ回答する
+
+    IDが見つからない・フィールドが空の場合は None（通常どおりLLMで回答）
+    """
+    if not FACT_ANSWER_ENABLED or not results or len(results) != len(session_ids):
+        return None
+    intents = detect_intents(message)
+    if not intents:
+        return None
+
+    sessions = [Session(result['source']) for result in results]
+    paragraphs = []
+    for session in sessions:
+        lines = [RENDERERS[intent](session) for intent in intents]
+        if any(line is None for line in lines):
+            return None
+        paragraphs.append("\n".join(lines))
+
+    for intent in intents:
+        metrics.inc("rag_fact_answers_total", intent=intent)
+    return FactAnswer(
+        text="\n\n".join(paragraphs),
+        intents=intents,
+        session_ids=[session.session_id for session in sessions]
+    )
@@ -0,0 +1,160 @@
+import os
+import re
+import random
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+from app.services.shared_cache import shared_cache
+from app.services.metrics import metrics
+
+metrics.describe("rag_fallback_searches_total", "Keyword fallback searches by outcome")
+metrics.describe("rag_fallback_skipped_total", "Keyword fallback candidates skipped before searching, by reason")
+metrics.describe("rag_fallback_expected_attempts", "Moving average of keyword fallback searches per chat request (this worker)")
+
+# 成功率の推定を使い始める観測数と、推定の事前分布の重み（観測が少ないうちは全体の成功率に寄せる）
+FALLBACK_MIN_OBSERVATIONS = int(os.getenv('FALLBACK_MIN_OBSERVATIONS', '20'))
+FALLBACK_PRIOR_WEIGHT = float(os.getenv('FALLBACK_PRIOR_WEIGHT', '5'))
+# 推定成功率がこれ未満の分類は後回し、さらに低い場合は試行しない
+FALLBACK_DEMOTE_RATE = float(os.getenv('FALLBACK_DEMOTE_RATE', '0.3'))
+FALLBACK_PRUNE_RATE = float(os.getenv('FALLBACK_PRUNE_RATE', '0.05'))
+# 除外した分類もこの確率で試行して推定を更新し続ける（一度除外されたまま戻らないことを防ぐ）
+FALLBACK_EXPLORE_RATE = float(os.getenv('FALLBACK_EXPLORE_RATE', '0.05'))
+# 古い観測の重みを減らす係数（観測のたびに掛ける。コーパスの変化に追従）
+FALLBACK_STATS_DECAY = float(os.getenv('FALLBACK_STATS_DECAY', '0.995'))
+# 記録する 分類 × パターン の上限
+FALLBACK_MAX_BUCKETS = int(os.getenv('FALLBACK_MAX_BUCKETS', '1000'))
+# 1リクエストあたりの試行回数の移動平均の係数
+EXPECTED_ATTEMPTS_ALPHA = 0.05
+
+SCRIPT_PATTERNS = [
+    ("latin", re.compile(r'[A-Za-z0-9]')),
+    ("katakana", re.compile(r'[ァ-ヶー]')),
+    ("kanji", re.compile(r'[一-龯々]')),
+    ("hiragana", re.compile(r'[ぁ-ゖ]')),
+]
+
+def keyword_pattern(keyword: str) -> str:
+    """キーワードの字種（latin / katakana / kanji / hiragana、複数の場合は mixed）"""
+    text = unicodedata.normalize('NFKC', keyword)
+    scripts = [name for name, pattern in SCRIPT_PATTERNS if pattern.search(text)]
+    if len(scripts) == 1:
+        return scripts[0]
+    return "mixed" if scripts else "other"
+
+def category_bucket(category: str) -> str:
+    """LLMが返す分類（「企業名の一部」など）。長い説明文は先頭のみ"""
+    return unicodedata.normalize('NFKC', category or "").strip()[:20] or "unknown"
+
+class FallbackPlanner:
+    """フォールバック検索の候補を、分類 × キーワードの字種 ごとの実績の成功率で並べ替える
+
+    優先度スコアの順を基本に、実績の少ない分類はそのまま、成功率の低い分類は後回し・除外する。
+    結果が0件だったキーワードは負のキャッシュ（TTL付き、ワーカー間共有）に入れ、期限まで検索しない
+    実績はワーカーごとのメモリ上に持つ
+    """
+    def __init__(self):
+        # (分類, 字種) → [試行, 成功]（減衰付き）
+        self.buckets: Dict[Tuple[str, str], List[float]] = {}
+        # 実行順の位置 → [試行, 成功]
+        self.positions: Dict[int, List[float]] = {}
+        self.totals = [0.0, 0.0]
+        self.expected_attempts: Optional[float] = None
+        self.requests = 0
+        self.stats = {"skipped_negative": 0, "skipped_pruned": 0, "demoted": 0, "explored": 0}
+
+    def _overall_rate(self) -> float:
+        attempts, hits = self.totals
+        return hits / attempts if attempts > 0 else 0.5
+
+    def _estimate(self, bucket: Optional[List[float]]) -> Optional[float]:
+        """推定成功率（観測が FALLBACK_MIN_OBSERVATIONS 未満の場合は None）"""
+        if bucket is None or bucket[0] < FALLBACK_MIN_OBSERVATIONS:
+            return None
+        attempts, hits = bucket
+        return (hits + FALLBACK_PRIOR_WEIGHT * self._overall_rate()) / (attempts + FALLBACK_PRIOR_WEIGHT)
+
+    def success_rate(self, category: str, keyword: str) -> Optional[float]:
+        return self._estimate(self.buckets.get((category_bucket(category), keyword_pattern(keyword))))
+
+    @staticmethod
+    def negative_key(keyword: str, events: Optional[List[str]], filters: Optional[Dict[str, str]]) -> str:
+        return shared_cache.make_key(keyword, sorted(events) if events else None, filters or None)
+
+    async def plan(self, candidates: List[Dict[str, Any]], events: Optional[List[str]] = None,
+             filters: Optional[Dict[str, str]] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """(試行する候補, 試行しない候補)。試行する候補は成功率の低い分類を後ろに回す（同じ段では元の順）"""
+        planned: List[Tuple[int, int, Dict[str, Any]]] = []
+        skipped: List[Dict[str, Any]] = []
+        for position, candidate in enumerate(candidates):
+            if await shared_cache.get_async("negative", self.negative_key(candidate['keyword'], events, filters)) is not None:
+                skipped.append({**candidate, 'skip_reason': 'negative_cache'})
+                self.stats["skipped_negative"] += 1
+                metrics.inc("rag_fallback_skipped_total", reason="negative_cache")
+                continue
+
+            rate = self.success_rate(candidate.get('category', ''), candidate['keyword'])
+            candidate['expected_success'] = round(rate, 3) if rate is not None else None
+            tier = 0
+            if rate is not None and rate < FALLBACK_PRUNE_RATE:
+                if random.random() >= FALLBACK_EXPLORE_RATE:
+                    skipped.append({**candidate, 'skip_reason': 'pruned'})
+                    self.stats["skipped_pruned"] += 1
+                    metrics.inc("rag_fallback_skipped_total", reason="pruned")
+                    continue
+                self.stats["explored"] += 1
+                tier = 1
+            elif rate is not None and rate < FALLBACK_DEMOTE_RATE:
+                tier = 1
+            if tier:
+                self.stats["demoted"] += 1
+            planned.append((tier, position, candidate))
+
+        planned.sort(key=lambda item: (item[0], item[1]))
+        return [candidate for _, _, candidate in planned], skipped
+
+    async def record(self, candidate: Dict[str, Any], position: int, found: bool,
+               events: Optional[List[str]] = None, filters: Optional[Dict[str, str]] = None):
+        """1回の試行の結果を記録（0件の場合は負のキャッシュに入れる）"""
+        key = (category_bucket(candidate.get('category', '')), keyword_pattern(candidate['keyword']))
+        bucket = self.buckets.get(key)
+        if bucket is None and len(self.buckets) < FALLBACK_MAX_BUCKETS:
+            bucket = self.buckets[key] = [0.0, 0.0]
+        for counts in (bucket, self.positions.setdefault(position, [0.0, 0.0]), self.totals):
+            if counts is None:
+                continue
+            counts[0] = counts[0] * FALLBACK_STATS_DECAY + 1
+            counts[1] = counts[1] * FALLBACK_STATS_DECAY + (1 if found else 0)
+
+        metrics.inc("rag_fallback_searches_total", outcome="hit" if found else "miss")
+        if not found:
+            await shared_cache.set_async("negative", self.negative_key(candidate['keyword'], events, filters), True)
+
+    def finish(self, attempts: int):
+        """1リクエストの試行回数を移動平均に反映"""
+        self.requests += 1
+        if self.expected_attempts is None:
+            self.expected_attempts = float(attempts)
+        else:
+            self.expected_attempts += EXPECTED_ATTEMPTS_ALPHA * (attempts - self.expected_attempts)
+        metrics.set_gauge("rag_fallback_expected_attempts", round(self.expected_attempts, 4))
+
+    def summary(self) -> Dict[str, Any]:
+        def rate(counts: List[float]) -> Dict[str, float]:
+            return {
+                "attempts": round(counts[0], 2),
+                "success_rate": round(counts[1] / counts[0], 3) if counts[0] > 0 else None
+            }
+        buckets = sorted(self.buckets.items(), key=lambda item: -item[1][0])
+        return {
+            "requests": self.requests,
+            "expected_attempts": round(self.expected_attempts, 4) if self.expected_attempts is not None else None,
+            "overall": rate(self.totals),
+            "positions": {position: rate(counts) for position, counts in sorted(self.positions.items())},
+            "buckets": [
+                {"category": category, "pattern": pattern, **rate(counts), "estimate": self._estimate(counts)}
+                for (category, pattern), counts in buckets
+            ],
+            "stats": self.stats
+        }
+
+# シングルトンインスタンス
+fallback_planner = FallbackPlanner()
@@ -0,0 +1,94 @@
+import os
+import asyncio
+from typing import Any, Dict, List, Optional
+from app.services.opensearch_client import opensearch_client
+from app.services.deadline import get_deadline
+
+def parse_event_indices(value: str) -> Dict[str, str]:
+    """OPENSEARCH_INDICES を イベント名 → インデックス名（またはエイリアス） に変換
+
+    例: "aws_summit_2025=aws_summit_sessions,aws_summit_2024=aws_summit_sessions_2024"
+    イベント名を省略した場合はインデックス名をイベント名として使う
+    """
+    indices: Dict[str, str] = {}
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        event, _, index_name = entry.partition('=')
+        indices[event.strip()] = (index_name or event).strip()
+    return indices
+
+# 検索対象のイベント（先頭がセッションマップ・インジェストの既定）
+EVENT_INDICES = parse_event_indices(os.getenv('OPENSEARCH_INDICES', 'aws_summit_sessions'))
+if not EVENT_INDICES:
+    raise ValueError("OPENSEARCH_INDICES has no index (e.g. aws_summit_2025=aws_summit_sessions); unset it to use the default index")
+DEFAULT_EVENT = next(iter(EVENT_INDICES))
+DEFAULT_INDEX = EVENT_INDICES[DEFAULT_EVENT]
+
+class UnknownEventError(ValueError):
+    def __init__(self, events: List[str]):
+        super().__init__(f"Unknown events: {', '.join(events)} (available: {', '.join(EVENT_INDICES)})")
+        self.events = events
+
+def resolve_indices(events: Optional[List[str]] = None) -> Dict[str, str]:
+    """検索対象の イベント → インデックス（events 省略時は全イベント）"""
+    if not events:
+        return dict(EVENT_INDICES)
+    unknown = [event for event in events if event not in EVENT_INDICES]
+    if unknown:
+        raise UnknownEventError(unknown)
+    return {event: EVENT_INDICES[event] for event in events}
+
+def merge_results(results_by_event: Dict[str, List[Dict[str, Any]]], size: int) -> List[Dict[str, Any]]:
+    """イベントごとの結果をスコア正規化して統合
+
+    BM25のスコアはインデックスごとの統計に依存して比較できないので、各イベントの最上位を 1.0 に
+    揃えてから並べる。同じイベント内の同一セッション（元データと拡張版など）は、応答したイベントの数に
+    関係なく常に上位の1件のみ残す（別のイベントの同じセッションIDは別のセッションとして残す）
+    """
+    merged: List[Dict[str, Any]] = []
+    for event, hits in results_by_event.items():
+        top_score = max((hit['score'] or 0.0 for hit in hits), default=0.0)
+        seen = set()
+        for hit in hits:
+            key = hit['source'].get('session_id') or hit['id']
+            if key in seen:
+                continue
+            seen.add(key)
+            hit['event'] = event
+            hit['normalized_score'] = (hit['score'] or 0.0) / top_score if top_score > 0 else 0.0
+            merged.append(hit)
+    merged.sort(key=lambda hit: hit['normalized_score'], reverse=True)
+    return merged[:size]
+
+async def federated_search(query_text: str, size: int = 5, events: Optional[List[str]] = None,
+                           **search_options: Any) -> List[Dict[str, Any]]:
+    """設定されたイベントのインデックスに並列に検索し、正規化・重複除去して上位 size 件を返す
+
+    search_options は search_with_transcript_content にそのまま渡す（profile_log・explain など）
+    """
+    indices = resolve_indices(events)
+    searches = [
+        opensearch_client.search_with_transcript_content(index_name, query_text, size, **search_options)
+        for index_name in indices.values()
+    ]
+    # イベントを増やしても待ち時間は最も遅いインデックス分だけ
+    results = await asyncio.gather(*searches, return_exceptions=True)
+
+    results_by_event: Dict[str, List[Dict[str, Any]]] = {}
+    errors = []
+    for event, result in zip(indices, results):
+        if isinstance(result, BaseException):
+            print(f"⚠️ Search failed for event {event}: {result!r}")
+            errors.append(result)
+        else:
+            results_by_event[event] = result
+    if not results_by_event:
+        raise errors[0]
+    if errors:
+        # 一部のイベントが失敗しても残りの結果で回答する
+        deadline = get_deadline()
+        if deadline:
+            deadline.degrade("partial_federated_search")
+    return merge_results(results_by_event, size)
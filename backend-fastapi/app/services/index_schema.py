@@ -0,0 +1,378 @@
+import os
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# コードで管理するマッピングの版（変更したら上げて scripts/manage_index.py migrate で新しいインデックスへ移行）
+SCHEMA_VERSION = 1
+# 移行時のコピー（_reindex が使えない場合）の1回あたりの件数と、一時的な失敗の再試行回数
+REINDEX_BATCH_SIZE = int(os.getenv('REINDEX_BATCH_SIZE', '500'))
+REINDEX_MAX_RETRIES = int(os.getenv('REINDEX_MAX_RETRIES', '5'))
+# エイリアスの付け替え後、以前のインデックスへの処理中の書き込みを待つ秒数
+REINDEX_SETTLE_SECONDS = float(os.getenv('REINDEX_SETTLE_SECONDS', '5'))
+
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+def _ja_text(ngram: bool = False, keyword: bool = False) -> Dict[str, Any]:
+    """日本語解析の text フィールド（部分一致用の n-gram・完全一致用の keyword をサブフィールドに持つ）"""
+    field: Dict[str, Any] = {"type": "text", "analyzer": "ja_text"}
+    subfields = {}
+    if ngram:
+        subfields["ngram"] = {"type": "text", "analyzer": "ja_ngram"}
+    if keyword:
+        subfields["keyword"] = {"type": "keyword", "ignore_above": 256}
+    if subfields:
+        field["fields"] = subfields
+    return field
+
+INDEX_SETTINGS: Dict[str, Any] = {
+    "analysis": {
+        "tokenizer": {
+            "ja_tokenizer": {"type": "kuromoji_tokenizer", "mode": "search"},
+            "ja_ngram_tokenizer": {"type": "ngram", "min_gram": 2, "max_gram": 3, "token_chars": ["letter", "digit"]}
+        },
+        "analyzer": {
+            "ja_text": {
+                "type": "custom",
+                "tokenizer": "ja_tokenizer",
+                "filter": ["kuromoji_baseform", "kuromoji_part_of_speech", "cjk_width", "ja_stop", "kuromoji_stemmer", "lowercase"]
+            },
+            "ja_ngram": {
+                "type": "custom",
+                "tokenizer": "ja_ngram_tokenizer",
+                "filter": ["cjk_width", "lowercase"]
+            }
+        }
+    }
+}
+
+INDEX_MAPPINGS: Dict[str, Any] = {
+    "_meta": {"schema_version": SCHEMA_VERSION},
+    "properties": {
+        # 完全一致の検索・フィルタ用（解析しない）
+        "session_id": {"type": "keyword"},
+        "track": {"type": "keyword"},
+        "level": {"type": "keyword"},
+        "date": {"type": "keyword"},
+        "start_time": {"type": "keyword"},
+        "end_time": {"type": "keyword"},
+        "room": {"type": "keyword"},
+        "session_type": {"type": "keyword"},
+        "data_version": {"type": "keyword"},
+        "duration": {"type": "integer"},
+        "has_transcript": {"type": "boolean"},
+        "has_detailed_content": {"type": "boolean"},
+        "enhanced_timestamp": {"type": "double"},
+        # 全文検索用
+        "title": _ja_text(ngram=True, keyword=True),
+        "abstract": _ja_text(),
+        "summary": _ja_text(),
+        "transcript_summary": _ja_text(ngram=True),
+        "speakers": {
+            "properties": {
+                "name": _ja_text(keyword=True),
+                "title": _ja_text(),
+                "company": _ja_text(keyword=True)
+            }
+        }
+    }
+}
+
+def index_body() -> Dict[str, Any]:
+    return {"settings": INDEX_SETTINGS, "mappings": INDEX_MAPPINGS}
+
+def versioned_name(alias: str, version: int = SCHEMA_VERSION) -> str:
+    return f"{alias}_v{version}"
+
+def flatten_mapping(properties: Dict[str, Any], prefix: str = "") -> Dict[str, str]:
+    """マッピングを フィールドのパス → 型 に展開（サブフィールドは "title.keyword" のように含める）"""
+    types: Dict[str, str] = {}
+    for name, field in properties.items():
+        path = f"{prefix}{name}"
+        if 'properties' in field:
+            types.update(flatten_mapping(field['properties'], f"{path}."))
+            continue
+        types[path] = field.get('type', 'object')
+        for subname, subfield in (field.get('fields') or {}).items():
+            types[f"{path}.{subname}"] = subfield.get('type', 'object')
+    return types
+
+EXPECTED_FIELD_TYPES = flatten_mapping(INDEX_MAPPINGS['properties'])
+
+class IndexSchemaManager:
+    """インデックスのマッピングをコードで定義し、版付きインデックス + エイリアスで運用する
+
+    検索・インジェストはエイリアス名（OPENSEARCH_INDICES）を使い、移行時は新しい版のインデックスを
+    作ってコピーしたあとエイリアスを一度の操作で付け替える（検索側は停止しない）
+    起動時に実際のマッピングを読み込み、keyword として定義されているフィールドは
+    解析済みフィールドへのフォールバックなしの term 句で完全一致させる
+    """
+    def __init__(self):
+        # インデックス名 → フィールドのパス → 型（detect で読み込んだ実際のマッピング）
+        self.field_types: Dict[str, Dict[str, str]] = {}
+        self.versions: Dict[str, Optional[int]] = {}
+        # 検索対象のすべてのインデックスで keyword のフィールド
+        self.keyword_fields: Set[str] = set()
+        self.detected_at = 0.0
+
+    def detect(self, client, index_names: Iterable[str]):
+        """実際のマッピングを読み込む（ブロッキング）。読み込めないインデックスがあれば従来のクエリのまま"""
+        field_types: Dict[str, Dict[str, str]] = {}
+        versions: Dict[str, Optional[int]] = {}
+        for name in index_names:
+            response = client.indices.get_mapping(index=name)
+            # エイリアスの場合もレスポンスのキーは実際のインデックス名（通常は1つ）
+            for mapping in response.values():
+                mappings = mapping.get('mappings', {})
+                field_types[name] = flatten_mapping(mappings.get('properties', {}))
+                versions[name] = (mappings.get('_meta') or {}).get('schema_version')
+                break
+
+        keyword_fields = None
+        for types in field_types.values():
+            fields = {path for path, field_type in types.items() if field_type == 'keyword'}
+            keyword_fields = fields if keyword_fields is None else keyword_fields & fields
+        self.field_types, self.versions = field_types, versions
+        self.keyword_fields = keyword_fields or set()
+        self.detected_at = time.time()
+        print(f"🗺️ Index mappings detected: {', '.join(f'{name} (schema v{versions[name]})' for name in field_types)}; "
+              f"keyword fields: {', '.join(sorted(self.keyword_fields)) or 'none'}")
+
+    def keyword_field(self, field: str) -> Optional[str]:
+        """完全一致に使える keyword フィールド（フィールド自体、または .keyword サブフィールド）"""
+        if field in self.keyword_fields:
+            return field
+        if f"{field}.keyword" in self.keyword_fields:
+            return f"{field}.keyword"
+        return None
+
+    def has_field(self, field: str) -> bool:
+        """すべての検索対象インデックスにあるフィールド（ngram サブフィールドの有無の判定用）"""
+        return bool(self.field_types) and all(field in types for types in self.field_types.values())
+
+    def drift(self, index_name: str) -> Dict[str, Tuple[Optional[str], str]]:
+        """コードの定義と型が異なるフィールド（パス → (実際の型, 定義の型)）"""
+        actual = self.field_types.get(index_name, {})
+        return {
+            path: (actual.get(path), expected)
+            for path, expected in EXPECTED_FIELD_TYPES.items()
+            if actual.get(path) != expected
+        }
+
+    def resolve_alias(self, client, alias: str) -> Tuple[Optional[str], bool]:
+        """エイリアスが指すインデックス名と、エイリアスではなく同名のインデックス（移行前）かどうか"""
+        if client.indices.exists_alias(name=alias):
+            indices = list(client.indices.get_alias(name=alias).keys())
+            return (indices[0] if indices else None), False
+        if client.indices.exists(index=alias):
+            return alias, True
+        return None, False
+
+    def create_index(self, client, name: str):
+        client.indices.create(index=name, body=index_body())
+        print(f"🆕 Created index {name} (schema v{SCHEMA_VERSION})")
+
+    def ensure(self, client, alias: str) -> str:
+        """エイリアスがなければ現在の版のインデックスを作ってエイリアスを付ける"""
+        current, legacy = self.resolve_alias(client, alias)
+        if current:
+            if legacy:
+                print(f"⚠️ {alias} is a plain index with an inferred mapping; run migrate to move it behind an alias")
+            return current
+        name = versioned_name(alias)
+        if not client.indices.exists(index=name):
+            self.create_index(client, name)
+        client.indices.update_aliases(body={"actions": [{"add": {"index": name, "alias": alias}}]})
+        print(f"🔗 Alias {alias} → {name}")
+        return name
+
+    def migrate(self, client, alias: str, delete_old: bool = False, replace_legacy: bool = False) -> Dict[str, Any]:
+        """現在の版（SCHEMA_VERSION）のインデックスを作ってコピーし、エイリアスを付け替える
+
+        コピー開始以降にインジェストされた拡張ドキュメント（enhanced_timestamp が開始時刻以降）は
+        最初のコピーから除き、追いつきのコピーで移す。追いつきは付け替えの直前にもう一度行い、
+        付け替え後も REINDEX_SETTLE_SECONDS 待って以前のインデックスに届いた書き込みを移す
+        （コピー済みのドキュメントは session_id + enhanced_timestamp で判定して重複させない）。
+        同名のインデックス（エイリアス導入前）から移行する場合は
+        エイリアスと同じ名前のインデックスを削除する必要があるため replace_legacy を指定する
+        （削除から付け替えまでの間は検索できず、書き込みは同名のインデックスを作ってしまうのでインジェストを止めて実行する）
+        """
+        source, legacy = self.resolve_alias(client, alias)
+        target = versioned_name(alias)
+        if source == target:
+            raise ValueError(f"{alias} already points to {target}")
+        if legacy and not replace_legacy:
+            raise ValueError(f"{alias} is a plain index; pass replace_legacy to delete it after copying")
+        if client.indices.exists(index=target):
+            raise ValueError(f"{target} already exists; delete it or bump SCHEMA_VERSION")
+
+        migrate_start = time.time()
+        self.create_index(client, target)
+        copied = caught_up = 0
+        # 追いつきでコピーしたドキュメント（session_id, enhanced_timestamp）
+        seen: Set[Tuple[Any, Any]] = set()
+        recent = {"range": {"enhanced_timestamp": {"gte": migrate_start}}}
+        if source:
+            copied = self.copy(client, source, target, {"bool": {"must_not": [recent]}})
+            caught_up = self.copy(client, source, target, recent, seen=seen)
+            # 付け替えの直前に、追いつきのコピー中に届いた分を移す
+            caught_up += self.copy(client, source, target, recent, seen=seen)
+
+        if legacy:
+            client.indices.delete(index=source)
+            actions = [{"add": {"index": target, "alias": alias}}]
+        elif source:
+            # 削除と追加を一度に行うので、検索側からは常にどちらか一方のインデックスが見える
+            actions = [{"remove": {"index": source, "alias": alias}}, {"add": {"index": target, "alias": alias}}]
+        else:
+            actions = [{"add": {"index": target, "alias": alias}}]
+        client.indices.update_aliases(body={"actions": actions})
+        print(f"🔀 Alias {alias}: {source or '(none)'} → {target}")
+
+        if source and not legacy:
+            # 付け替え前にエイリアス経由で送られ、以前のインデックスに書き込まれた分を移す
+            self._settle(client, source)
+            caught_up += self.copy(client, source, target, recent, seen=seen)
+            if delete_old:
+                client.indices.delete(index=source)
+                print(f"🗑️ Deleted {source}")
+
+        return {
+            "alias": alias,
+            "source": source,
+            "target": target,
+            "copied": copied,
+            "caught_up": caught_up,
+            "took": round(time.time() - migrate_start, 3)
+        }
+
+    def _settle(self, client, index_name: str):
+        """処理中の書き込みが検索できるようになるまで待つ（AOSSは _refresh がないので待機のみ）"""
+        try:
+            client.indices.refresh(index=index_name)
+        except Exception:
+            pass
+        if REINDEX_SETTLE_SECONDS > 0:
+            time.sleep(REINDEX_SETTLE_SECONDS)
+
+    def copy(self, client, source: str, target: str, query: Optional[Dict[str, Any]] = None,
+             seen: Optional[Set[Tuple[Any, Any]]] = None) -> int:
+        """source のドキュメントを target にコピー（_reindex を優先し、使えない環境では検索 + バルクで移す）
+
+        seen を渡した場合は検索 + バルクで移し、含まれるドキュメントを飛ばしてコピーした分を追加する
+        """
+        query = query or {"match_all": {}}
+        if seen is None:
+            try:
+                response = client.reindex(
+                    body={"source": {"index": source, "query": query}, "dest": {"index": target}},
+                    wait_for_completion=True,
+                    refresh=True
+                )
+                print(f"📦 Reindexed {response.get('total', 0)} documents {source} → {target}")
+                return response.get('total', 0)
+            except Exception as e:
+                # AOSSは _reindex・scroll を提供しないので search_after で読み出す
+                print(f"ℹ️ _reindex unavailable ({e.__class__.__name__}), copying with search + bulk")
+
+        copied = 0
+        for hits in search_after_pages(client, source, query, stable_sort(client, source), REINDEX_BATCH_SIZE):
+            sources = [hit['_source'] for hit in hits]
+            if seen is not None:
+                keys = [(doc.get('session_id'), doc.get('enhanced_timestamp')) for doc in sources]
+                sources = [doc for doc, key in zip(sources, keys) if key not in seen]
+                seen.update(keys)
+            if sources:
+                copied += self._bulk_index(client, target, sources)
+                print(f"📦 Copied {copied} documents {source} → {target}")
+        return copied
+
+    def _bulk_index(self, client, index_name: str, sources: List[Dict[str, Any]]) -> int:
+        """バルク書き込み（項目単位の一時的な失敗は指数バックオフで再送）"""
+        pending = sources
+        written = 0
+        for attempt in range(REINDEX_MAX_RETRIES + 1):
+            body = []
+            for source in pending:
+                body.append({"index": {"_index": index_name}})
+                body.append(source)
+            response = client.bulk(body=body)
+            retry = []
+            for source, item in zip(pending, response['items']):
+                status = (item.get('index') or {}).get('status', 500)
+                if status < 300:
+                    written += 1
+                elif status in RETRYABLE_STATUS:
+                    retry.append(source)
+                else:
+                    raise RuntimeError(f"Copy failed for {source.get('session_id')}: {item}")
+            if not retry:
+                return written
+            pending = retry
+            time.sleep(min(30.0, 0.5 * (2 ** attempt)))
+        raise RuntimeError(f"Copy gave up after {REINDEX_MAX_RETRIES} retries ({len(pending)} documents)")
+
+    def status(self, index_names: Iterable[str]) -> Dict[str, Any]:
+        indices = {}
+        for name in index_names:
+            drift = self.drift(name)
+            indices[name] = {
+                "schema_version": self.versions.get(name),
+                "expected_version": SCHEMA_VERSION,
+                "detected": name in self.field_types,
+                "drift": {path: {"actual": actual, "expected": expected} for path, (actual, expected) in drift.items()}
+            }
+        return {
+            "indices": indices,
+            "keyword_fields": sorted(self.keyword_fields),
+            "detected_at": self.detected_at
+        }
+
+def search_after_pages(client, index: str, query: Dict[str, Any], sort: List[Any],
+                       size: int, source: Any = True) -> Iterator[List[Dict[str, Any]]]:
+    """search_after で全件をページごとに読み出す（from / size と違い max_result_window の制限を受けない）
+
+    sort は一意になるようにタイブレーカーまで含めて指定する（ブロッキング）
+    """
+    search_after = None
+    while True:
+        body: Dict[str, Any] = {"query": query, "size": size, "sort": sort, "_source": source}
+        if search_after is not None:
+            body["search_after"] = search_after
+        hits = client.search(index=index, body=body)['hits']['hits']
+        if hits:
+            yield hits
+        if len(hits) < size:
+            return
+        search_after = hits[-1]['sort']
+
+def stable_sort(client, index_name: str) -> List[Any]:
+    """ページングが途中で崩れない並び（session_id → enhanced_timestamp → _id）"""
+    sort: List[Any] = []
+    for mapping in client.indices.get_mapping(index=index_name).values():
+        types = flatten_mapping(mapping.get('mappings', {}).get('properties', {}))
+        keyword = next((field for field in ("session_id", "session_id.keyword") if types.get(field) == 'keyword'), None)
+        if keyword:
+            sort.append({keyword: "asc"})
+        break
+    sort.append({"enhanced_timestamp": {"order": "asc", "missing": "_first", "unmapped_type": "double"}})
+    sort.append({"_id": "asc"})
+    return sort
+
+def exact_match_clause(field: str, value: Any) -> Dict[str, Any]:
+    """完全一致の句（keyword フィールドがあれば term のみ、推測されたマッピングでは従来どおり3通りで照合）"""
+    keyword = schema_manager.keyword_field(field)
+    if keyword:
+        return {"term": {keyword: value}}
+    return {
+        "bool": {
+            "should": [
+                {"term": {field: value}},
+                {"term": {f"{field}.keyword": value}},
+                {"match_phrase": {field: value}}
+            ],
+            "minimum_should_match": 1
+        }
+    }
+
+# シングルトンインスタンス
+schema_manager = IndexSchemaManager()
@@ -0,0 +1,362 @@
+import os
+import json
+import time
+import random
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from app.services.opensearch_client import opensearch_client
+from app.services.index_schema import schema_manager, search_after_pages, stable_sort
+from app.services.session_store import session_store
+from app.services.passage_indexer import index_documents
+from app.services.vector_store import vector_store
+from app.services.change_feed import change_feed, change_feed_tailer
+from app.services.admission import OverloadedError
+from app.services.metrics import metrics
+
+metrics.describe("rag_ingest_documents_total", "Documents handled by the bulk writer by outcome")
+metrics.describe("rag_ingest_flushes_total", "Bulk writer flushes by trigger")
+metrics.describe("rag_ingest_retries_total", "Bulk requests retried after throttling or transport errors")
+metrics.describe("rag_ingest_queue_depth", "Documents waiting for the bulk writer")
+
+# 1回のバルク書き込みの上限（件数・バイト数）と、最初の1件を受け付けてから書き込むまでの最大待ち時間
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '100'))
+INGEST_BATCH_BYTES = int(os.getenv('INGEST_BATCH_BYTES', str(5 * 1024 * 1024)))
+INGEST_FLUSH_SECONDS = float(os.getenv('INGEST_FLUSH_SECONDS', '2'))
+# 待ち行列の上限（超えた場合は 503 + Retry-After で投入側に待ってもらう）
+INGEST_QUEUE_MAX = int(os.getenv('INGEST_QUEUE_MAX', '1000'))
+# スロットリング（429）・一時的な失敗の再試行（指数バックオフ + ジッター）
+INGEST_MAX_RETRIES = int(os.getenv('INGEST_MAX_RETRIES', '5'))
+INGEST_RETRY_BASE_SECONDS = float(os.getenv('INGEST_RETRY_BASE_SECONDS', '0.5'))
+INGEST_RETRY_MAX_SECONDS = float(os.getenv('INGEST_RETRY_MAX_SECONDS', '30'))
+# 書き込み後に講演要約のパッセージを埋め込んでベクトルストアに追加する
+INGEST_INDEX_PASSAGES = os.getenv('INGEST_INDEX_PASSAGES', 'true').lower() == 'true'
+
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+def build_enhanced_document(original: Dict[str, Any], transcript: str) -> Dict[str, Any]:
+    """元のセッションに講演要約を付けた拡張ドキュメント（元のドキュメントは残す）"""
+    enhanced = dict(original)
+    enhanced['transcript_summary'] = transcript
+    enhanced['has_detailed_content'] = True
+    enhanced['data_version'] = 'enhanced_v1'
+    enhanced['enhanced_timestamp'] = time.time()
+    return enhanced
+
+def backoff_delay(attempt: int) -> float:
+    return min(INGEST_RETRY_MAX_SECONDS, INGEST_RETRY_BASE_SECONDS * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+class PendingDocument:
+    """待ち行列の1件（セッションドキュメント、または既存セッションへの講演要約）
+
+    index_name を省略した場合は BulkWriter の既定のインデックス（セッションマップのイベント）に書き込む
+    """
+    __slots__ = ('session_id', 'source', 'transcript', 'index_name', 'size', 'queued_at')
+
+    def __init__(self, session_id: str, source: Optional[Dict[str, Any]] = None, transcript: Optional[str] = None,
+                 index_name: Optional[str] = None):
+        self.session_id = session_id
+        self.source = source
+        self.transcript = transcript
+        self.index_name = index_name
+        self.size = len(json.dumps(source, ensure_ascii=False).encode('utf-8')) if source else 0
+        self.size += len(transcript.encode('utf-8')) if transcript else 0
+        self.queued_at = time.time()
+
+class BulkWriter:
+    """管理APIから受け付けたドキュメントをまとめてバルク書き込みするバックグラウンドタスク
+
+    書き込みは専用スレッドで実行し、流入制御（チャットのOpenSearch枠）も使わないのでチャットの処理を待たせない
+    """
+    def __init__(self, index_name: str = session_store.index_name):
+        self.index_name = index_name
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        # 待ち行列から取り出して書き込み待ちのバッチ（停止時に書き込む）
+        self.collecting: List[PendingDocument] = []
+        # 書き込み中のバッチ（停止時はキャンセルせずに完了を待つ）
+        self.in_flight: Optional[asyncio.Future] = None
+        # バルク書き込み・削除・埋め込み用（既定のスレッドプールを検索と取り合わない）
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bulk-writer")
+        self.stats = {"accepted": 0, "indexed": 0, "failed": 0, "flushes": 0, "retries": 0, "last_flush_at": 0.0}
+        self.last_errors: List[Dict[str, Any]] = []
+        metrics.register_gauge("rag_ingest_queue_depth", lambda: {(): self.queue.qsize() if self.queue else 0})
+
+    def start(self):
+        if self.task is None:
+            self.queue = asyncio.Queue(maxsize=INGEST_QUEUE_MAX)
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """書き込み中のバッチの完了を待ち、待ち行列に残っているドキュメントを書き込んでから停止"""
+        if self.task is None:
+            return
+        # 書き込みは shield しているので、キャンセルされるのは次のドキュメントの待ち受けのみ
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        if self.in_flight is not None:
+            await self.in_flight
+            self.in_flight = None
+        remaining, self.collecting = self.collecting, []
+        while not self.queue.empty():
+            remaining.append(self.queue.get_nowait())
+        if remaining:
+            await self.flush(remaining, "shutdown")
+
+    def submit(self, documents: List[PendingDocument]) -> int:
+        """待ち行列に追加（入りきらない場合は何も追加せずに OverloadedError）"""
+        if self.queue is None:
+            raise RuntimeError("Bulk writer is not running")
+        free = self.queue.maxsize - self.queue.qsize()
+        if len(documents) > free:
+            # 1回分の書き込み間隔 × 待ち行列の消化に必要な回数を目安に再送してもらう
+            retry_after = max(1.0, INGEST_FLUSH_SECONDS * (self.queue.qsize() / max(INGEST_BATCH_SIZE, 1)))
+            metrics.inc("rag_ingest_documents_total", len(documents), outcome="rejected")
+            raise OverloadedError("ingestion", retry_after, "queue_full")
+        for document in documents:
+            self.queue.put_nowait(document)
+        self.stats["accepted"] += len(documents)
+        return self.queue.qsize()
+
+    async def run(self):
+        while True:
+            batch = self.collecting = [await self.queue.get()]
+            size = batch[0].size
+            flush_at = time.monotonic() + INGEST_FLUSH_SECONDS
+            reason = "interval"
+            while True:
+                if len(batch) >= INGEST_BATCH_SIZE:
+                    reason = "batch_size"
+                    break
+                if size >= INGEST_BATCH_BYTES:
+                    reason = "batch_bytes"
+                    break
+                timeout = flush_at - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    document = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(document)
+                size += document.size
+            self.collecting = []
+            # 停止時にキャンセルされても書き込みと変更ログへの記録は最後まで行う（stop が完了を待つ）
+            self.in_flight = asyncio.ensure_future(self._flush_batch(batch, reason))
+            await asyncio.shield(self.in_flight)
+            self.in_flight = None
+
+    async def _flush_batch(self, batch: List[PendingDocument], reason: str):
+        try:
+            await self.flush(batch, reason)
+        except Exception as e:
+            self.stats["failed"] += len(batch)
+            metrics.inc("rag_ingest_documents_total", len(batch), outcome="failed")
+            self._record_error("flush", repr(e))
+            print(f"❌ Bulk flush failed ({len(batch)} documents): {e!r}")
+
+    async def flush(self, batch: List[PendingDocument], reason: str):
+        """バッチをインデックスごとに分けて書き込む"""
+        flush_start = time.time()
+        await opensearch_client.initialize()
+        by_index: Dict[str, List[PendingDocument]] = {}
+        for document in batch:
+            by_index.setdefault(document.index_name or self.index_name, []).append(document)
+        for index_name, documents in by_index.items():
+            await self._flush_index(index_name, documents, reason, flush_start)
+
+        self.stats["flushes"] += 1
+        self.stats["last_flush_at"] = time.time()
+        metrics.inc("rag_ingest_flushes_total", reason=reason)
+
+    async def _flush_index(self, index_name: str, batch: List[PendingDocument], reason: str, flush_start: float):
+        loop = asyncio.get_running_loop()
+        sources = await self._resolve_sources(index_name, batch)
+        written = await loop.run_in_executor(self.executor, self._bulk_with_retry, index_name, sources)
+        if not written:
+            return
+        # パッセージはセッションマップのインデックス（既定のイベント）のみ
+        local = index_name == session_store.index_name
+        # 変更ログに記録し、このワーカーには即座に反映（他のワーカーは各自の変更ログ追跡で反映）
+        seq = change_feed.record_many("upsert", index_name, written)
+        await change_feed_tailer.poll()
+        if local and INGEST_INDEX_PASSAGES:
+            await self._index_passages([source for _, source in written])
+        print(f"📥 Bulk flush ({reason}) to {index_name}: {len(written)}/{len(batch)} documents in "
+              f"{time.time() - flush_start:.2f}s (change seq {seq})")
+
+    async def delete(self, session_ids: List[str], index_name: Optional[str] = None) -> int:
+        """セッションのドキュメント（元データ・拡張版とも）を削除して削除件数を返す（index_name 省略時は既定のインデックス）
+
+        書き込みと同じ専用スレッドで実行し、変更ログに delete を記録して各ワーカーのマップから外す
+        """
+        index_name = index_name or self.index_name
+        loop = asyncio.get_running_loop()
+        await opensearch_client.initialize()
+        deleted = await loop.run_in_executor(self.executor, self._delete_documents, index_name, session_ids)
+        if deleted:
+            seq = change_feed.record_many("delete", index_name, deleted)
+            await change_feed_tailer.poll()
+            print(f"🗑️ Deleted {len(deleted)} documents for {', '.join(session_ids)} from {index_name} (change seq {seq})")
+        if INGEST_INDEX_PASSAGES and index_name == session_store.index_name:
+            await loop.run_in_executor(self.executor, self._delete_passages, session_ids)
+        return len(deleted)
+
+    def _delete_documents(self, index_name: str, session_ids: List[str]) -> List[Tuple[str, Dict[str, Any]]]:
+        """セッションIDのドキュメントをバルクで削除（ブロッキング、専用スレッドで実行）。削除した (ドキュメントID, {session_id}) を返す"""
+        client = opensearch_client.client
+        field = schema_manager.keyword_field("session_id") or "session_id"
+        query = {"bool": {"filter": [{"terms": {field: session_ids}}]}}
+        targets = []
+        for page in search_after_pages(client, index_name, query, stable_sort(client, index_name),
+                                       INGEST_BATCH_SIZE, source=["session_id"]):
+            targets.extend((hit['_id'], {"session_id": hit['_source'].get('session_id')}) for hit in page)
+        if not targets:
+            return []
+
+        body = [{"delete": {"_index": index_name, "_id": doc_id}} for doc_id, _ in targets]
+        response = client.bulk(body=body)
+        deleted = []
+        for target, item in zip(targets, response['items']):
+            status = item.get('delete', {}).get('status', 500)
+            # 404 はすでに削除されている（変更ログには記録して各ワーカーのマップから外す）
+            if status < 300 or status == 404:
+                deleted.append(target)
+            else:
+                self._record_error(target[1]['session_id'], json.dumps(item.get('delete', {}).get('error'), ensure_ascii=False))
+        return deleted
+
+    def _delete_passages(self, session_ids: List[str]):
+        try:
+            removed = vector_store.delete(
+                vector_id for session_id in session_ids for vector_id in vector_store.session_vector_ids(session_id)
+            )
+            if removed:
+                print(f"🧭 Removed {removed} passages of deleted sessions")
+        except Exception as e:
+            print(f"⚠️ Passage removal skipped for deleted sessions: {e}")
+
+    async def _resolve_sources(self, index_name: str, batch: List[PendingDocument]) -> List[Dict[str, Any]]:
+        """講演要約は元のセッションに付けて拡張ドキュメントにする（元のセッションはマップから、なければ1回の検索でまとめて取得）"""
+        originals: Dict[str, Dict[str, Any]] = {}
+        missing = []
+        for document in batch:
+            if document.source is None:
+                # セッションマップは既定のイベントのみ
+                hit = session_store.get(document.session_id) if index_name == session_store.index_name else None
+                if hit:
+                    originals[document.session_id] = hit.session.source
+                else:
+                    missing.append(document.session_id)
+        if missing:
+            originals.update(await self._fetch_originals(index_name, missing))
+
+        sources = []
+        for document in batch:
+            if document.source is not None:
+                sources.append(document.source)
+            elif document.session_id in originals:
+                sources.append(build_enhanced_document(originals[document.session_id], document.transcript))
+            else:
+                self.stats["failed"] += 1
+                metrics.inc("rag_ingest_documents_total", outcome="failed")
+                self._record_error(document.session_id, "original session not found")
+        return sources
+
+    async def _fetch_originals(self, index_name: str, session_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        client = await opensearch_client.initialize()
+        field = schema_manager.keyword_field("session_id") or "session_id"
+        body = {"size": len(session_ids) * 2, "query": {"bool": {"filter": [{"terms": {field: session_ids}}]}}}
+        response = await asyncio.get_running_loop().run_in_executor(
+            self.executor, lambda: client.search(index=index_name, body=body)
+        )
+        originals = {}
+        for hit in response['hits']['hits']:
+            source = hit['_source']
+            # 拡張版がある場合も元のセッションを基にする
+            if source.get('session_id') and (source['session_id'] not in originals or not source.get('enhanced_timestamp')):
+                originals[source['session_id']] = source
+        return originals
+
+    def _bulk_with_retry(self, index_name: str, sources: List[Dict[str, Any]]) -> List[Tuple[str, Dict[str, Any]]]:
+        """バルク書き込み（ブロッキング、専用スレッドで実行）。書き込めた (ドキュメントID, ドキュメント) を返す
+
+        リクエスト全体の失敗と、項目単位の 429 などの一時的な失敗はバックオフして失敗した分だけ再送する
+        """
+        client = opensearch_client.client
+        written: List[Tuple[str, Dict[str, Any]]] = []
+        pending = list(sources)
+        attempt = 0
+        while pending:
+            # AOSSは任意のドキュメントIDを受け付けないので、ID なしの index 操作で追加する
+            body = []
+            for source in pending:
+                body.append({"index": {"_index": index_name}})
+                body.append(source)
+            try:
+                response = client.bulk(body=body)
+            except Exception as e:
+                status = getattr(e, 'status_code', None)
+                if (isinstance(status, int) and status not in RETRYABLE_STATUS) or attempt >= INGEST_MAX_RETRIES:
+                    raise
+                response = None
+                print(f"⚠️ Bulk request failed ({e!r}), retrying {len(pending)} documents")
+
+            retry = []
+            if response is not None:
+                for source, item in zip(pending, response['items']):
+                    result = item.get('index') or item.get('create') or {}
+                    status = result.get('status', 500)
+                    if status < 300:
+                        written.append((result['_id'], source))
+                    elif status in RETRYABLE_STATUS and attempt < INGEST_MAX_RETRIES:
+                        retry.append(source)
+                    else:
+                        self.stats["failed"] += 1
+                        metrics.inc("rag_ingest_documents_total", outcome="failed")
+                        self._record_error(source.get('session_id'), json.dumps(result.get('error'), ensure_ascii=False))
+            else:
+                retry = pending
+
+            if retry:
+                delay = backoff_delay(attempt)
+                attempt += 1
+                self.stats["retries"] += 1
+                metrics.inc("rag_ingest_retries_total")
+                print(f"⏳ Throttled: retrying {len(retry)} documents in {delay:.2f}s (attempt {attempt})")
+                time.sleep(delay)
+            pending = retry
+
+        self.stats["indexed"] += len(written)
+        metrics.inc("rag_ingest_documents_total", len(written), outcome="indexed")
+        return written
+
+    async def _index_passages(self, sources: List[Dict[str, Any]]):
+        try:
+            await index_documents(sources)
+        except Exception as e:
+            print(f"⚠️ Vector indexing skipped for bulk flush: {e}")
+
+    def _record_error(self, target: Optional[str], error: str):
+        self.last_errors.append({"target": target, "error": error, "at": time.time()})
+        del self.last_errors[:-20]
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.task is not None and not self.task.done(),
+            "index": self.index_name,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "queue_max": INGEST_QUEUE_MAX,
+            "batch_size": INGEST_BATCH_SIZE,
+            "batch_bytes": INGEST_BATCH_BYTES,
+            "flush_seconds": INGEST_FLUSH_SECONDS,
+            "stats": self.stats,
+            "last_errors": self.last_errors
+        }
+
+# シングルトンインスタンス
+bulk_writer = BulkWriter()
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import threading
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+# スコアリングルールの設定ファイルと、変更を確認する間隔（秒）
+KEYWORD_PRIORITY_RULES_PATH = os.getenv(
+    'KEYWORD_PRIORITY_RULES_PATH',
+    os.path.join(os.path.dirname(__file__), '..', '..', 'config', 'keyword_priority.json')
+)
+KEYWORD_PRIORITY_RELOAD_SECONDS = float(os.getenv('KEYWORD_PRIORITY_RELOAD_SECONDS', '5'))
+# 分類 → 基本スコア の表の上限（LLMが返す分類の表記揺れで無制限に増えないように）
+MAX_CATEGORY_ENTRIES = int(os.getenv('KEYWORD_PRIORITY_MAX_CATEGORIES', '10000'))
+
+class CategoryRule:
+    """分類文字列に対する条件（部分文字列のいずれか・すべて・いずれも含まない・完全一致）"""
+    __slots__ = ('any_of', 'all_of', 'none_of', 'equals', 'score')
+
+    def __init__(self, config: Dict[str, Any]):
+        self.any_of: Tuple[str, ...] = tuple(config.get('any_of') or ())
+        self.all_of: Tuple[str, ...] = tuple(config.get('all_of') or ())
+        self.none_of: Tuple[str, ...] = tuple(config.get('none_of') or ())
+        self.equals: Optional[str] = config.get('equals')
+        self.score = int(config['score'])
+
+    def matches(self, category: str) -> bool:
+        if self.equals is not None and category != self.equals:
+            return False
+        if self.any_of and not any(part in category for part in self.any_of):
+            return False
+        if any(part not in category for part in self.all_of):
+            return False
+        return not any(part in category for part in self.none_of)
+
+class CompiledRules:
+    """設定から作る参照表（分類 → 基本スコア、重要語の集合、文字数の重み）
+
+    グループ内は最初に一致したルールのみ、グループ間は加算（従来の if / elif の連鎖と同じ）
+    分類ごとの基本スコアは初回に計算して表に入れるので、2回目以降は辞書引きのみ
+    """
+    def __init__(self, config: Dict[str, Any], source: str = "", mtime: float = 0.0):
+        self.groups: List[Tuple[str, Tuple[CategoryRule, ...]]] = [
+            (group.get('name', f"group{position}"), tuple(CategoryRule(rule) for rule in group['rules']))
+            for position, group in enumerate(config.get('groups') or [])
+        ]
+        self.length_weight = int(config.get('length_weight', 0))
+        self.important_terms: FrozenSet[str] = frozenset(config.get('important_terms') or ())
+        self.important_term_bonus = int(config.get('important_term_bonus', 0))
+        self.category_scores: Dict[str, int] = {}
+        for category in config.get('known_categories') or ():
+            self.base_score(category)
+        self.version = config.get('version')
+        self.source = source
+        self.mtime = mtime
+        self.loaded_at = time.time()
+
+    def _evaluate(self, category: str) -> int:
+        score = 0
+        for _, rules in self.groups:
+            for rule in rules:
+                if rule.matches(category):
+                    score += rule.score
+                    break
+        return score
+
+    def base_score(self, category: str) -> int:
+        score = self.category_scores.get(category)
+        if score is None:
+            score = self._evaluate(category)
+            if len(self.category_scores) < MAX_CATEGORY_ENTRIES:
+                self.category_scores[category] = score
+        return score
+
+    def score(self, keyword: str, category: str) -> int:
+        score = self.base_score(category) + len(keyword) * self.length_weight
+        if keyword in self.important_terms:
+            score += self.important_term_bonus
+        return score
+
+    def score_many(self, keywords: Sequence[Tuple[str, str]]) -> List[int]:
+        return [self.score(keyword, category) for keyword, category in keywords]
+
+class KeywordPriorityEngine:
+    """設定ファイルの変更を検知して参照表を作り直す（再起動不要、差し替えはアトミック）"""
+    def __init__(self, path: str = KEYWORD_PRIORITY_RULES_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.rules: Optional[CompiledRules] = None
+        self.last_check = 0.0
+        self.stats = {"reloads": 0, "errors": 0}
+        self.last_error: Optional[str] = None
+
+    def load(self) -> CompiledRules:
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, encoding='utf-8') as f:
+            config = json.load(f)
+        rules = CompiledRules(config, self.path, mtime)
+        self.rules = rules
+        self.stats["reloads"] += 1
+        print(f"🏷️ Keyword priority rules loaded (version {rules.version}, {sum(len(r) for _, r in rules.groups)} rules, "
+              f"{len(rules.important_terms)} important terms)")
+        return rules
+
+    def current(self) -> CompiledRules:
+        """現在の参照表（RELOAD_SECONDS ごとにファイルの更新時刻を確認）"""
+        rules = self.rules
+        now = time.monotonic()
+        if rules is not None and now - self.last_check < KEYWORD_PRIORITY_RELOAD_SECONDS:
+            return rules
+        with self.lock:
+            if self.rules is not None and now - self.last_check < KEYWORD_PRIORITY_RELOAD_SECONDS:
+                return self.rules
+            self.last_check = now
+            try:
+                if self.rules is None or os.path.getmtime(self.path) != self.rules.mtime:
+                    self.load()
+            except Exception as e:
+                # 壊れた設定では置き換えず、直前の参照表を使い続ける
+                self.stats["errors"] += 1
+                self.last_error = repr(e)
+                print(f"⚠️ Keyword priority rules reload failed: {e}")
+                if self.rules is None:
+                    raise
+            return self.rules
+
+    def score(self, keyword: str, category: str) -> int:
+        return self.current().score(keyword, category)
+
+    def score_many(self, keywords: Sequence[Tuple[str, str]]) -> List[int]:
+        """抽出されたキーワードを同じ版の参照表でまとめて採点"""
+        return self.current().score_many(keywords)
+
+    def summary(self) -> Dict[str, Any]:
+        rules = self.rules
+        return {
+            "path": self.path,
+            "version": rules.version if rules else None,
+            "loaded_at": rules.loaded_at if rules else None,
+            "groups": [name for name, _ in rules.groups] if rules else [],
+            "important_terms": len(rules.important_terms) if rules else 0,
+            "cached_categories": len(rules.category_scores) if rules else 0,
+            "stats": self.stats,
+            "last_error": self.last_error
+        }
+
+# シングルトンインスタンス
+keyword_priority = KeywordPriorityEngine()
@@ -0,0 +1,330 @@
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import heapq
+import struct
+import time
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from app.models.search import SearchHit, Session
+from app.services.query_filters import matches_filters
+
+# スナップショット形式
+#   ヘッダー: マジック(8) バージョン(u32) バイトオーダー(u32) 文書数(u32) 語数(u32) 平均文書長(f64)
+#             + 11セクション × (オフセット u64, 長さ u64)
+#   セクション（8バイト境界に配置）:
+#     term_offsets    u32[語数+1]   term_blob 内の各語の開始位置
+#     term_blob       UTF-8       バイト順にソートした語の連結
+#     posting_offsets u32[語数+1]   各語のポスティングの開始位置
+#     posting_docs    u32[総数]     文書番号
+#     posting_tfs     f32[総数]     フィールド重み付きの出現頻度
+#     doc_lengths     f32[文書数]   フィールド重み付きの文書長（BM25の正規化用）
+#     doc_id_offsets  u32[文書数+1] doc_id_blob 内の各文書IDの開始位置
+#     doc_id_blob     UTF-8       文書IDの連結
+#     doc_flags       u8[文書数]    bit0: transcript_summary あり
+#     stored_offsets  u64[文書数+1] stored_blob 内の各文書の開始位置
+#     stored_blob     JSON        保存フィールド（_source、参照されるまでデコードしない）
+# v2: 文書IDとフラグを stored_blob から分離（上位文書でも _source を遅延デコードできるように）
+SNAPSHOT_MAGIC = b'RAGLEX\x00\x00'
+SNAPSHOT_VERSION = 2
+FLAG_HAS_TRANSCRIPT = 1
+BYTE_ORDER = 1 if sys.byteorder == 'little' else 2
+SECTIONS = [
+    "term_offsets", "term_blob", "posting_offsets", "posting_docs",
+    "posting_tfs", "doc_lengths", "doc_id_offsets", "doc_id_blob", "doc_flags",
+    "stored_offsets", "stored_blob"
+]
+HEADER_FORMAT = '<8sIIIId' + 'QQ' * len(SECTIONS)
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# search_with_transcript_content と同じフィールド重み
+FIELD_WEIGHTS = {
+    "transcript_summary": 4.0,
+    "session_id": 4.0,
+    "title": 3.0,
+    "abstract": 2.0,
+    "summary": 2.0,
+    "speakers.name": 2.0,
+    "speakers.company": 2.0,
+}
+
+# 英数字の単語 / 日本語（ひらがな・カタカナ・漢字）の連続
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+|[ぁ-ゖァ-ヺー一-龯々]+')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def tokenize(text: str) -> List[str]:
+    """英数字は単語単位、日本語は文字バイグラム（1文字の場合はユニグラム）"""
+    tokens = []
+    for run in TOKEN_PATTERN.findall(unicodedata.normalize('NFKC', text).lower()):
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+def field_values(source: Dict[str, Any], field: str) -> List[str]:
+    if field.startswith('speakers.'):
+        key = field.split('.', 1)[1]
+        return [speaker.get(key) or '' for speaker in source.get('speakers') or []]
+    value = source.get(field)
+    return [str(value)] if value else []
+
+def _align(buffer: bytearray):
+    buffer.extend(b'\x00' * (-len(buffer) % 8))
+
+def write_snapshot(path: str, documents: Iterable[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    """(文書ID, _source) からスナップショットを作成（一時ファイルに書いてアトミックに置き換え）"""
+    build_start = time.time()
+    postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+    doc_lengths = array('f')
+    doc_id_offsets = array('I', [0])
+    doc_id_blob = bytearray()
+    doc_flags = bytearray()
+    stored_offsets = array('Q', [0])
+    stored_blob = bytearray()
+
+    for doc_number, (doc_id, source) in enumerate(documents):
+        weighted_tf: Counter = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for value in field_values(source, field):
+                for token in tokenize(value):
+                    weighted_tf[token] += weight
+        for token, tf in weighted_tf.items():
+            postings[token].append((doc_number, tf))
+        doc_lengths.append(sum(weighted_tf.values()))
+
+        doc_id_blob.extend(doc_id.encode('utf-8'))
+        doc_id_offsets.append(len(doc_id_blob))
+        doc_flags.append(FLAG_HAS_TRANSCRIPT if source.get('transcript_summary') else 0)
+        stored_blob.extend(json.dumps(source, ensure_ascii=False).encode('utf-8'))
+        stored_offsets.append(len(stored_blob))
+
+    doc_count = len(doc_lengths)
+    # バイト列の順序でソートしておき、読み込み時はバイト比較の二分探索で語を引く
+    terms = sorted(postings, key=lambda term: term.encode('utf-8'))
+    term_offsets = array('I', [0])
+    term_blob = bytearray()
+    posting_offsets = array('I', [0])
+    posting_docs = array('I')
+    posting_tfs = array('f')
+    for term in terms:
+        term_blob.extend(term.encode('utf-8'))
+        term_offsets.append(len(term_blob))
+        for doc_number, tf in postings[term]:
+            posting_docs.append(doc_number)
+            posting_tfs.append(tf)
+        posting_offsets.append(len(posting_docs))
+
+    section_bytes = {
+        "term_offsets": term_offsets.tobytes(),
+        "term_blob": bytes(term_blob),
+        "posting_offsets": posting_offsets.tobytes(),
+        "posting_docs": posting_docs.tobytes(),
+        "posting_tfs": posting_tfs.tobytes(),
+        "doc_lengths": doc_lengths.tobytes(),
+        "doc_id_offsets": doc_id_offsets.tobytes(),
+        "doc_id_blob": bytes(doc_id_blob),
+        "doc_flags": bytes(doc_flags),
+        "stored_offsets": stored_offsets.tobytes(),
+        "stored_blob": bytes(stored_blob),
+    }
+
+    body = bytearray(b'\x00' * HEADER_SIZE)
+    _align(body)
+    section_table = []
+    for name in SECTIONS:
+        offset = len(body)
+        body.extend(section_bytes[name])
+        section_table.extend([offset, len(section_bytes[name])])
+        _align(body)
+
+    avg_doc_length = (sum(doc_lengths) / doc_count) if doc_count else 0.0
+    struct.pack_into(
+        HEADER_FORMAT, body, 0,
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, BYTE_ORDER, doc_count, len(terms), avg_doc_length, *section_table
+    )
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+    stats = {"documents": doc_count, "terms": len(terms), "postings": len(posting_docs), "bytes": len(body)}
+    print(f"💽 Wrote lexical snapshot {path} {stats} in {time.time() - build_start:.2f}s")
+    return stats
+
+class LexicalIndex:
+    """mmapで開いたスナップショットに対するBM25検索（読み込みはゼロコピー）
+
+    チャットの検索には使っていないのでワーカーでは開かない（scripts/build_lexical_snapshot.py で作成・計測する）
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.mmap = None
+        self.inode = None
+        self.doc_count = 0
+        self.term_count = 0
+        self.avg_doc_length = 0.0
+        self.sections: Dict[str, memoryview] = {}
+
+    @property
+    def available(self) -> bool:
+        return self.open()
+
+    def open(self) -> bool:
+        """スナップショットを開く（ファイルが置き換えられていれば開き直す）"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if self.mmap is not None and self.inode == (stat.st_ino, stat.st_mtime_ns):
+            return True
+
+        open_start = time.time()
+        file = open(self.path, 'rb')
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = struct.unpack_from(HEADER_FORMAT, mapped, 0)
+        magic, version, byte_order, doc_count, term_count, avg_doc_length = header[:6]
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            mapped.close()
+            file.close()
+            raise ValueError(f"Unsupported lexical snapshot: {magic!r} v{version}")
+        if byte_order != BYTE_ORDER:
+            mapped.close()
+            file.close()
+            raise ValueError("Lexical snapshot was written with a different byte order")
+
+        view = memoryview(mapped)
+        formats = {
+            "term_offsets": 'I', "posting_offsets": 'I', "posting_docs": 'I',
+            "posting_tfs": 'f', "doc_lengths": 'f', "doc_id_offsets": 'I', "doc_flags": 'B',
+            "stored_offsets": 'Q'
+        }
+        sections = {}
+        for index, name in enumerate(SECTIONS):
+            offset, length = header[6 + index * 2], header[7 + index * 2]
+            section = view[offset:offset + length]
+            sections[name] = section.cast(formats[name]) if name in formats else section
+
+        # 古いマップは参照がなくなった時点で解放される（検索中のリクエストはそのまま読み続けられる）
+        self.file, self.mmap, self.sections = file, mapped, sections
+        self.inode = (stat.st_ino, stat.st_mtime_ns)
+        self.doc_count, self.term_count, self.avg_doc_length = doc_count, term_count, avg_doc_length
+        print(f"💽 Lexical snapshot opened ({doc_count} docs, {term_count} terms) in {(time.time() - open_start) * 1000:.2f}ms")
+        return True
+
+    def close(self):
+        if self.mmap is None:
+            return
+        self.sections = {}
+        try:
+            self.mmap.close()
+        except BufferError:
+            # 参照中のビューがある場合はGCに任せる
+            pass
+        self.file.close()
+        self.mmap = None
+        self.file = None
+        self.inode = None
+
+    def _term_bytes(self, term_number: int) -> bytes:
+        offsets = self.sections["term_offsets"]
+        return self.sections["term_blob"][offsets[term_number]:offsets[term_number + 1]].tobytes()
+
+    def find_term(self, term: str) -> int:
+        """語の番号を二分探索（見つからない場合は -1）"""
+        target = term.encode('utf-8')
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term_bytes(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self._term_bytes(low) == target:
+            return low
+        return -1
+
+    def doc_id(self, doc_number: int) -> str:
+        offsets = self.sections["doc_id_offsets"]
+        return self.sections["doc_id_blob"][offsets[doc_number]:offsets[doc_number + 1]].tobytes().decode('utf-8')
+
+    def document(self, doc_number: int) -> Session:
+        """保存フィールドを遅延デコードするセッション（mmap上のバイト列を参照するだけでコピーしない）"""
+        offsets = self.sections["stored_offsets"]
+        return Session.from_encoded(self.sections["stored_blob"][offsets[doc_number]:offsets[doc_number + 1]])
+
+    def search(self, query_text: str, size: int = 5, source_fields: Optional[List[str]] = None,
+               filters: Optional[Dict[str, str]] = None) -> List[SearchHit]:
+        """BM25で上位 size 件を返す（search_with_transcript_content と同じ結果型）
+
+        ローカルでは転送量がないため source_fields は使わず、参照されたフィールドだけを遅延デコードする
+        filters はスコア順に候補を確認し、条件に合うものだけを size 件まで残す
+        """
+        if not self.open():
+            return []
+
+        posting_offsets = self.sections["posting_offsets"]
+        posting_docs = self.sections["posting_docs"]
+        posting_tfs = self.sections["posting_tfs"]
+        doc_lengths = self.sections["doc_lengths"]
+
+        scores: Dict[int, float] = defaultdict(float)
+        for token, query_tf in Counter(tokenize(query_text)).items():
+            term_number = self.find_term(token)
+            if term_number < 0:
+                continue
+            start, end = posting_offsets[term_number], posting_offsets[term_number + 1]
+            idf = math.log(1 + (self.doc_count - (end - start) + 0.5) / ((end - start) + 0.5))
+            for position in range(start, end):
+                doc_number = posting_docs[position]
+                tf = posting_tfs[position]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[doc_number] / (self.avg_doc_length or 1.0))
+                scores[doc_number] += query_tf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        doc_flags = self.sections["doc_flags"]
+        if filters:
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        else:
+            ranked = heapq.nlargest(size, scores.items(), key=lambda item: item[1])
+
+        hits: List[SearchHit] = []
+        for doc_number, score in ranked:
+            session = self.document(doc_number)
+            if filters and not matches_filters(session.source, filters):
+                continue
+            hits.append(SearchHit(
+                self.doc_id(doc_number), score, session,
+                has_transcript=bool(doc_flags[doc_number] & FLAG_HAS_TRANSCRIPT)
+            ))
+            if len(hits) >= size:
+                break
+        return hits
+
+    def summary(self) -> Dict[str, Any]:
+        available = self.open()
+        return {
+            "path": self.path,
+            "available": available,
+            "format_version": SNAPSHOT_VERSION,
+            "documents": self.doc_count if available else 0,
+            "terms": self.term_count if available else 0,
+            "bytes": len(self.mmap) if available else 0,
+        }
+
+def snapshot_path() -> str:
+    return os.getenv(
+        'LEXICAL_SNAPSHOT_PATH',
+        os.path.join(os.path.dirname(__file__), '..', '..', 'snapshots', 'aws_summit_sessions.lex')
+    )
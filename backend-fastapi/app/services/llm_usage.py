@@ -0,0 +1,113 @@
+import os
+import json
+import contextvars
+from typing import Any, Dict, List, Optional
+from app.models.generation import GenerationResult
+from app.services.metrics import metrics
+
+metrics.describe("rag_llm_calls_total", "Bedrock generation calls by model, stage and outcome")
+metrics.describe("rag_llm_tokens_total", "Bedrock tokens consumed by model, stage and direction")
+metrics.describe("rag_llm_cost_usd_total", "Estimated Bedrock cost in USD by model and stage")
+metrics.describe("rag_llm_budget_rejections_total", "Prompts rejected before the Bedrock call by token budget")
+
+# 1000トークンあたりの単価（USD、オンデマンド料金）。LLM_PRICING_JSON で上書き可能
+# 例: {"anthropic.claude-3-haiku-20240307-v1:0": {"input": 0.00025, "output": 0.00125}}
+DEFAULT_PRICING = {
+    "anthropic.claude-3-haiku-20240307-v1:0": {"input": 0.00025, "output": 0.00125},
+    "anthropic.claude-v2:1": {"input": 0.008, "output": 0.024},
+}
+MODEL_PRICING: Dict[str, Dict[str, float]] = {**DEFAULT_PRICING, **json.loads(os.getenv('LLM_PRICING_JSON') or '{}')}
+
+# 1回の呼び出しに送るプロンプトの上限トークン数（0 の場合は無制限）
+LLM_MAX_PROMPT_TOKENS = int(os.getenv('LLM_MAX_PROMPT_TOKENS', '0'))
+# 1リクエスト（キーワード抽出 + 回答生成）の入出力トークンの合計上限（0 の場合は無制限、ChatRequest.token_budget で上書き）
+LLM_REQUEST_TOKEN_BUDGET = int(os.getenv('LLM_REQUEST_TOKEN_BUDGET', '0'))
+
+def estimate_cost(model_id: str, input_tokens: int, output_tokens: int) -> float:
+    pricing = MODEL_PRICING.get(model_id)
+    if not pricing:
+        return 0.0
+    return (input_tokens * pricing.get("input", 0.0) + output_tokens * pricing.get("output", 0.0)) / 1000
+
+class TokenBudgetExceededError(Exception):
+    """プロンプトがトークン予算を超えるため送信しない（413 で返す）"""
+    def __init__(self, stage: str, prompt_tokens: int, limit: int):
+        super().__init__(f"Prompt for {stage} needs ~{prompt_tokens} tokens, budget allows {limit}")
+        self.stage = stage
+        self.prompt_tokens = prompt_tokens
+        self.limit = limit
+
+class RequestUsage:
+    """1リクエスト内のLLM呼び出しの使用量とトークン予算"""
+    def __init__(self, token_budget: int = LLM_REQUEST_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.calls: List[GenerationResult] = []
+
+    @property
+    def input_tokens(self) -> int:
+        return sum(call.input_tokens for call in self.calls)
+
+    @property
+    def output_tokens(self) -> int:
+        return sum(call.output_tokens for call in self.calls)
+
+    @property
+    def cost_usd(self) -> float:
+        return sum(call.cost_usd for call in self.calls)
+
+    def remaining(self) -> Optional[int]:
+        """予算の残り（予算なしの場合は None）"""
+        if not self.token_budget:
+            return None
+        return max(self.token_budget - self.input_tokens - self.output_tokens, 0)
+
+    def prompt_limit(self, max_output_tokens: int) -> Optional[int]:
+        """次の呼び出しに送れるプロンプトのトークン数（出力分を差し引く）"""
+        limits = []
+        if LLM_MAX_PROMPT_TOKENS:
+            limits.append(LLM_MAX_PROMPT_TOKENS)
+        remaining = self.remaining()
+        if remaining is not None:
+            limits.append(max(remaining - max_output_tokens, 0))
+        return min(limits) if limits else None
+
+    def record(self, result: GenerationResult):
+        self.calls.append(result)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "token_budget": self.token_budget or None,
+            "calls": [call.to_dict() for call in self.calls]
+        }
+
+current_usage: contextvars.ContextVar[Optional[RequestUsage]] = contextvars.ContextVar('current_usage', default=None)
+
+def start_usage(token_budget: Optional[int] = None) -> RequestUsage:
+    usage = RequestUsage(LLM_REQUEST_TOKEN_BUDGET if token_budget is None else token_budget)
+    current_usage.set(usage)
+    return usage
+
+def get_usage() -> Optional[RequestUsage]:
+    return current_usage.get()
+
+def check_prompt_budget(stage: str, prompt_tokens: int, max_output_tokens: int):
+    """送信前にプロンプトのトークン数を予算と照合（超える場合は TokenBudgetExceededError）"""
+    usage = current_usage.get()
+    limit = usage.prompt_limit(max_output_tokens) if usage else LLM_MAX_PROMPT_TOKENS or None
+    if limit is not None and prompt_tokens > limit:
+        metrics.inc("rag_llm_budget_rejections_total", stage=stage)
+        raise TokenBudgetExceededError(stage, prompt_tokens, limit)
+
+def record_generation(result: GenerationResult, outcome: str = "success"):
+    """呼び出し結果をリクエストの使用量とモデル・段階別のカウンタに加算"""
+    metrics.inc("rag_llm_calls_total", model=result.model_id, stage=result.stage, outcome=outcome)
+    if not result.cached:
+        metrics.inc("rag_llm_tokens_total", result.input_tokens, model=result.model_id, stage=result.stage, direction="input")
+        metrics.inc("rag_llm_tokens_total", result.output_tokens, model=result.model_id, stage=result.stage, direction="output")
+        metrics.inc("rag_llm_cost_usd_total", result.cost_usd, model=result.model_id, stage=result.stage)
+    usage = current_usage.get()
+    if usage is not None:
+        usage.record(result)
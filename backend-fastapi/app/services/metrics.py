@@ -0,0 +1,82 @@
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(label_key: LabelKey) -> str:
+    if not label_key:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in label_key)
+    return "{" + pairs + "}"
+
+class MetricsRegistry:
+    """プロセス内のカウンタ・ゲージ（/metrics でPrometheusテキスト形式として出力）"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self.gauge_callbacks: Dict[str, Callable[[], Dict[LabelKey, float]]] = {}
+        self.help_texts: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str):
+        self.help_texts[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def register_gauge(self, name: str, callback: Callable[[], Dict[LabelKey, float]]):
+        """出力時に値を計算するゲージ（キュー長など）"""
+        self.gauge_callbacks[name] = callback
+
+    def get(self, name: str, **labels) -> float:
+        key = _label_key(labels)
+        with self.lock:
+            if name in self.counters:
+                return self.counters[name].get(key, 0.0)
+            return self.gauges.get(name, {}).get(key, 0.0)
+
+    def _collect(self) -> Tuple[Dict[str, Dict[LabelKey, float]], Dict[str, Dict[LabelKey, float]]]:
+        with self.lock:
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            gauges = {name: dict(series) for name, series in self.gauges.items()}
+        for name, callback in self.gauge_callbacks.items():
+            try:
+                gauges[name] = callback()
+            except Exception as e:
+                print(f"⚠️ Metrics gauge {name} failed: {e}")
+        return counters, gauges
+
+    def render(self) -> str:
+        counters, gauges = self._collect()
+        lines = []
+        for metric_type, metrics in (("counter", counters), ("gauge", gauges)):
+            for name in sorted(metrics):
+                if name in self.help_texts:
+                    lines.append(f"# HELP {name} {self.help_texts[name]}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for label_key, value in sorted(metrics[name].items()):
+                    lines.append(f"{name}{_format_labels(label_key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        counters, gauges = self._collect()
+        return {
+            metric_type: {
+                name: {(_format_labels(label_key) or "total"): value for label_key, value in series.items()}
+                for name, series in metrics.items()
+            }
+            for metric_type, metrics in (("counters", counters), ("gauges", gauges))
+        }
+
+# シングルトンインスタンス
+metrics = MetricsRegistry()
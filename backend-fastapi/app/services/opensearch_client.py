@@ -1,13 +1,189 @@
 import os
+import re
+import time
+import asyncio
+import threading
 import boto3
 from opensearchpy import OpenSearch, RequestsHttpConnection
 from requests_aws4auth import AWS4Auth
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+from app.services.shared_cache import shared_cache
+from app.services.admission import admission_controller
+from app.services.deadline import stage_timeout
+from app.services.query_filters import build_filter_clauses
+from app.services.index_schema import schema_manager
+from app.services.profiler import in_stage
+
+# セッションID（例: AWS-08, KEY-01）のパターン
+SESSION_ID_PATTERN = re.compile(r'^[A-Z]+-\d+$')
+
+# ハイブリッド検索の should 句の名前（プロファイル結果のラベル用、ngram はマッピングに n-gram サブフィールドがある場合のみ）
+TRANSCRIPT_QUERY_CLAUSES = ["phrase_multi_match", "best_fields_multi_match", "ngram_multi_match"]
+
+# transcript_summary をハイライト断片で返す場合の断片サイズ（文字数）
+TRANSCRIPT_FRAGMENT_SIZE = int(os.getenv('TRANSCRIPT_FRAGMENT_SIZE', '300'))
+
+def search_result(hit: Dict[str, Any], explain: bool = False) -> Dict[str, Any]:
+    """OpenSearchのヒットを検索結果の辞書に変換（_source はコピーせずに参照する）
+
+    {'id', 'score', 'source'} に講演要約のハイライト断片・有無と explain を必要な場合のみ加える
+    （共有キャッシュ・APIレスポンスと同じ形式。保存済みのドキュメントは SearchHit.to_dict() で同じ形式になる）
+    """
+    source = hit.get('_source') or {}
+    result = {'id': hit['_id'], 'score': hit['_score'], 'source': source}
+    highlight = hit.get('highlight')
+    fragments = highlight.get('transcript_summary') if highlight else None
+    if fragments:
+        result['transcript_fragments'] = fragments
+    # transcript_summaryがマッチした場合は特別にマーク
+    if fragments or source.get('transcript_summary'):
+        result['has_transcript'] = True
+    if explain and '_explanation' in hit:
+        result['explanation'] = hit['_explanation']
+    return result
+
+class TimedDeserializer:
+    """レスポンスJSONのデコード時間を計測するデシリアライザのラッパー"""
+    def __init__(self, deserializer):
+        self.deserializer = deserializer
+        # 検索はワーカースレッドで実行されるのでスレッドごとに保持
+        self.local = threading.local()
+
+    @property
+    def last_decode_time(self) -> float:
+        return getattr(self.local, 'last_decode_time', 0.0)
+
+    def loads(self, s, mimetype=None):
+        decode_start = time.time()
+        try:
+            return self.deserializer.loads(s, mimetype)
+        finally:
+            self.local.last_decode_time = time.time() - decode_start
+
+def is_session_id(query_text: str) -> bool:
+    """クエリ全体がセッションIDかどうか"""
+    return bool(SESSION_ID_PATTERN.match(query_text.strip()))
+
+def build_session_id_query(session_id: str, size: int = 5) -> Dict[str, Any]:
+    """セッションID完全一致用のクエリ（マッピングが text / keyword のどちらでも動くように）
+
+    session_id が keyword としてマッピングされている場合は、スコア計算なしの filter 句（キャッシュ対象）のみ
+    """
+    session_id = session_id.strip()
+    if schema_manager.keyword_field("session_id") == "session_id":
+        return {"size": size, "query": {"bool": {"filter": [{"term": {"session_id": session_id}}]}}}
+    return {
+        "size": size,
+        "query": {
+            "bool": {
+                "should": [
+                    {"term": {"session_id": session_id}},
+                    {"term": {"session_id.keyword": session_id}},
+                    {"match_phrase": {"session_id": session_id}}
+                ],
+                "minimum_should_match": 1
+            }
+        }
+    }
+
+def apply_payload_options(body: Dict[str, Any], source_fields: Optional[List[str]] = None,
+                          transcript_fragments: int = 0) -> Dict[str, Any]:
+    """_source の射影と transcript_summary のハイライト断片指定をクエリに追加"""
+    body = dict(body)
+    
+    if source_fields is not None:
+        includes = list(source_fields)
+        if transcript_fragments > 0 and 'transcript_summary' in includes:
+            # 断片で返すので全文は転送しない
+            includes.remove('transcript_summary')
+        body["_source"] = {"includes": includes} if includes else False
+    elif transcript_fragments > 0:
+        body["_source"] = {"excludes": ["transcript_summary"]}
+    
+    if transcript_fragments > 0:
+        body["highlight"] = {
+            "pre_tags": [""],
+            "post_tags": [""],
+            "fields": {
+                "transcript_summary": {
+                    "fragment_size": TRANSCRIPT_FRAGMENT_SIZE,
+                    "number_of_fragments": transcript_fragments,
+                    # マッチしない場合も先頭部分を返す
+                    "no_match_size": TRANSCRIPT_FRAGMENT_SIZE
+                }
+            }
+        }
+    
+    return body
+
+def _ns_to_ms(value: int) -> float:
+    return round(value / 1_000_000, 3)
+
+def summarize_profile(response: Dict[str, Any], wall_time: float, decode_time: float,
+                      clause_labels: Optional[List[str]] = None) -> Dict[str, Any]:
+    """OpenSearchのprofile結果を段階別の内訳に要約"""
+    took_ms = response.get('took', 0)
+    wall_ms = wall_time * 1000
+    decode_ms = decode_time * 1000
+    
+    rewrite_ns = 0
+    collector_ns = 0
+    clauses: Dict[int, Dict[str, Any]] = {}
+    
+    for shard in response.get('profile', {}).get('shards', []):
+        for search in shard.get('searches', []):
+            rewrite_ns += search.get('rewrite_time', 0)
+            for collector in search.get('collector', []):
+                collector_ns += collector.get('time_in_nanos', 0)
+            
+            for root in search.get('query', []):
+                # bool クエリの場合は子要素（should 句）ごとに集計
+                children = root.get('children') or [root]
+                for position, node in enumerate(children):
+                    clause = clauses.setdefault(position, {
+                        "clause": clause_labels[position] if clause_labels and position < len(clause_labels) else f"clause_{position}",
+                        "type": node.get('type'),
+                        "description": node.get('description', '')[:200],
+                        "time_ns": 0,
+                        "breakdown_ns": {}
+                    })
+                    clause["time_ns"] += node.get('time_in_nanos', 0)
+                    for key, value in node.get('breakdown', {}).items():
+                        # *_count はスキップして時間だけ合計
+                        if key.endswith('_count'):
+                            continue
+                        clause["breakdown_ns"][key] = clause["breakdown_ns"].get(key, 0) + value
+    
+    clause_summaries = []
+    for position in sorted(clauses):
+        clause = clauses[position]
+        clause_summaries.append({
+            "clause": clause["clause"],
+            "type": clause["type"],
+            "description": clause["description"],
+            "time_ms": _ns_to_ms(clause["time_ns"]),
+            "breakdown_ms": {
+                key: _ns_to_ms(value)
+                for key, value in sorted(clause["breakdown_ns"].items(), key=lambda x: x[1], reverse=True)
+                if value > 0
+            }
+        })
+    
+    return {
+        "wall_ms": round(wall_ms, 3),
+        "server_took_ms": took_ms,
+        "network_ms": round(max(wall_ms - took_ms - decode_ms, 0.0), 3),
+        "json_decode_ms": round(decode_ms, 3),
+        "query_rewrite_ms": _ns_to_ms(rewrite_ns),
+        "collector_ms": _ns_to_ms(collector_ns),
+        "clauses": clause_summaries
+    }
 
 class OpenSearchClient:
     def __init__(self):
         self.client = None
         self.endpoint = None
+        self.deserializer = None
         
     async def initialize(self):
         if self.client:
@@ -42,8 +218,128 @@ class OpenSearchClient:
             timeout=30
         )
         
+        # JSONデコード時間を計測できるようにデシリアライザを差し替え
+        self.deserializer = TimedDeserializer(self.client.transport.deserializer)
+        self.client.transport.deserializer = self.deserializer
+        
         return self.client
     
+    async def execute_search(self, index_name: str, body: Dict[str, Any], profile: bool = False,
+                             explain: bool = False, clause_labels: Optional[List[str]] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """検索を実行し、必要に応じてプロファイル情報を返す
+        
+        ブロッキングするHTTP呼び出しはスレッドで実行し、同時実行数は流入制御で制限する
+        """
+        client = await self.initialize()
+        
+        if profile or explain:
+            body = dict(body)
+            if profile:
+                body["profile"] = True
+            if explain:
+                body["explain"] = True
+        
+        def timed_search(timeout: float):
+            search_start = time.time()
+            response = client.search(index=index_name, body=body, request_timeout=timeout)
+            return response, time.time() - search_start, self.deserializer.last_decode_time
+        
+        # 予算が残っていなければ実行枠を待たずに失敗させる（DeadlineExceededError）
+        stage_timeout("search", 30)
+        async with admission_controller.slot("opensearch"):
+            # 実行枠の待ち時間を差し引いた残り予算をタイムアウトとして渡す（締め切りがなければクライアント既定の30秒）
+            timeout = stage_timeout("search", 30)
+            response, wall_time, decode_time = await asyncio.to_thread(in_stage(timed_search), timeout)
+        
+        if not profile:
+            return response, None
+        
+        profile_summary = summarize_profile(response, wall_time, decode_time, clause_labels)
+        print(f"🧪 Profile: wall {profile_summary['wall_ms']}ms, took {profile_summary['server_took_ms']}ms, "
+              f"network {profile_summary['network_ms']}ms, decode {profile_summary['json_decode_ms']}ms")
+        return response, profile_summary
+    
+    def build_transcript_search_query(self, query_text: str, size: int = 5, min_score: float = 0.001,
+                                      filters: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """チャットで実際に使用するハイブリッド検索クエリを構築
+        
+        filters（トラック・日付・レベル・企業）はスコアに関与しない bool.filter 句として追加する
+        フィルタは候補を絞るだけで、本文のいずれかの句に一致しないセッションはヒットにしない
+        （0件でフォールバック候補を判定するため）。質問文が空の場合のみ条件に合うセッションを一覧する
+        """
+        if is_session_id(query_text):
+            # セッションID専用の検索クエリ
+            return build_session_id_query(query_text, size)
+        
+        filter_clauses = build_filter_clauses(filters)
+        if not query_text.strip():
+            # 条件のみの検索（「6月26日のセッション」から条件を除くと何も残らない場合など）
+            return {
+                "size": size,
+                "query": {"bool": {"filter": filter_clauses}} if filter_clauses else {"match_all": {}}
+            }
+        
+        # ハイブリッド検索クエリ（構造化データ + 非構造化データ）
+        query = {
+            "size": size,
+            "min_score": min_score,
+            "query": {
+                "bool": {
+                    "should": [
+                        # フレーズマッチング（高精度）
+                        {
+                            "multi_match": {
+                                "query": query_text,
+                                "fields": [
+                                    "transcript_summary^4.0",  # 最高優先度
+                                    "title^3.0",
+                                    "abstract^2.0"
+                                ],
+                                "type": "phrase",
+                                "boost": 2.0
+                            }
+                        },
+                        # 通常のキーワード検索
+                        {
+                            "multi_match": {
+                                "query": query_text,
+                                "fields": [
+                                    "transcript_summary^4.0",
+                                    "session_id^4.0",
+                                    "title^3.0",
+                                    "abstract^2.0",
+                                    "summary^2.0",
+                                    "speakers.name^2.0",
+                                    "speakers.company^2.0"
+                                ],
+                                "type": "best_fields",
+                                "boost": 1.0
+                            }
+                        }
+                    ],
+                    "minimum_should_match": 1
+                }
+            }
+        }
+        
+        if schema_manager.has_field("title.ngram") and schema_manager.has_field("transcript_summary.ngram"):
+            # 形態素解析で分割がずれる複合語・表記揺れの部分一致（低い重みで補助的に加点）
+            query["query"]["bool"]["should"].append({
+                "multi_match": {
+                    "query": query_text,
+                    "fields": [
+                        "transcript_summary.ngram^2.0",
+                        "title.ngram^1.5"
+                    ],
+                    "type": "best_fields",
+                    "boost": 0.5
+                }
+            })
+        
+        if filter_clauses:
+            query["query"]["bool"]["filter"] = filter_clauses
+        return query
+    
     async def test_connection(self):
         """接続テスト用メソッド"""
         try:
@@ -58,20 +354,9 @@ class OpenSearchClient:
         """改良版検索（セッションID対応）"""
         client = await self.initialize()
     
-        # セッションIDパターンを検出
-        import re
-        is_session_id = re.match(r'^[A-Z]+-\d+\\$', query_text.strip())
-    
-        if is_session_id:
+        if is_session_id(query_text):
             # セッションID専用の検索クエリ
-            search_query = {
-                "size": size,
-                "query": {
-                    "term": {
-                        "session_id": query_text
-                    }
-                }
-            }
+            search_query = build_session_id_query(query_text, size)
             print(f"🔍 Using session ID search for: {query_text}")
         else:
             # 通常の検索クエリ（session_idフィールドを追加）
@@ -99,13 +384,7 @@ class OpenSearchClient:
             response = client.search(index=index_name, body=search_query)
             hits = response['hits']['hits']
         
-            results = []
-            for hit in hits:
-                results.append({
-                    'id': hit['_id'],
-                    'score': hit['_score'],
-                    'source': hit['_source']
-                })
+            results = [search_result(hit) for hit in hits]
         
             print(f"📊 Found {len(results)} results")
             for result in results:
@@ -117,92 +396,62 @@ class OpenSearchClient:
             print(f"❌ Error in search: {error}")
             raise error
 
-    async def search_with_transcript_content(self, index_name: str, query_text: str, size: int = 5, min_score: float = 0.001) -> List[Dict[str, Any]]:
-        """非構造化データ対応のハイブリッド検索（transcript_summary含む）"""
-        client = await self.initialize()
-    
-        # セッションIDパターンを検出
-        import re
-        is_session_id = re.match(r'^[A-Z]+-\d+\\$', query_text.strip())
-    
-        if is_session_id:
-            # セッションID専用の検索クエリ
-            search_query = {
-                "size": size,
-                "query": {
-                    "term": {
-                        "session_id": query_text
-                    }
-                }
-            }
+    async def search_with_transcript_content(self, index_name: str, query_text: str, size: int = 5, min_score: float = 0.001,
+                                             profile_log: Optional[List[Dict[str, Any]]] = None, explain: bool = False,
+                                             source_fields: Optional[List[str]] = None,
+                                             transcript_fragments: int = 0,
+                                             filters: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        """非構造化データ対応のハイブリッド検索（transcript_summary含む）
+        
+        profile_log を渡すと profile: true で検索し、段階別の内訳を追記する
+        source_fields で返却フィールドを限定し、transcript_fragments > 0 の場合は
+        transcript_summary を全文ではなくハイライト断片（transcript_fragments）で返す
+        """
+        search_query = apply_payload_options(
+            self.build_transcript_search_query(query_text, size, min_score, filters),
+            source_fields,
+            transcript_fragments
+        )
+        
+        # プロファイル・explain時は実際に検索する必要があるのでキャッシュを使わない
+        use_cache = profile_log is None and not explain
+        if use_cache:
+            cache_key = shared_cache.make_key(index_name, search_query)
+            cached_results = await shared_cache.get_async("search", cache_key)
+            if cached_results is not None:
+                print(f"💾 [Transcript Search] Cache hit for: {query_text} ({len(cached_results)} results)")
+                return cached_results
+        
+        if is_session_id(query_text):
             print(f"🔍 [Transcript Search] Using session ID search for: {query_text}")
         else:
-            # ハイブリッド検索クエリ（構造化データ + 非構造化データ）
-            search_query = {
-                "size": size,
-                "min_score": min_score,
-                "query": {
-                    "bool": {
-                        "should": [
-                            # フレーズマッチング（高精度）
-                            {
-                                "multi_match": {
-                                    "query": query_text,
-                                    "fields": [
-                                        "transcript_summary^4.0",  # 最高優先度
-                                        "title^3.0",
-                                        "abstract^2.0"
-                                    ],
-                                    "type": "phrase",
-                                    "boost": 2.0
-                                }
-                            },
-                            # 通常のキーワード検索
-                            {
-                                "multi_match": {
-                                    "query": query_text,
-                                    "fields": [
-                                        "transcript_summary^4.0",
-                                        "session_id^4.0",
-                                        "title^3.0",
-                                        "abstract^2.0",
-                                        "summary^2.0",
-                                        "speakers.name^2.0",
-                                        "speakers.company^2.0"
-                                    ],
-                                    "type": "best_fields",
-                                    "boost": 1.0
-                                }
-                            }
-                        ],
-                        "minimum_should_match": 1
-                    }
-                }
-            }
             print(f"🔍 [Transcript Search] Using hybrid search for: {query_text}")
     
         try:
-            response = client.search(index=index_name, body=search_query)
+            response, profile_summary = await self.execute_search(
+                index_name,
+                search_query,
+                profile=profile_log is not None,
+                explain=explain,
+                clause_labels=TRANSCRIPT_QUERY_CLAUSES
+            )
             hits = response['hits']['hits']
         
-            results = []
-            for hit in hits:
-                result_data = {
-                    'id': hit['_id'],
-                    'score': hit['_score'],
-                    'source': hit['_source']
-                }
-                
-                # transcript_summaryがマッチした場合は特別にマーク
-                if 'transcript_summary' in hit['_source'] and hit['_source']['transcript_summary']:
-                    result_data['has_transcript'] = True
-                
-                results.append(result_data)
+            results = [search_result(hit, explain) for hit in hits]
         
             print(f"📊 [Transcript Search] Found {len(results)} results")
             for result in results:
                 transcript_mark = "📄" if result.get('has_transcript') else "📋"
                 print(f"  {transcript_mark} {result['source'].get('session_id')}: {result['source'].get('title')} (score: {result['score']})")
+            
+            if profile_log is not None:
+                profile_summary['query'] = query_text
+                profile_summary['index'] = index_name
+                profile_summary['hits'] = len(results)
+                profile_log.append(profile_summary)
+            
+            if use_cache:
+                await shared_cache.set_async("search", cache_key, results)
         
             return results
         
@@ -0,0 +1,92 @@
+import os
+import re
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+from app.services.bedrock_client import bedrock_client
+from app.services.embedding_cache import text_hash
+from app.services.vector_store import vector_store
+
+# 1パッセージの最大文字数（見出し・段落単位で結合してこの長さ以内に収める）
+PASSAGE_MAX_CHARS = int(os.getenv('PASSAGE_MAX_CHARS', '500'))
+
+def _split_long_text(text: str, max_chars: int) -> List[str]:
+    """見出し・空行で段落に分け、max_chars 以内になるように結合"""
+    paragraphs = [p.strip() for p in re.split(r'\n\s*\n|\n(?=#)', text) if p.strip()]
+    passages: List[str] = []
+    current = ""
+    for paragraph in paragraphs:
+        while len(paragraph) > max_chars:
+            if current:
+                passages.append(current)
+                current = ""
+            passages.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + len(paragraph) + 1 > max_chars:
+            passages.append(current)
+            current = ""
+        current = f"{current}\n{paragraph}" if current else paragraph
+    if current:
+        passages.append(current)
+    return passages
+
+def split_passages(source: Dict[str, Any]) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """セッションドキュメントを (ベクトルID, テキスト, メタデータ) のパッセージに分割
+
+    ベクトルIDにテキストのハッシュを含めるので、内容が変わらないパッセージは再インデックス時にスキップされる
+    """
+    session_id = source.get('session_id')
+    if not session_id:
+        return []
+
+    fields = [("abstract", f"{source.get('title', '')}\n{source.get('abstract', '')}".strip())]
+    if source.get('transcript_summary'):
+        fields.extend(
+            ("transcript", passage)
+            for passage in _split_long_text(source['transcript_summary'], PASSAGE_MAX_CHARS)
+        )
+
+    passages = []
+    for position, (field, text) in enumerate(fields):
+        if not text:
+            continue
+        vector_id = f"{session_id}:{field}:{text_hash(text)[:12]}"
+        meta = {"session_id": session_id, "field": field, "position": position, "text": text}
+        passages.append((vector_id, text, meta))
+    return passages
+
+async def index_documents(sources: Iterable[Dict[str, Any]], batch_size: int = 64) -> Dict[str, int]:
+    """ドキュメントのパッセージを埋め込んでベクトルストアに追記（変更のないパッセージはスキップ）
+
+    同じセッションの以前のパッセージのうち、今回のドキュメントにないもの（内容が変わったもの）は削除する
+    """
+    index_start = time.time()
+    existing_ids = vector_store.live_ids()
+
+    pending = []
+    skipped = 0
+    # session_id → 今回のドキュメントのパッセージID（同じセッションの元データと拡張版をまとめて扱う）
+    current_ids: Dict[str, set] = {}
+    for source in sources:
+        for vector_id, text, meta in split_passages(source):
+            current_ids.setdefault(meta["session_id"], set()).add(vector_id)
+            if vector_id in existing_ids:
+                skipped += 1
+                continue
+            existing_ids.add(vector_id)
+            pending.append((vector_id, text, meta))
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        vectors = await bedrock_client.embed_texts([text for _, text, _ in batch])
+        vector_store.append([vector_id for vector_id, _, _ in batch], vectors, [meta for _, _, meta in batch])
+
+    superseded = [
+        vector_id
+        for session_id, vector_ids in current_ids.items()
+        for vector_id in vector_store.session_vector_ids(session_id) - vector_ids
+    ]
+    removed = vector_store.delete(superseded) if superseded else 0
+
+    print(f"🧭 Indexed {len(pending)} new passages ({skipped} unchanged, {removed} superseded removed) "
+          f"in {time.time() - index_start:.2f}s")
+    return {"indexed": len(pending), "unchanged": skipped, "removed": removed}
@@ -0,0 +1,214 @@
+import os
+import sys
+import time
+import signal
+import threading
+import contextvars
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 既定のサンプリング間隔と、停止し忘れても負荷をかけ続けないための最大計測時間
+PROFILE_DEFAULT_INTERVAL_MS = float(os.getenv('PROFILE_DEFAULT_INTERVAL_MS', '10'))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+# 1スタックあたりの最大フレーム数と、記録する異なるスタックの最大数（メモリ上限）
+PROFILE_MAX_DEPTH = int(os.getenv('PROFILE_MAX_DEPTH', '64'))
+PROFILE_MAX_STACKS = int(os.getenv('PROFILE_MAX_STACKS', '20000'))
+
+# wall: 実時間（SIGALRM、I/O待ちも含む） / cpu: プロセスのCPU時間（SIGPROF）
+TIMER_MODES = {
+    "wall": (signal.ITIMER_REAL, signal.SIGALRM),
+    "cpu": (signal.ITIMER_PROF, signal.SIGPROF),
+}
+
+# 待機中のスレッド・イベントループの末端フレーム（既定では集計しない）
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+
+# 実行中のパイプライン段階（イベントループ上のタスクごと）
+current_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('current_stage', default=None)
+# スレッドで実行中の処理の段階（シグナルハンドラから他スレッドのコンテキスト変数は読めないため）
+thread_stages: Dict[int, str] = {}
+
+def set_stage(stage: str):
+    """以降の処理をこの段階として集計（タスク内で順に切り替える）"""
+    current_stage.set(stage)
+
+def in_stage(func: Callable) -> Callable:
+    """asyncio.to_thread で実行する関数を、呼び出し元の段階としてスレッドに記録する"""
+    def wrapper(*args, **kwargs):
+        stage = current_stage.get()
+        ident = threading.get_ident()
+        if stage:
+            thread_stages[ident] = stage
+        try:
+            return func(*args, **kwargs)
+        finally:
+            thread_stages.pop(ident, None)
+    return wrapper
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class ProfilerBusyError(Exception):
+    """計測中に別の計測を開始しようとした"""
+
+class SamplingProfiler:
+    """シグナルタイマーで全スレッドのスタックを定期的に採取する統計プロファイラ
+
+    出力は flamegraph.pl / speedscope で読める collapsed stack 形式（先頭に段階名）
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = False
+        # シグナルハンドラを登録済み（自動停止後も stop / 次の start で元に戻す）
+        self.armed = False
+        self.mode = "wall"
+        self.interval = PROFILE_DEFAULT_INTERVAL_MS / 1000
+        self.include_idle = False
+        self.started_at = 0.0
+        self.stopped_at = 0.0
+        self.stop_at = 0.0
+        self.stacks: Counter = Counter()
+        self.stages: Counter = Counter()
+        self.samples = 0
+        self.dropped = 0
+        self.sample_time = 0.0
+        self.previous_handler: Any = None
+
+    def start(self, interval_ms: float = PROFILE_DEFAULT_INTERVAL_MS, duration: float = PROFILE_MAX_SECONDS,
+              mode: str = "wall", include_idle: bool = False):
+        if mode not in TIMER_MODES:
+            raise ValueError(f"Unknown profile mode: {mode} (available: {', '.join(TIMER_MODES)})")
+        if threading.current_thread() is not threading.main_thread():
+            # シグナルハンドラはメインスレッドでしか登録できない
+            raise RuntimeError("Profiler must be started from the main thread")
+        with self.lock:
+            if self.active:
+                raise ProfilerBusyError("Profiler is already running")
+            self.active = True
+
+        if self.armed:
+            self._disarm()
+        self.mode = mode
+        self.interval = max(interval_ms, 1.0) / 1000
+        self.include_idle = include_idle
+        self.stacks = Counter()
+        self.stages = Counter()
+        self.samples = self.dropped = 0
+        self.sample_time = 0.0
+        self.started_at = time.time()
+        self.stopped_at = 0.0
+        self.stop_at = time.monotonic() + min(duration, PROFILE_MAX_SECONDS)
+
+        which, signum = TIMER_MODES[mode]
+        self.previous_handler = signal.signal(signum, self._handle)
+        self.armed = True
+        signal.setitimer(which, self.interval, self.interval)
+        print(f"🔬 Profiler started ({mode}, every {self.interval * 1000:.1f}ms, up to {self.stop_at - time.monotonic():.1f}s)")
+
+    def stop(self) -> Dict[str, Any]:
+        with self.lock:
+            was_active, self.active = self.active, False
+        if self.armed:
+            self._disarm()
+        if not was_active:
+            return self.summary()
+        self.stopped_at = time.time()
+        print(f"🔬 Profiler stopped: {self.samples} samples, {len(self.stacks)} stacks "
+              f"(overhead {self.overhead() * 100:.2f}%)")
+        return self.summary()
+
+    def _disarm(self):
+        which, signum = TIMER_MODES[self.mode]
+        signal.setitimer(which, 0, 0)
+        signal.signal(signum, self.previous_handler if self.previous_handler is not None else signal.SIG_DFL)
+        self.armed = False
+
+    def _handle(self, signum, frame):
+        if not self.active:
+            return
+        sample_start = time.perf_counter()
+        try:
+            if time.monotonic() >= self.stop_at:
+                # 最大計測時間に達したら自動で停止（ハンドラ内なのでタイマーだけ止める）
+                self.active = False
+                self.stopped_at = time.time()
+                signal.setitimer(TIMER_MODES[self.mode][0], 0, 0)
+                return
+            main_ident = threading.main_thread().ident
+            for ident, thread_frame in sys._current_frames().items():
+                if ident == main_ident:
+                    # メインスレッドは割り込まれたフレーム（ハンドラ自身を含まない）を使う
+                    self._record(frame, current_stage.get())
+                else:
+                    self._record(thread_frame, thread_stages.get(ident))
+        except Exception:
+            self.dropped += 1
+        finally:
+            self.sample_time += time.perf_counter() - sample_start
+
+    def _record(self, frame, stage: Optional[str]):
+        if frame is None:
+            return
+        code = frame.f_code
+        if not self.include_idle and stage is None and (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES:
+            return
+
+        labels: List[str] = []
+        while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+            labels.append(_frame_label(frame))
+            frame = frame.f_back
+        labels.reverse()
+        stage_label = stage or "other"
+        key = (stage_label, tuple(labels))
+        if key not in self.stacks and len(self.stacks) >= PROFILE_MAX_STACKS:
+            self.dropped += 1
+            return
+        self.stacks[key] += 1
+        self.stages[stage_label] += 1
+        self.samples += 1
+
+    def overhead(self) -> float:
+        """計測期間に対するサンプリング処理時間の割合"""
+        elapsed = (self.stopped_at or time.time()) - self.started_at
+        return self.sample_time / elapsed if elapsed > 0 else 0.0
+
+    def collapsed(self) -> str:
+        """collapsed stack 形式（"[stage:段階];関数 (ファイル:行);... 回数"）"""
+        lines = [
+            f"[stage:{stage}];{';'.join(labels)} {count}"
+            for (stage, labels), count in sorted(self.stacks.items(), key=lambda item: -item[1])
+        ]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def top_functions(self, limit: int = 20) -> List[Tuple[str, int]]:
+        """末端（自身の処理時間）のサンプル数が多い関数"""
+        leaves: Counter = Counter()
+        # ハンドラが割り込んでも壊れないようにスナップショットを取ってから集計
+        for (_, labels), count in list(self.stacks.items()):
+            if labels:
+                leaves[labels[-1]] += count
+        return leaves.most_common(limit)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "mode": self.mode,
+            "interval_ms": round(self.interval * 1000, 3),
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "samples": self.samples,
+            "dropped": self.dropped,
+            "stacks": len(self.stacks),
+            "overhead": round(self.overhead(), 5),
+            "stages": dict(self.stages.most_common()),
+            "top_functions": [{"function": name, "samples": count} for name, count in self.top_functions()]
+        }
+
+# シングルトンインスタンス
+profiler = SamplingProfiler()
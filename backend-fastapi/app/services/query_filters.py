@@ -0,0 +1,124 @@
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Set
+from app.services.index_schema import exact_match_clause
+
+# 構造化フィルタの対象フィールド（ChatRequest.filters と同じキー）
+FILTER_FIELDS = ["track", "date", "level", "company"]
+
+DATE_PATTERNS = [
+    re.compile(r'(?:(\d{4})年)?\s*(\d{1,2})月\s*(\d{1,2})日'),
+    re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})'),
+    re.compile(r'(?<![\d/])()(\d{1,2})/(\d{1,2})(?![\d/])'),
+]
+LEVEL_PATTERN = re.compile(r'(?:レベル|level|lv\.?|(?<![a-z])l)\s*(\d{3})|(\d{3})\s*(?:レベル|level)', re.IGNORECASE)
+TRACK_PATTERN = re.compile(r'([^\s、。,]+(?:\s+[A-Za-z&]+)*)\s*トラック')
+COMPANY_SUFFIX_PATTERN = re.compile(r'(株式会社|合同会社|有限会社|\(株\)|（株）|,?\s*inc\.?|,?\s*ltd\.?|,?\s*llc|,?\s*corporation)', re.IGNORECASE)
+
+def _fold(text: str) -> str:
+    return unicodedata.normalize('NFKC', text).lower().strip()
+
+def company_core(company: str) -> str:
+    """法人格を除いた社名（「ソニーグループ株式会社」→「ソニーグループ」）"""
+    return COMPANY_SUFFIX_PATTERN.sub('', _fold(company)).strip()
+
+class FilterVocabulary:
+    """コーパスに実在する値（トラック・日付・レベル・企業）。質問文から拾う値をこれに限定して誤検出を防ぐ"""
+    def __init__(self):
+        self.tracks: Dict[str, str] = {}
+        self.dates: Set[str] = set()
+        self.levels: Set[str] = set()
+        self.companies: Dict[str, str] = {}
+
+    def build(self, sources: Iterable[Dict[str, Any]]):
+        tracks, dates, levels, companies = {}, set(), set(), {}
+        for source in sources:
+            if source.get('track'):
+                tracks[_fold(source['track'])] = source['track']
+            if source.get('date'):
+                dates.add(str(source['date']))
+            if source.get('level'):
+                levels.add(str(source['level']))
+            for speaker in source.get('speakers') or []:
+                core = company_core(speaker.get('company') or '')
+                # 短すぎる社名は誤検出が多いので対象外
+                if len(core) >= 2:
+                    companies[core] = speaker['company']
+        self.tracks, self.dates, self.levels, self.companies = tracks, dates, levels, companies
+
+    def parse(self, message: str) -> Dict[str, str]:
+        """質問文から構造化フィルタを抽出（コーパスに存在する値のみ）"""
+        filters: Dict[str, str] = {}
+        folded = _fold(message)
+
+        for pattern in DATE_PATTERNS:
+            match = pattern.search(folded)
+            if not match:
+                continue
+            year, month, day = match.group(1), int(match.group(2)), int(match.group(3))
+            suffix = f"-{month:02d}-{day:02d}"
+            candidates = [date for date in self.dates if date.endswith(suffix) and (not year or date.startswith(year))]
+            if len(candidates) == 1:
+                filters["date"] = candidates[0]
+            break
+
+        match = LEVEL_PATTERN.search(folded)
+        if match:
+            level = match.group(1) or match.group(2)
+            if level in self.levels:
+                filters["level"] = level
+
+        match = TRACK_PATTERN.search(folded)
+        if match:
+            mentioned = match.group(1).strip()
+            # 「Generative AIトラック」→ 実在するトラック名のうち末尾が一致する最長のもの
+            matches = [track for track in self.tracks if mentioned == track or mentioned.endswith(track)]
+            if matches:
+                filters["track"] = self.tracks[max(matches, key=len)]
+
+        mentioned_companies = [core for core in self.companies if core in folded]
+        if mentioned_companies:
+            filters["company"] = company_core(self.companies[max(mentioned_companies, key=len)])
+
+        return filters
+
+def merge_filters(explicit: Optional[Dict[str, Optional[str]]], parsed: Dict[str, str]) -> Dict[str, str]:
+    """明示指定を優先して質問文からの抽出結果と統合（値のないキーは除外）"""
+    merged = dict(parsed)
+    for field, value in (explicit or {}).items():
+        if value:
+            merged[field] = str(value)
+    return {field: merged[field] for field in FILTER_FIELDS if merged.get(field)}
+
+def matches_filters(source: Dict[str, Any], filters: Optional[Dict[str, str]]) -> bool:
+    """ローカル検索用: OpenSearchの filter 句と同じ条件で判定"""
+    if not filters:
+        return True
+    for field, value in filters.items():
+        if field == "company":
+            wanted = company_core(value)
+            if not any(wanted in _fold(speaker.get('company') or '') for speaker in source.get('speakers') or []):
+                return False
+        elif _fold(str(source.get(field) or '')) != _fold(value):
+            return False
+    return True
+
+def build_filter_clauses(filters: Optional[Dict[str, str]]) -> List[Dict[str, Any]]:
+    """スコア計算に関与しない bool.filter 句（エンジン側でキャッシュされる）
+
+    keyword としてマッピングされたフィールドは term 句のみ、推測されたマッピングでは text / keyword の両方で照合
+    企業は法人格を除いて小文字化した値（company_core）なので、keyword ではなく解析済みフィールドの match_phrase で照合
+    """
+    clauses = []
+    for field, value in (filters or {}).items():
+        if field == "company":
+            clauses.append({"match_phrase": {"speakers.company": value}})
+        elif field == "track":
+            # 明示指定（"ai" など）もコーパスの表記に揃えてから term で照合
+            clauses.append(exact_match_clause(field, filter_vocabulary.tracks.get(_fold(value), value)))
+        else:
+            clauses.append(exact_match_clause(field, value))
+    return clauses
+
+# シングルトンインスタンス
+filter_vocabulary = FilterVocabulary()
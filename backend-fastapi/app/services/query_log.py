@@ -0,0 +1,118 @@
+import os
+import re
+import hmac
+import json
+import time
+import hashlib
+import logging
+import unicodedata
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional
+
+# 個人情報になりうる文字列のマスク（メールアドレス・電話番号・長い数字列）
+PII_PATTERNS = [
+    (re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+'), '<email>'),
+    (re.compile(r'\d{2,4}-\d{2,4}-\d{3,4}'), '<phone>'),
+    (re.compile(r'\d{7,}'), '<number>'),
+]
+
+def normalize_query(query: str) -> str:
+    """全角・半角や空白の揺れを吸収した正規化クエリ"""
+    normalized = unicodedata.normalize('NFKC', query)
+    return ' '.join(normalized.split())
+
+def redact_query(query: str) -> str:
+    for pattern, replacement in PII_PATTERNS:
+        query = pattern.sub(replacement, query)
+    return query
+
+def worker_log_path(path: str, pid: Optional[int] = None) -> str:
+    """ワーカーごとのログファイル（query.log → query.<pid>.log）
+
+    RotatingFileHandler は複数プロセスで同じファイルをローテーションすると記録が欠けるので、
+    ワーカーごとに別のファイルに書いてそれぞれでローテーションする
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}.{pid or os.getpid()}{ext}"
+
+class QueryLogger:
+    """チャットリクエストを1行1JSONで追記するローテーション付きクエリログ（負荷再現用、ワーカーごとのファイル）
+
+    再送で同じリクエストを再現できるように、対象イベントと構造化フィルタも記録する
+    質問文・キーワード・採用された検索語は既定ではソルト付きハッシュのみ記録し、
+    QUERY_LOG_STORE_TEXT=true の場合のみマスクした文字列を記録する
+    """
+    def __init__(self):
+        self.path = os.getenv('QUERY_LOG_PATH')
+        self.store_text = os.getenv('QUERY_LOG_STORE_TEXT', 'false').lower() == 'true'
+        self.salt = os.getenv('QUERY_LOG_SALT', '').encode('utf-8')
+        self.enabled = bool(self.path)
+        if self.enabled and not self.salt:
+            # ソルトなしのハッシュは辞書攻撃で元の質問文に戻せるので記録しない
+            print("⚠️ QUERY_LOG_SALT is empty; query log disabled")
+            self.enabled = False
+        self.logger = None
+
+    def _get_logger(self) -> logging.Logger:
+        if self.logger:
+            return self.logger
+
+        logger = logging.getLogger('rag.query_log')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = RotatingFileHandler(
+            worker_log_path(self.path),
+            maxBytes=int(os.getenv('QUERY_LOG_MAX_BYTES', str(50 * 1024 * 1024))),
+            backupCount=int(os.getenv('QUERY_LOG_BACKUP_COUNT', '5')),
+            encoding='utf-8'
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        self.logger = logger
+        return logger
+
+    def hash_query(self, normalized: str) -> str:
+        """同一クエリの集計用ハッシュ（ソルト付きで元の文字列は復元できない）"""
+        return hmac.new(self.salt, normalized.encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+
+    def protect(self, text: str) -> str:
+        """ログに書く文字列（QUERY_LOG_STORE_TEXT の場合はマスクした文字列、それ以外はハッシュ）"""
+        normalized = normalize_query(text)
+        return redact_query(normalized) if self.store_text else self.hash_query(normalized)
+
+    def record(self, query: str, trace: Dict[str, Any], timings: Dict[str, float],
+               hit_ids: Optional[List[str]] = None, status: int = 200):
+        if not self.enabled:
+            return
+
+        normalized = normalize_query(query)
+        keywords = trace.get('keywords')
+        selected = trace.get('selected_candidate')
+        if selected and selected.get('keyword'):
+            # 検索語は質問文そのもの（original_query / final_fallback など）の場合がある
+            selected = {**selected, 'keyword': self.protect(selected['keyword'])}
+        entry = {
+            "ts": round(time.time(), 3),
+            "qh": self.hash_query(normalized),
+            "path": trace.get('search_method'),
+            "kw": [self.protect(keyword) for keyword in keywords] if keywords else keywords,
+            "sel": selected,
+            "ev": trace.get('events'),
+            "flt": trace.get('filters'),
+            "att": trace.get('search_attempts', 0),
+            "kc": trace.get('keyword_cache_hit', False),
+            "hits": hit_ids or [],
+            "t": {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+            "st": status
+        }
+        if self.store_text:
+            entry["q"] = redact_query(normalized)
+
+        try:
+            self._get_logger().info(json.dumps(entry, ensure_ascii=False, separators=(',', ':')))
+        except Exception as e:
+            # ログ出力の失敗でリクエストを失敗させない
+            print(f"⚠️ Query log write failed: {e}")
+
+# シングルトンインスタンス
+query_logger = QueryLogger()
@@ -0,0 +1,166 @@
+import os
+import re
+import time
+import asyncio
+from typing import Dict, Any, List, Optional
+from app.services.opensearch_client import opensearch_client, build_session_id_query
+from app.services.deadline import stage_timeout
+from app.models.search import SearchHit
+from app.services.federated_search import DEFAULT_INDEX
+from app.services.index_schema import search_after_pages, stable_sort
+
+# 読み込み時の1ページの件数
+SESSION_STORE_PAGE_SIZE = int(os.getenv('SESSION_STORE_PAGE_SIZE', '500'))
+# OpenSearchにも存在しなかったセッションID（例: 「GPT-4」）を再検索しない秒数と、記録する上限
+SESSION_STORE_NEGATIVE_TTL_SECONDS = float(os.getenv('SESSION_STORE_NEGATIVE_TTL_SECONDS', '300'))
+SESSION_STORE_NEGATIVE_MAX_ENTRIES = int(os.getenv('SESSION_STORE_NEGATIVE_MAX_ENTRIES', '10000'))
+
+# 質問文中のセッションID（例: 「AWS-08の講演者は？」）
+SESSION_ID_IN_TEXT_PATTERN = re.compile(r'(?<![A-Za-z0-9])[A-Z]+-\d+(?![0-9A-Za-z])')
+
+def document_version(source: Dict[str, Any]) -> tuple:
+    """同じセッションIDのドキュメントの新しさ（拡張版 > 元データ、タイムスタンプが新しいほど優先）"""
+    return (
+        1 if source.get('has_detailed_content') else 0,
+        source.get('enhanced_timestamp') or 0
+    )
+
+class SessionStore:
+    """session_id → 最新ドキュメント のインメモリマップ（セッションID質問の高速パス用）"""
+    def __init__(self, index_name: str = DEFAULT_INDEX):
+        self.index_name = index_name
+        self.documents: Dict[str, SearchHit] = {}
+        self.last_enhanced_timestamp = 0.0
+        self.loaded = False
+        # 存在しなかったセッションID → 期限（time.time()）
+        self.negative: Dict[str, float] = {}
+        self.stats = {"hits": 0, "misses": 0, "fallback_hits": 0, "negative_hits": 0}
+
+    @staticmethod
+    def extract_session_ids(text: str) -> List[str]:
+        """質問文からセッションIDを抽出（出現順・重複なし）"""
+        session_ids = []
+        for session_id in SESSION_ID_IN_TEXT_PATTERN.findall(text):
+            if session_id not in session_ids:
+                session_ids.append(session_id)
+        return session_ids
+
+    def upsert(self, doc_id: str, source: Dict[str, Any]) -> bool:
+        """ドキュメントを登録（既存より新しい場合のみ置き換え）"""
+        session_id = source.get('session_id')
+        if not session_id:
+            return False
+
+        current = self.documents.get(session_id)
+        if current and document_version(current.session.source) > document_version(source):
+            return False
+
+        self.documents[session_id] = SearchHit.from_source(doc_id, 1.0, source)
+        self.negative.pop(session_id, None)
+        self.last_enhanced_timestamp = max(self.last_enhanced_timestamp, source.get('enhanced_timestamp') or 0)
+        return True
+
+    def remove(self, session_id: str):
+        self.documents.pop(session_id, None)
+
+    def get(self, session_id: str) -> Optional[SearchHit]:
+        """ローカルマップのみを参照（O(1)）"""
+        return self.documents.get(session_id)
+
+    def _remember_missing(self, session_id: str):
+        now = time.time()
+        if len(self.negative) >= SESSION_STORE_NEGATIVE_MAX_ENTRIES:
+            self.negative = {key: expires for key, expires in self.negative.items() if expires > now}
+            if len(self.negative) >= SESSION_STORE_NEGATIVE_MAX_ENTRIES:
+                # 期限の近いものから捨てる
+                self.negative.pop(min(self.negative, key=self.negative.get))
+        self.negative[session_id] = now + SESSION_STORE_NEGATIVE_TTL_SECONDS
+
+    async def lookup(self, session_id: str) -> Optional[SearchHit]:
+        """ローカルマップを参照し、ミス時のみOpenSearchの完全一致検索にフォールバック
+
+        OpenSearchにもなかったIDは SESSION_STORE_NEGATIVE_TTL_SECONDS の間は検索しない
+        （その間に取り込まれた場合は upsert で解除される）
+        """
+        hit = self.documents.get(session_id)
+        if hit:
+            self.stats["hits"] += 1
+            return hit
+
+        expires = self.negative.get(session_id)
+        if expires is not None:
+            if expires > time.time():
+                self.stats["negative_hits"] += 1
+                return None
+            del self.negative[session_id]
+
+        self.stats["misses"] += 1
+        client = await opensearch_client.initialize()
+        response = await asyncio.to_thread(
+            client.search,
+            index=self.index_name,
+            body=build_session_id_query(session_id, size=10),
+            request_timeout=stage_timeout("search", 30)
+        )
+
+        for found in response['hits']['hits']:
+            # 解析済みフィールドの部分一致を除外して完全一致のみ登録
+            if found['_source'].get('session_id') == session_id:
+                self.upsert(found['_id'], found['_source'])
+
+        hit = self.documents.get(session_id)
+        if hit:
+            self.stats["fallback_hits"] += 1
+            print(f"🗂️ Session store miss for {session_id}, loaded from OpenSearch")
+        else:
+            self._remember_missing(session_id)
+        return hit
+
+    def _fetch_all(self, client, query: Dict[str, Any], sort: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+        """条件に合うドキュメントを search_after で全件取得（ブロッキング、スレッドで実行する）"""
+        sort = sort or stable_sort(client, self.index_name)
+        hits: List[Dict[str, Any]] = []
+        for page in search_after_pages(client, self.index_name, query, sort, SESSION_STORE_PAGE_SIZE):
+            hits.extend(page)
+        return hits
+
+    async def warm_up(self):
+        """起動時に全セッションを読み込む（件数の上限なし）"""
+        load_start = time.time()
+        client = await opensearch_client.initialize()
+        hits = await asyncio.to_thread(self._fetch_all, client, {"match_all": {}})
+
+        # マップの更新はイベントループ上で行う
+        for hit in hits:
+            self.upsert(hit['_id'], hit['_source'])
+
+        self.loaded = True
+        print(f"🗂️ Session store loaded {len(self.documents)} sessions from {len(hits)} documents "
+              f"in {time.time() - load_start:.3f}s")
+
+    async def refresh(self) -> int:
+        """前回以降に投入された拡張ドキュメント（enhanced_timestamp が新しいもの）を古い順にすべて取り込む"""
+        client = await opensearch_client.initialize()
+        hits = await asyncio.to_thread(
+            self._fetch_all,
+            client,
+            {"range": {"enhanced_timestamp": {"gt": self.last_enhanced_timestamp}}},
+            [{"enhanced_timestamp": "asc"}, {"_id": "asc"}]
+        )
+
+        updated = 0
+        for hit in hits:
+            if self.upsert(hit['_id'], hit['_source']):
+                updated += 1
+            # 既存より古く採用しなかったドキュメントも次回の対象から外す
+            self.last_enhanced_timestamp = max(self.last_enhanced_timestamp, hit['_source'].get('enhanced_timestamp') or 0)
+
+        if updated:
+            print(f"🗂️ Session store refreshed {updated} sessions")
+        return updated
+
+def refresh_interval() -> float:
+    return float(os.getenv('SESSION_STORE_REFRESH_SECONDS', '60'))
+
+# シングルトンインスタンス
+session_store = SessionStore()
@@ -0,0 +1,188 @@
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+# 名前空間ごとのデフォルトTTL（秒）
+DEFAULT_TTLS = {
+    "keywords": float(os.getenv('KEYWORD_CACHE_TTL_SECONDS', '86400')),
+    "search": float(os.getenv('SEARCH_CACHE_TTL_SECONDS', '600')),
+    "llm": float(os.getenv('LLM_CACHE_TTL_SECONDS', '3600')),
+    # フォールバック検索で0件だったキーワード（この間は同じ条件で検索しない）
+    "negative": float(os.getenv('FALLBACK_NEGATIVE_TTL_SECONDS', '600')),
+}
+
+# ヒット時の最終アクセス時刻（LRUの順序）の更新間隔（秒）。毎回書き込むとプロセス間でロックを取り合う
+TOUCH_INTERVAL = float(os.getenv('SHARED_CACHE_TOUCH_SECONDS', '60'))
+
+class SharedCache:
+    """同一ホストの全uvicornワーカーで共有するキャッシュ（SQLite WAL + TTL + LRU）"""
+    def __init__(self, path: Optional[str] = None, max_entries: Optional[int] = None):
+        self.path = path or os.getenv('SHARED_CACHE_PATH', '/tmp/rag_shared_cache.sqlite3')
+        self.max_entries = max_entries or int(os.getenv('SHARED_CACHE_MAX_ENTRIES', '10000'))
+        self.enabled = os.getenv('SHARED_CACHE_ENABLED', 'true').lower() == 'true'
+        self.connection = None
+        self.lock = threading.Lock()
+        self.writes_since_eviction = 0
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection:
+            return self.connection
+
+        connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        # WALモード: 複数プロセスからの同時読み込みと1つの書き込みを並行させる
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        connection.execute("CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)")
+        self.connection = connection
+        return connection
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """任意のJSON化可能な値からキャッシュキーを生成"""
+        raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _record(self, namespace: str, outcome: str):
+        counters = self.stats.setdefault(namespace, {"hits": 0, "misses": 0, "sets": 0, "errors": 0})
+        counters[outcome] += 1
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        try:
+            with self.lock:
+                connection = self._connect()
+                row = connection.execute(
+                    "SELECT value, expires_at, last_access FROM cache WHERE namespace = ? AND key = ?",
+                    (namespace, key)
+                ).fetchone()
+
+                if row is None or row[1] < now:
+                    if row is not None:
+                        connection.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+                    self._record(namespace, "misses")
+                    return None
+
+                # LRUの順序は粗くてよいので、前回の更新から一定時間経った場合のみ書き込む
+                if now - row[2] >= TOUCH_INTERVAL:
+                    connection.execute(
+                        "UPDATE cache SET last_access = ? WHERE namespace = ? AND key = ?",
+                        (now, namespace, key)
+                    )
+            self._record(namespace, "hits")
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            # キャッシュの障害でリクエストを失敗させない
+            print(f"⚠️ Shared cache get failed ({namespace}): {e}")
+            self._record(namespace, "errors")
+            return None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        if not self.enabled:
+            return
+
+        now = time.time()
+        ttl = ttl if ttl is not None else DEFAULT_TTLS.get(namespace, 600.0)
+        try:
+            payload = json.dumps(value, ensure_ascii=False)
+            with self.lock:
+                connection = self._connect()
+                connection.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (namespace, key, payload, now + ttl, now)
+                )
+                self.writes_since_eviction += 1
+                if self.writes_since_eviction >= 100:
+                    self._evict(connection, now)
+            self._record(namespace, "sets")
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"⚠️ Shared cache set failed ({namespace}): {e}")
+            self._record(namespace, "errors")
+
+    async def get_async(self, namespace: str, key: str) -> Optional[Any]:
+        """get をスレッドで実行（SQLiteのロック待ちでイベントループを止めない）"""
+        if not self.enabled:
+            return None
+        return await asyncio.to_thread(self.get, namespace, key)
+
+    async def set_async(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        """set をスレッドで実行（SQLiteのロック待ちでイベントループを止めない）"""
+        if not self.enabled:
+            return
+        await asyncio.to_thread(self.set, namespace, key, value, ttl)
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        """期限切れを削除し、上限を超えた分を最終アクセスが古い順に削除（LRU）"""
+        self.writes_since_eviction = 0
+        connection.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+        count = connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            connection.execute(
+                "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY last_access LIMIT ?)",
+                (overflow,)
+            )
+            print(f"🧹 Shared cache evicted {overflow} LRU entries")
+
+    def delete(self, namespace: str, key: str):
+        if not self.enabled:
+            return
+        try:
+            with self.lock:
+                self._connect().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.Error as e:
+            print(f"⚠️ Shared cache delete failed ({namespace}): {e}")
+
+    def clear(self, namespace: Optional[str] = None):
+        """名前空間単位（省略時は全体）でキャッシュを無効化"""
+        if not self.enabled:
+            return
+        try:
+            with self.lock:
+                connection = self._connect()
+                if namespace:
+                    connection.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+                else:
+                    connection.execute("DELETE FROM cache")
+        except sqlite3.Error as e:
+            print(f"⚠️ Shared cache clear failed: {e}")
+
+    def summary(self) -> Dict[str, Any]:
+        entries = {}
+        if self.enabled:
+            try:
+                with self.lock:
+                    rows = self._connect().execute(
+                        "SELECT namespace, COUNT(*) FROM cache GROUP BY namespace"
+                    ).fetchall()
+                entries = {namespace: count for namespace, count in rows}
+            except sqlite3.Error as e:
+                print(f"⚠️ Shared cache summary failed: {e}")
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "max_entries": self.max_entries,
+            "entries": entries,
+            "worker_stats": self.stats
+        }
+
+# シングルトンインスタンス
+shared_cache = SharedCache()
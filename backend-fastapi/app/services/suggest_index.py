@@ -0,0 +1,187 @@
+import os
+import re
+import math
+import time
+import threading
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 候補の種類ごとの重み（search_with_transcript_content のフィールドブーストに合わせる）
+SUGGESTION_WEIGHTS = {
+    "session_id": 4.0,
+    "title": 3.0,
+    "speaker": 2.0,
+    "company": 2.0,
+}
+# 各ノードに保持する上位候補数（問い合わせ時は木を辿るだけで済む）
+SUGGEST_TOP_K = int(os.getenv('SUGGEST_TOP_K', '10'))
+
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+# 読みの揺れを吸収するため区切り記号・空白は除去
+IGNORED_CHARS_PATTERN = re.compile(r'[\s・･\-_/:：,，、。.!！?？「」『』()（）\[\]【】]+')
+# タイトル・名前の中で候補の起点にする位置（空白・記号の直後、助詞などのひらがなの後に続く語の先頭）
+WORD_START_PATTERN = re.compile(r'(?:^|[\s・/:：\-（(「『【]|(?<=[ぁ-ゖ]))(?=[^\sぁ-ゖ])|^(?=\S)')
+
+def normalize(text: str) -> str:
+    """全角・半角、大文字・小文字、カタカナ・ひらがなを揃える（例: 「ソニー」「そにー」「ｿﾆｰ」は同じキー）"""
+    text = unicodedata.normalize('NFKC', text).lower().translate(KATAKANA_TO_HIRAGANA)
+    return IGNORED_CHARS_PATTERN.sub('', text)
+
+def suffix_keys(text: str) -> List[str]:
+    """先頭と各単語の先頭から始まるキー（「データ」で「生成AIのための データ活用」にもヒットさせる）"""
+    keys = []
+    for match in WORD_START_PATTERN.finditer(text):
+        key = normalize(text[match.end():])
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+class _Node:
+    __slots__ = ('children', 'terminals', 'top')
+
+    def __init__(self):
+        # 先頭文字 → (辺のラベル, 子ノード)
+        self.children: Dict[str, Tuple[str, "_Node"]] = {}
+        self.terminals: List[int] = []
+        self.top: List[int] = []
+
+class PrefixTrie:
+    """辺に文字列を持つ圧縮トライ（各ノードに部分木の上位候補を事前計算）"""
+    def __init__(self):
+        self.root = _Node()
+        self.node_count = 1
+
+    def insert(self, key: str, item: int):
+        node = self.root
+        while key:
+            edge = node.children.get(key[0])
+            if edge is None:
+                child = _Node()
+                child.terminals.append(item)
+                node.children[key[0]] = (key, child)
+                self.node_count += 1
+                return
+
+            label, child = edge
+            common = 0
+            while common < len(label) and common < len(key) and label[common] == key[common]:
+                common += 1
+            if common < len(label):
+                # 辺を共通部分で分割
+                middle = _Node()
+                middle.children[label[common]] = (label[common:], child)
+                node.children[key[0]] = (label[:common], middle)
+                self.node_count += 1
+                child = middle
+            node = child
+            key = key[common:]
+        node.terminals.append(item)
+
+    def finalize(self, rank: Dict[int, float], k: int):
+        """部分木の上位 k 件を後順で計算"""
+        def visit(node: _Node) -> List[int]:
+            candidates = list(node.terminals)
+            for _, child in node.children.values():
+                candidates.extend(visit(child))
+            unique = sorted(set(candidates), key=lambda item: -rank[item])[:k]
+            node.top = unique
+            return unique
+        visit(self.root)
+
+    def find(self, key: str) -> Optional[_Node]:
+        node = self.root
+        while key:
+            edge = node.children.get(key[0])
+            if edge is None:
+                return None
+            label, child = edge
+            if key.startswith(label):
+                key = key[len(label):]
+                node = child
+            elif label.startswith(key):
+                # 辺の途中で入力が終わった場合はその先の部分木
+                return child
+            else:
+                return None
+        return node
+
+class SuggestIndex:
+    """セッションID・タイトル・講演者・企業の入力補完（インメモリのみ、OpenSearchには問い合わせない）"""
+    def __init__(self):
+        self.trie = PrefixTrie()
+        self.suggestions: List[Dict[str, Any]] = []
+        self.popularity: Counter = Counter()
+        self.lock = threading.Lock()
+        self.built_at = 0.0
+        self.dirty = False
+
+    def record_hits(self, session_ids: Iterable[str]):
+        """回答に使われたセッションを人気度として記録（次回の再構築で順位に反映）"""
+        for session_id in session_ids:
+            if session_id:
+                self.popularity[session_id] += 1
+                self.dirty = True
+
+    def build(self, sources: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        build_start = time.time()
+        # 同じ表記の候補（同じ講演者・企業）は1つにまとめ、関連セッションを集約
+        grouped: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for source in sources:
+            session_id = source.get('session_id')
+            if not session_id:
+                continue
+            entries = [("session_id", session_id), ("title", source.get('title') or "")]
+            for speaker in source.get('speakers') or []:
+                entries.append(("speaker", speaker.get('name') or ""))
+                entries.append(("company", speaker.get('company') or ""))
+            for kind, text in entries:
+                text = text.strip()
+                if not text:
+                    continue
+                suggestion = grouped.setdefault((kind, text), {"text": text, "type": kind, "session_ids": []})
+                if session_id not in suggestion["session_ids"]:
+                    suggestion["session_ids"].append(session_id)
+
+        suggestions = list(grouped.values())
+        rank: Dict[int, float] = {}
+        trie = PrefixTrie()
+        for item, suggestion in enumerate(suggestions):
+            popularity = sum(self.popularity[session_id] for session_id in suggestion["session_ids"])
+            suggestion["score"] = round(SUGGESTION_WEIGHTS[suggestion["type"]] * (1 + math.log1p(popularity)), 4)
+            rank[item] = suggestion["score"]
+            keys = [normalize(suggestion["text"])] if suggestion["type"] == "session_id" else suffix_keys(suggestion["text"])
+            for key in keys:
+                trie.insert(key, item)
+        trie.finalize(rank, SUGGEST_TOP_K)
+
+        with self.lock:
+            self.trie, self.suggestions = trie, suggestions
+            self.built_at = time.time()
+            self.dirty = False
+        stats = {"suggestions": len(suggestions), "nodes": trie.node_count}
+        print(f"🔤 Suggest index built {stats} in {(time.time() - build_start) * 1000:.1f}ms")
+        return stats
+
+    def suggest(self, query: str, limit: int = 8) -> List[Dict[str, Any]]:
+        key = normalize(query)
+        if not key:
+            return []
+        with self.lock:
+            trie, suggestions = self.trie, self.suggestions
+        node = trie.find(key)
+        if node is None:
+            return []
+        return [suggestions[item] for item in node.top[:limit]]
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "suggestions": len(self.suggestions),
+            "nodes": self.trie.node_count,
+            "built_at": self.built_at,
+            "dirty": self.dirty,
+            "tracked_sessions": len(self.popularity)
+        }
+
+# シングルトンインスタンス
+suggest_index = SuggestIndex()
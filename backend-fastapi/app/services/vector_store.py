@@ -0,0 +1,413 @@
+import os
+import json
+import mmap
+import time
+import fcntl
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+STORE_VERSION = 1
+UNASSIGNED = -1
+
+class VectorStore:
+    """メモリマップ型のローカルベクトルストア（IVF近似最近傍インデックス付き）
+
+    ディレクトリ構成:
+      meta.json         - 次元数・型・件数・削除件数・IVFのリスト数
+      vectors.bin       - 正規化済みベクトル（行優先、float16/float32）
+      ids.jsonl         - 行番号 → ID・メタデータ（サイドカー）
+      ids.offsets       - ids.jsonl の各行の開始位置（int64）
+      deleted.bin       - 削除した行番号（int64、追記のみ）
+      ivf_centroids.npy - IVFのセントロイド
+      ivf_assign.bin    - 各ベクトルの所属リスト（int32、未割り当ては -1）
+      write.lock        - 書き込み（追記・削除・インデックス作成）の排他用（fcntl.flock）
+
+    ベクトル・サイドカーは読み取り専用の memmap で開くので、複数ワーカー間でページキャッシュを共有する
+    サイドカーは検索結果の行のみ読み出し、ID・セッションIDの索引は必要になった時点で作る
+    削除した行は検索対象から外すだけで領域は残る（作り直すと詰められる）
+
+    書き込みはプロセス間でファイルロックを取り、各ファイルは一時ファイルに書いてから置き換え、
+    meta.json を最後に置き換える（途中で落ちても meta.json の件数までが有効で、残った書きかけは次の書き込みで捨てる）
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.meta: Optional[Dict[str, Any]] = None
+        self.vectors = None
+        self.assign = None
+        self.centroids = None
+        self.list_order = None
+        self.list_offsets = None
+        self.offsets = None
+        self.sidecar: Any = b""
+        self.deleted = None
+        # meta.json の (inode, 更新時刻, サイズ) と読み込んだ内容（変わっていなければ再読み込みしない）
+        self.meta_stat: Optional[Tuple[int, int, int]] = None
+        self.meta_cache: Optional[Dict[str, Any]] = None
+        # session_id / ID → 行番号（削除済みを除く、indexed_rows 行目まで作成済み）
+        self.session_rows: Dict[str, List[int]] = {}
+        self.id_rows: Dict[str, List[int]] = {}
+        self.indexed_rows = 0
+        self.loaded_count = -1
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def exists(self) -> bool:
+        return os.path.exists(self._path('meta.json'))
+
+    @contextmanager
+    def _write_lock(self):
+        """追記・削除・インデックス作成を全プロセスで1つずつ実行する（ロック取得後に最新の meta.json を読み直す）"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path('write.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _replace_file(self, name: str, data: bytes, keep: int = 0):
+        """先頭 keep バイト（meta.json で有効な範囲）に data を続けた内容を一時ファイルに書いて置き換える
+
+        memmap で開いている読み込み中のワーカーは置き換え前のファイルを参照し続ける
+        """
+        tmp_path = self._path(name + '.tmp')
+        with open(tmp_path, 'wb') as dst:
+            if keep:
+                with open(self._path(name), 'rb') as src:
+                    remaining = keep
+                    while remaining > 0:
+                        chunk = src.read(min(remaining, 1 << 20))
+                        if not chunk:
+                            raise ValueError(f"Vector store file {name} is shorter than meta.json ({keep} bytes)")
+                        dst.write(chunk)
+                        remaining -= len(chunk)
+            dst.write(data)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, self._path(name))
+
+    def _write_meta(self, meta: Dict[str, Any]):
+        # 読み込み中のワーカーが壊れたメタデータを見ないようにアトミックに置き換え（他のファイルの後に書く）
+        tmp_path = self._path('meta.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path('meta.json'))
+
+    def create(self, dim: int, dtype: str = 'float16'):
+        """空のストアを作成"""
+        with self._write_lock():
+            self._create(dim, dtype)
+
+    def _create(self, dim: int, dtype: str):
+        if dtype not in ('float16', 'float32'):
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        for name in ('vectors.bin', 'ids.jsonl', 'ids.offsets', 'deleted.bin', 'ivf_assign.bin'):
+            self._replace_file(name, b"")
+        if os.path.exists(self._path('ivf_centroids.npy')):
+            os.remove(self._path('ivf_centroids.npy'))
+        self._write_meta({"version": STORE_VERSION, "dim": dim, "dtype": dtype, "count": 0, "deleted": 0, "nlist": 0, "metric": "cosine", "sidecar_bytes": 0})
+        self.loaded_count = -1
+
+    def _read_meta(self) -> Dict[str, Any]:
+        """meta.json（置き換えられていなければ前回読み込んだ内容を返す）"""
+        stat = os.stat(self._path('meta.json'))
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key != self.meta_stat or self.meta_cache is None:
+            with open(self._path('meta.json')) as f:
+                self.meta_cache = json.load(f)
+            self.meta_stat = key
+        return self.meta_cache
+
+    def _load_offsets(self, count: int) -> np.ndarray:
+        """ids.jsonl の行の開始位置（索引がない・足りない既存のストアは一度だけ走査して作る）"""
+        path = self._path('ids.offsets')
+        stored = os.path.getsize(path) // 8 if os.path.exists(path) else 0
+        if stored < count:
+            offsets = []
+            with open(self._path('ids.jsonl'), 'rb') as f:
+                position = 0
+                for line in f:
+                    offsets.append(position)
+                    position += len(line)
+            np.asarray(offsets[:count], dtype=np.int64).tofile(path)
+            print(f"🧭 Rebuilt vector store sidecar offsets ({count} rows)")
+        if not count:
+            return np.zeros((0,), dtype=np.int64)
+        return np.memmap(path, dtype=np.int64, mode='r', shape=(count,))
+
+    def _open_sidecar(self):
+        with open(self._path('ids.jsonl'), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def load(self, force: bool = False) -> bool:
+        """memmapで開く（meta.json が変わっていなければ何もしない）。ストアがない場合は False"""
+        if not self.exists():
+            return False
+
+        meta = self._read_meta()
+        if meta.get('version') != STORE_VERSION:
+            raise ValueError(f"Unsupported vector store version: {meta.get('version')}")
+        if not force and meta is self.meta:
+            return True
+
+        load_start = time.time()
+        with self.lock:
+            count, dim = meta['count'], meta['dim']
+            if count:
+                self.vectors = np.memmap(self._path('vectors.bin'), dtype=meta['dtype'], mode='r', shape=(count, dim))
+                self.assign = np.memmap(self._path('ivf_assign.bin'), dtype=np.int32, mode='r', shape=(count,))
+            else:
+                self.vectors = np.zeros((0, dim), dtype=meta['dtype'])
+                self.assign = np.zeros((0,), dtype=np.int32)
+            self.offsets = self._load_offsets(count)
+            self.sidecar = self._open_sidecar()
+
+            deleted_count = meta.get('deleted', 0)
+            self.deleted = None
+            if deleted_count:
+                rows = np.fromfile(self._path('deleted.bin'), dtype=np.int64, count=deleted_count)
+                self.deleted = np.zeros(count, dtype=bool)
+                self.deleted[rows[rows < count]] = True
+
+            # IDの索引は追記分だけ作り足す（削除があった場合は作り直す）
+            if force or count < self.indexed_rows or deleted_count != (self.meta or {}).get('deleted', 0):
+                self.session_rows = {}
+                self.id_rows = {}
+                self.indexed_rows = 0
+
+            self.centroids = None
+            self.list_order = None
+            self.list_offsets = None
+            if meta.get('nlist') and os.path.exists(self._path('ivf_centroids.npy')):
+                self.centroids = np.load(self._path('ivf_centroids.npy'), mmap_mode='r')
+                # リストごとの行番号を連続領域に並べる（所属リスト順の安定ソート）
+                self.list_order = np.argsort(self.assign, kind='stable').astype(np.int64)
+                sorted_assign = np.asarray(self.assign)[self.list_order]
+                self.list_offsets = np.searchsorted(sorted_assign, np.arange(UNASSIGNED, meta['nlist'] + 1))
+
+            self.meta = meta
+            self.loaded_count = count
+
+        print(f"🧭 Vector store loaded {count} vectors (dim: {meta['dim']}, nlist: {meta.get('nlist', 0)}) in {(time.time() - load_start) * 1000:.1f}ms")
+        return True
+
+    def entry(self, row: int) -> Dict[str, Any]:
+        """行のIDとメタデータ（サイドカーの該当行のみ読み出す）"""
+        start = int(self.offsets[row])
+        end = self.sidecar.find(b"\n", start)
+        return json.loads(self.sidecar[start:end if end >= 0 else len(self.sidecar)])
+
+    def _index_rows(self):
+        """未作成の行の session_id / ID の索引を作る"""
+        with self.lock:
+            count = self.loaded_count
+            for row in range(self.indexed_rows, count):
+                if self.deleted is not None and self.deleted[row]:
+                    continue
+                entry = self.entry(row)
+                self.id_rows.setdefault(entry["id"], []).append(row)
+                session_id = entry.get("meta", {}).get("session_id")
+                if session_id:
+                    self.session_rows.setdefault(session_id, []).append(row)
+            self.indexed_rows = max(self.indexed_rows, count)
+
+    def live_ids(self) -> Set[str]:
+        """削除されていないベクトルのID"""
+        if not self.load():
+            return set()
+        self._index_rows()
+        return set(self.id_rows)
+
+    def session_vector_ids(self, session_id: str) -> Set[str]:
+        """セッションの削除されていないパッセージのID"""
+        if not self.load():
+            return set()
+        self._index_rows()
+        return {self.entry(row)["id"] for row in self.session_rows.get(session_id, [])}
+
+    def delete(self, ids: Iterable[str]) -> int:
+        """IDのベクトルを検索対象から外す（差し替えられたパッセージ用）。削除した行数"""
+        ids = list(ids)
+        with self._write_lock():
+            if not self.load():
+                return 0
+            self._index_rows()
+            rows = sorted({row for vector_id in ids for row in self.id_rows.get(vector_id, [])})
+            if not rows:
+                return 0
+            deleted = self.meta.get('deleted', 0)
+            self._replace_file('deleted.bin', np.asarray(rows, dtype=np.int64).tobytes(), keep=deleted * 8)
+            meta = dict(self.meta)
+            meta['deleted'] = deleted + len(rows)
+            self._write_meta(meta)
+            self.load()
+        return len(rows)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _nearest_lists(self, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+
+    def _sidecar_bytes(self, meta: Dict[str, Any]) -> int:
+        """ids.jsonl の有効な長さ（meta.json に記録がない既存のストアは最終行の末尾から求める）"""
+        if 'sidecar_bytes' in meta:
+            return meta['sidecar_bytes']
+        count = meta['count']
+        if not count:
+            return 0
+        end = self.sidecar.find(b"\n", int(self.offsets[count - 1]))
+        return end + 1 if end >= 0 else len(self.sidecar)
+
+    def append(self, ids: Sequence[str], vectors: Sequence[Sequence[float]], metas: Optional[Sequence[Dict[str, Any]]] = None) -> int:
+        """ベクトルを追記（インジェスト時の差分追加用）。学習済みならその場でリストに割り当てる"""
+        with self._write_lock():
+            if not self.exists():
+                self._create(len(vectors[0]), 'float16')
+            self.load()
+            return self._append(ids, vectors, metas)
+
+    def _append(self, ids: Sequence[str], vectors: Sequence[Sequence[float]], metas: Optional[Sequence[Dict[str, Any]]]) -> int:
+        count, dim, dtype = self.meta['count'], self.meta['dim'], self.meta['dtype']
+        normalized = self._normalize(vectors)
+        if normalized.ndim != 2 or normalized.shape[1] != dim:
+            raise ValueError(f"Expected vectors of dimension {dim}, got {normalized.shape}")
+
+        if self.centroids is not None:
+            assign = self._nearest_lists(normalized, np.asarray(self.centroids, dtype=np.float32))
+        else:
+            assign = np.full(len(normalized), UNASSIGNED, dtype=np.int32)
+
+        metas = metas or [{} for _ in ids]
+        lines = [
+            (json.dumps({"id": vector_id, "meta": meta}, ensure_ascii=False) + "\n").encode('utf-8')
+            for vector_id, meta in zip(ids, metas)
+        ]
+        # 新しい行の開始位置（meta.json で有効なサイドカーの末尾から。書きかけの行があれば上書きされる）
+        sidecar_bytes = self._sidecar_bytes(self.meta)
+        offsets = sidecar_bytes + np.cumsum([0] + [len(line) for line in lines[:-1]], dtype=np.int64)
+        self._replace_file('vectors.bin', normalized.astype(dtype).tobytes(), keep=count * dim * np.dtype(dtype).itemsize)
+        self._replace_file('ivf_assign.bin', assign.tobytes(), keep=count * 4)
+        self._replace_file('ids.jsonl', b"".join(lines), keep=sidecar_bytes)
+        self._replace_file('ids.offsets', offsets.astype(np.int64).tobytes(), keep=count * 8)
+
+        meta = dict(self.meta)
+        meta['count'] = count + len(normalized)
+        meta['sidecar_bytes'] = sidecar_bytes + sum(len(line) for line in lines)
+        self._write_meta(meta)
+        self.load()
+        return meta['count']
+
+    def build_index(self, nlist: Optional[int] = None, iterations: int = 10, sample_size: int = 50000, seed: int = 0):
+        """球面k-meansでIVFのセントロイドを学習し、全ベクトルをリストに割り当て直す"""
+        with self._write_lock():
+            self._build_index(nlist, iterations, sample_size, seed)
+
+    def _build_index(self, nlist: Optional[int], iterations: int, sample_size: int, seed: int):
+        self.load()
+        count = self.meta['count']
+        if count == 0:
+            return
+        nlist = nlist or max(1, int(np.sqrt(count)))
+        nlist = min(nlist, count)
+
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+        sample = np.asarray(self.vectors[sample_rows], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            labels = self._nearest_lists(sample, centroids)
+            for list_id in range(nlist):
+                members = sample[labels == list_id]
+                if len(members):
+                    centroids[list_id] = members.mean(axis=0)
+                else:
+                    # 空のリストはランダムなサンプルで置き換え
+                    centroids[list_id] = sample[rng.integers(len(sample))]
+            centroids = self._normalize(centroids)
+
+        assign = np.empty(count, dtype=np.int32)
+        for start in range(0, count, 65536):
+            chunk = np.asarray(self.vectors[start:start + 65536], dtype=np.float32)
+            assign[start:start + len(chunk)] = self._nearest_lists(chunk, centroids)
+
+        with open(self._path('ivf_centroids.npy.tmp'), 'wb') as f:
+            np.save(f, centroids.astype(np.float32))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self._path('ivf_centroids.npy.tmp'), self._path('ivf_centroids.npy'))
+        self._replace_file('ivf_assign.bin', assign.tobytes())
+        meta = dict(self.meta)
+        meta['nlist'] = nlist
+        self._write_meta(meta)
+        self.load(force=True)
+        print(f"🧭 Built IVF index with {nlist} lists over {count} vectors")
+
+    def _top_k(self, rows: np.ndarray, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        if self.deleted is not None:
+            rows = rows[~self.deleted[rows]]
+        if len(rows) == 0:
+            return []
+        scores = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+    def _results(self, scored: List[Tuple[int, float]]) -> List[Dict[str, Any]]:
+        entries = [(self.entry(row), score) for row, score in scored]
+        return [{"id": entry["id"], "score": score, "meta": entry.get("meta", {})} for entry, score in entries]
+
+    def search(self, query_vector: Sequence[float], k: int = 10, nprobe: int = 8) -> List[Dict[str, Any]]:
+        """近似最近傍検索（上位 nprobe 個のリストと未割り当ての追記分のみを走査）"""
+        if not self.load() or self.meta['count'] == 0:
+            return []
+        query = self._normalize(query_vector)
+
+        if self.centroids is None:
+            return self.search_brute_force(query_vector, k)
+
+        nlist = self.meta['nlist']
+        centroid_scores = np.asarray(self.centroids, dtype=np.float32) @ query
+        probe = np.argpartition(-centroid_scores, min(nprobe, nlist) - 1)[:min(nprobe, nlist)]
+
+        # list_offsets[0] は未割り当て（-1）の範囲
+        ranges = [(self.list_offsets[0], self.list_offsets[1])]
+        ranges.extend((self.list_offsets[list_id + 1], self.list_offsets[list_id + 2]) for list_id in probe)
+        rows = np.concatenate([self.list_order[start:end] for start, end in ranges])
+        return self._results(self._top_k(np.sort(rows), query, k))
+
+    def search_brute_force(self, query_vector: Sequence[float], k: int = 10) -> List[Dict[str, Any]]:
+        """全件走査（精度の基準・小規模ストア用）"""
+        if not self.load() or self.meta['count'] == 0:
+            return []
+        query = self._normalize(query_vector)
+        best: List[Tuple[int, float]] = []
+        for start in range(0, self.meta['count'], 65536):
+            rows = np.arange(start, min(start + 65536, self.meta['count']))
+            best = sorted(best + self._top_k(rows, query, k), key=lambda x: x[1], reverse=True)[:k]
+        return self._results(best)
+
+    def summary(self) -> Dict[str, Any]:
+        loaded = self.load()
+        return {
+            "directory": self.directory,
+            "loaded": loaded,
+            "meta": self.meta
+        }
+
+# シングルトンインスタンス
+vector_store = VectorStore(os.getenv('VECTOR_STORE_DIR', os.path.join(os.path.dirname(__file__), '..', '..', 'vector_store')))
@@ -2,17 +2,25 @@ import os
 import sys
 import asyncio
 import json
-import time
 
 # プロジェクトのルートパスを追加（インポートエラー回避）
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from app.services.opensearch_client import opensearch_client
+from app.services.passage_indexer import index_documents
+from app.services.ingestion import build_enhanced_document
+from app.services.session_store import SessionStore
+from app.services.lexical_index import write_snapshot, snapshot_path
+from app.services.change_feed import change_feed
+from app.services.federated_search import EVENT_INDICES, DEFAULT_EVENT
 from dotenv import load_dotenv
 
 # 環境変数読み込み
 load_dotenv()
 
+# 投入先のイベント（OPENSEARCH_INDICES のイベント名、省略時は既定イベント）
+INDEX_NAME = EVENT_INDICES[os.getenv('INGEST_EVENT', DEFAULT_EVENT)]
+
 # 講演要約データ（既存と同じ）
 transcript_data = {
     "AWS-08": """# 生成AIのためのデータ活用実践ガイド要約
@@ -205,7 +213,7 @@ async def find_session_by_id(session_id: str):
             }
         }
         
-        response = client.search(index="aws_summit_sessions", body=search_query)
+        response = client.search(index=INDEX_NAME, body=search_query)
         
         if response['hits']['hits']:
             return response['hits']['hits'][0]
@@ -227,26 +235,30 @@ async def create_enhanced_session_document(session_id: str, transcript_content:
             original_doc = hit['_source']
             print(f"✅ Found original session: {original_doc['title']}")
             
-            # 拡張ドキュメントを作成
-            enhanced_doc = original_doc.copy()
-            enhanced_doc['transcript_summary'] = transcript_content
-            enhanced_doc['has_detailed_content'] = True
-            enhanced_doc['data_version'] = 'enhanced_v1'
-            enhanced_doc['enhanced_timestamp'] = time.time()
+            # 拡張ドキュメントを作成（管理API POST /admin/documents と同じ形式）
+            enhanced_doc = build_enhanced_document(original_doc, transcript_content)
             
             # 新しいドキュメントとして追加
             client = await opensearch_client.initialize()
             response = client.index(
-                index="aws_summit_sessions",
+                index=INDEX_NAME,
                 body=enhanced_doc
             )
             
             new_doc_id = response['_id']
+            # 稼働中のワーカーが差分として取り込めるよう変更ログに記録
+            seq = change_feed.record("upsert", INDEX_NAME, new_doc_id, enhanced_doc)
             print(f"✅ Successfully created enhanced session document")
-            print(f"📄 New document ID: {new_doc_id}")
+            print(f"📄 New document ID: {new_doc_id} (change seq {seq})")
             print(f"📄 Added transcript summary ({len(transcript_content)} characters)")
             print(f"🔗 Original document preserved")
             
+            # 講演要約のパッセージをベクトルストアにも追加（埋め込みキャッシュにより変更分のみ計算）
+            try:
+                await index_documents([enhanced_doc])
+            except Exception as e:
+                print(f"⚠️ Vector indexing skipped for {session_id}: {e}")
+            
             return True
             
         else:
@@ -275,7 +287,7 @@ async def verify_enhanced_session(session_id: str):
             }
         }
         
-        response = client.search(index="aws_summit_sessions", body=search_query)
+        response = client.search(index=INDEX_NAME, body=search_query)
         
         if response['hits']['hits']:
             enhanced_doc = response['hits']['hits'][0]['_source']
@@ -331,5 +343,14 @@ async def main():
     else:
         print("⚠️ Some enhancements failed. Please check the logs above.")
 
+    # ローカル検索インデックスのスナップショットを更新（scripts/build_lexical_snapshot.py と同じ内容）
+    if success_count:
+        try:
+            store = SessionStore()
+            await store.warm_up()
+            write_snapshot(snapshot_path(), [(hit.id, hit.session.source) for hit in store.documents.values()])
+        except Exception as e:
+            print(f"⚠️ Lexical snapshot rebuild failed: {e}")
+
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+# プロジェクトのルートパスを追加（インポートエラー回避）
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.models.search import SearchHit, Session
+
+def make_response(sources, size):
+    """OpenSearchの検索レスポンス相当（_source はデシリアライズ済みの辞書）"""
+    hits = []
+    for i in range(size):
+        source = sources[i % len(sources)]
+        hit = {'_id': f"doc-{i}", '_score': 10.0 - i * 0.1, '_source': source}
+        if source.get('transcript_summary'):
+            hit['highlight'] = {'transcript_summary': [source['transcript_summary'][:150]]}
+        hits.append(hit)
+    return {'hits': {'hits': hits}}
+
+def legacy_pipeline(response):
+    """OpenSearchの結果の辞書への変換とコンテキスト構築（検索パイプラインと同じ表現）"""
+    results = []
+    for hit in response['hits']['hits']:
+        source = hit.get('_source', {})
+        result_data = {'id': hit['_id'], 'score': hit['_score'], 'source': source}
+        fragments = hit.get('highlight', {}).get('transcript_summary')
+        if fragments:
+            result_data['transcript_fragments'] = fragments
+        if fragments or ('transcript_summary' in source and source['transcript_summary']):
+            result_data['has_transcript'] = True
+        results.append(result_data)
+
+    context = ""
+    for result in results:
+        context += f"タイトル: {result['source']['title']}\n"
+        if 'abstract' in result['source']:
+            context += f"概要: {result['source']['abstract']}\n"
+        if result.get('transcript_fragments'):
+            context += f"詳細内容: {' … '.join(result['transcript_fragments'])}\n"
+        if 'speakers' in result['source'] and result['source']['speakers']:
+            speaker_names = []
+            for speaker in result['source']['speakers']:
+                speaker_names.append(f"{speaker['name']}（{speaker['company']}）")
+            context += f"講演者: {', '.join(speaker_names)}\n"
+    return results, context
+
+def legacy_stored_hits(stored):
+    """保存フィールドを上位文書すべてで即時デコード（ローカルインデックスの従来方式）"""
+    return [{'id': doc_id, 'score': 1.0, 'source': json.loads(blob)} for doc_id, blob in stored]
+
+def lazy_stored_hits(stored):
+    """Session.from_encoded で参照されるまでデコードしない（件数・IDしか使わない場合）"""
+    return [SearchHit(doc_id, 1.0, Session.from_encoded(blob)) for doc_id, blob in stored]
+
+def measure(name, pipeline, response, iterations):
+    # 割り当て数: 1リクエスト分の結果を保持したままの確保ブロック数とバイト数
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    retained = pipeline(response)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    size = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    del retained
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        pipeline(response)
+    per_call_us = (time.perf_counter() - start) * 1e6 / iterations
+
+    print(f"   - {name:8s}: {blocks:6d} blocks, {size / 1024:8.1f} KiB retained, peak {peak / 1024:8.1f} KiB, {per_call_us:8.1f}µs/request")
+
+def main():
+    # OpenSearchの結果（_source がデコード済み）は辞書のまま扱うので、辞書の経路は基準値として計測する。
+    # SearchHit を使うのは保存済みのJSONを参照時までデコードしない経路（セッションマップ・ローカルインデックス）のみ
+    parser = argparse.ArgumentParser(description="検索結果の辞書表現と保存済みドキュメントの遅延デコードのメモリ割り当て・処理時間")
+    parser.add_argument('--json', default=os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'aws_summit_sessions.json'))
+    parser.add_argument('--hits', default='3,30,300', help="1レスポンスあたりのヒット数（カンマ区切り）")
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(args.json, encoding='utf-8') as f:
+        sources = json.load(f)
+
+    for size in [int(n) for n in args.hits.split(',')]:
+        response = make_response(sources, size)
+        print(f"📊 {size} hits per response:")
+        measure("dict", legacy_pipeline, response, args.iterations)
+
+        stored = [(hit['_id'], json.dumps(hit['_source'], ensure_ascii=False).encode('utf-8')) for hit in response['hits']['hits']]
+        print(f"📦 {size} stored hits, only ids used:")
+        measure("eager", legacy_stored_hits, stored, args.iterations)
+        measure("lazy", lazy_stored_hits, stored, args.iterations)
+
+if __name__ == "__main__":
+    main()
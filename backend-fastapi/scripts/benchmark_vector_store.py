@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+# プロジェクトのルートパスを追加（インポートエラー回避）
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.vector_store import VectorStore
+
+def make_clustered_vectors(count, dim, clusters, seed):
+    """実データに近いクラスタ構造を持つ合成ベクトル"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(clusters, size=count)
+    return centers[labels] + 0.5 * rng.normal(size=(count, dim)).astype(np.float32)
+
+def main():
+    parser = argparse.ArgumentParser(description="ベクトルストアのIVF近似検索と全件走査の再現率・レイテンシ比較")
+    parser.add_argument('--store', help="既存のストアを使う（省略時は合成データで一時ストアを作成）")
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--dtype', default='float16', choices=['float16', 'float32'])
+    parser.add_argument('--nlist', type=int, default=0, help="IVFのリスト数（0 は sqrt(件数)）")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nprobe', default='1,4,8,16,32')
+    args = parser.parse_args()
+
+    temp_dir = None
+    if args.store:
+        store = VectorStore(args.store)
+        if not store.load():
+            print(f"❌ Vector store not found: {args.store}")
+            return
+    else:
+        temp_dir = tempfile.mkdtemp(prefix="vector_store_bench_")
+        store = VectorStore(temp_dir)
+        store.create(args.dim, args.dtype)
+        vectors = make_clustered_vectors(args.count, args.dim, clusters=max(10, args.count // 1000), seed=0)
+        append_start = time.time()
+        for start in range(0, args.count, 10000):
+            chunk = vectors[start:start + 10000]
+            store.append([f"doc-{start + i}" for i in range(len(chunk))], chunk)
+        print(f"📥 Appended {args.count} vectors in {time.time() - append_start:.2f}s")
+
+        build_start = time.time()
+        store.build_index(nlist=args.nlist or None)
+        print(f"🏗️ Built index in {time.time() - build_start:.2f}s")
+
+    # 起動時を想定した読み込み時間（新しいインスタンスで memmap を開く）
+    load_start = time.time()
+    VectorStore(store.directory).load()
+    print(f"⚡ Cold load: {(time.time() - load_start) * 1000:.1f}ms")
+
+    rng = np.random.default_rng(1)
+    query_rows = rng.choice(store.meta['count'], size=args.queries, replace=False)
+    queries = [np.asarray(store.vectors[row], dtype=np.float32) + 0.1 * rng.normal(size=store.meta['dim']) for row in query_rows]
+
+    brute_start = time.time()
+    truth = [{r['id'] for r in store.search_brute_force(q, args.k)} for q in queries]
+    brute_ms = (time.time() - brute_start) * 1000 / len(queries)
+    print(f"🐢 Brute force: {brute_ms:.2f}ms/query")
+
+    print(f"📊 Recall@{args.k} vs latency:")
+    for nprobe in [int(n) for n in args.nprobe.split(',')]:
+        search_start = time.time()
+        found = [{r['id'] for r in store.search(q, args.k, nprobe)} for q in queries]
+        ann_ms = (time.time() - search_start) * 1000 / len(queries)
+        recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+        print(f"   - nprobe={nprobe:3d}: recall {recall:.3f}, {ann_ms:.2f}ms/query ({brute_ms / ann_ms:.1f}x faster)")
+
+    if temp_dir:
+        shutil.rmtree(temp_dir)
+
+if __name__ == "__main__":
+    main()
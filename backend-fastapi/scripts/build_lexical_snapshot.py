@@ -0,0 +1,50 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+# プロジェクトのルートパスを追加（インポートエラー回避）
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.lexical_index import LexicalIndex, write_snapshot, snapshot_path
+from app.services.session_store import session_store
+from dotenv import load_dotenv
+
+# 環境変数読み込み
+load_dotenv()
+
+async def main():
+    parser = argparse.ArgumentParser(description="セッション・講演要約からローカル検索インデックスのスナップショットを作成")
+    parser.add_argument('--json', help="OpenSearchの代わりにJSONファイルから読み込む（例: ../data/aws_summit_sessions.json）")
+    parser.add_argument('--output', default=None, help="出力先（省略時は LEXICAL_SNAPSHOT_PATH）")
+    args = parser.parse_args()
+
+    print("🚀 Building lexical snapshot...")
+    print("=" * 60)
+
+    if args.json:
+        with open(args.json, encoding='utf-8') as f:
+            documents = [(source.get('session_id') or str(i), source) for i, source in enumerate(json.load(f))]
+    else:
+        # 同じセッションIDの最新ドキュメント（拡張版優先）のみを対象にする
+        await session_store.warm_up()
+        documents = [(hit.id, hit.session.source) for hit in session_store.documents.values()]
+
+    path = args.output or snapshot_path()
+    stats = write_snapshot(path, documents)
+
+    # 新しいワーカーと同じ条件で開く時間を確認
+    open_start = time.time()
+    LexicalIndex(path).open()
+
+    print("\n" + "=" * 60)
+    print(f"📊 Snapshot Summary:")
+    print(f"   - Documents: {stats['documents']}")
+    print(f"   - Terms: {stats['terms']}")
+    print(f"   - Size: {stats['bytes'] / 1024:.1f} KiB")
+    print(f"   - Open time: {(time.time() - open_start) * 1000:.2f}ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,50 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+
+# プロジェクトのルートパスを追加（インポートエラー回避）
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.passage_indexer import index_documents
+from app.services.session_store import session_store
+from app.services.vector_store import vector_store
+from app.services.embedding_cache import embedding_cache
+from dotenv import load_dotenv
+
+# 環境変数読み込み
+load_dotenv()
+
+async def main():
+    parser = argparse.ArgumentParser(description="セッション・講演要約のパッセージをベクトルストアにインデックス")
+    parser.add_argument('--json', help="OpenSearchの代わりにJSONファイルから読み込む（例: ../data/aws_summit_sessions.json）")
+    parser.add_argument('--build-index', action='store_true', help="追記後にIVFインデックスを再学習する")
+    parser.add_argument('--nlist', type=int, default=0)
+    args = parser.parse_args()
+
+    print("🚀 Starting vector store indexing...")
+    print("=" * 60)
+
+    if args.json:
+        with open(args.json, encoding='utf-8') as f:
+            sources = json.load(f)
+    else:
+        # 同じセッションIDの最新ドキュメント（拡張版優先）のみを対象にする
+        await session_store.warm_up()
+        sources = [hit.session.source for hit in session_store.documents.values()]
+
+    print(f"📋 Loaded {len(sources)} documents")
+    stats = await index_documents(sources)
+
+    if args.build_index:
+        vector_store.build_index(nlist=args.nlist or None)
+
+    print("\n" + "=" * 60)
+    print(f"📊 Indexing Summary:")
+    print(f"   - New passages: {stats['indexed']}")
+    print(f"   - Unchanged passages: {stats['unchanged']}")
+    print(f"   - Embedding cache: {embedding_cache.stats}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+
+# プロジェクトのルートパスを追加（インポートエラー回避）
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.opensearch_client import opensearch_client
+from app.services.federated_search import EVENT_INDICES, DEFAULT_EVENT
+from app.services.index_schema import schema_manager, index_body, SCHEMA_VERSION
+from dotenv import load_dotenv
+
+# 環境変数読み込み
+load_dotenv()
+
+async def main():
+    parser = argparse.ArgumentParser(description="版付きインデックスとエイリアスの管理（マッピングは app/services/index_schema.py）")
+    parser.add_argument('command', choices=['status', 'show', 'ensure', 'migrate'],
+                        help="status: 定義との差分 / show: 定義のJSON / ensure: エイリアスがなければ作成 / migrate: 現在の版へコピーしてエイリアスを付け替え")
+    parser.add_argument('--event', default=DEFAULT_EVENT, help=f"対象のイベント（{', '.join(EVENT_INDICES)}）")
+    parser.add_argument('--delete-old', action='store_true', help="付け替え後に以前のインデックスを削除")
+    parser.add_argument('--replace-legacy', action='store_true',
+                        help="エイリアスと同名のインデックス（エイリアス導入前）をコピー後に削除して置き換える（削除から付け替えまで検索できない）")
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        print(json.dumps(index_body(), ensure_ascii=False, indent=2))
+        return
+
+    alias = EVENT_INDICES[args.event]
+    client = await opensearch_client.initialize()
+
+    if args.command == 'ensure':
+        schema_manager.ensure(client, alias)
+    elif args.command == 'migrate':
+        print(f"🚀 Migrating {alias} to schema v{SCHEMA_VERSION}...")
+        print("=" * 60)
+        result = schema_manager.migrate(client, alias, delete_old=args.delete_old, replace_legacy=args.replace_legacy)
+        print("\n" + "=" * 60)
+        print(f"📊 Migration Summary:")
+        print(f"   - {result['source'] or '(none)'} → {result['target']}")
+        print(f"   - Copied: {result['copied']} (+{result['caught_up']} ingested during copy)")
+        print(f"   - Time: {result['took']:.2f}s")
+        # AOSSではコピー時にドキュメントIDが変わるので、IDを保持しているローカルのインデックスを作り直す
+        print("💡 Restart workers to reload the session map (and rebuild the lexical snapshot with scripts/build_lexical_snapshot.py if you use it)")
+
+    schema_manager.detect(client, [alias])
+    status = schema_manager.status([alias])["indices"][alias]
+    print(f"🗺️ {alias}: schema v{status['schema_version']} (expected v{status['expected_version']})")
+    for path, types in status["drift"].items():
+        print(f"   - {path}: {types['actual']} (expected {types['expected']})")
+    if not status["drift"]:
+        print("✅ Mapping matches the schema definition")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+import os
+import sys
+import glob
+import json
+import time
+import asyncio
+import argparse
+import urllib.request
+import urllib.error
+from collections import Counter, defaultdict
+
+# プロジェクトのルートパスを追加（インポートエラー回避）
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+def load_entries(patterns):
+    """クエリログ（ワーカーごとのファイル・ローテーション済みファイル含む）を時刻順に読み込む"""
+    paths = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    entries = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"⚠️ Skipping broken line in {path}")
+    # 同時刻のエントリも毎回同じ順序になるようにハッシュで安定ソート
+    entries.sort(key=lambda e: (e.get('ts', 0), e.get('qh', '')))
+    print(f"📂 Loaded {len(entries)} entries from {len(paths)} files")
+    return entries
+
+def percentile(values, ratio):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+def print_report(entries, top):
+    """フォールバック経路の分析（どのクエリが複数回の検索試行を要しているか）"""
+    paths = Counter(e.get('path') or 'unknown' for e in entries)
+    attempts = Counter(e.get('att', 0) for e in entries)
+    reasons = Counter((e.get('sel') or {}).get('reason', 'none') for e in entries)
+
+    by_query = defaultdict(lambda: {"count": 0, "attempts": 0, "query": None})
+    for e in entries:
+        stats = by_query[e.get('qh')]
+        stats["count"] += 1
+        stats["attempts"] += e.get('att', 0)
+        stats["query"] = e.get('q', e.get('qh'))
+
+    print("📊 Search path distribution:")
+    for path, count in paths.most_common():
+        print(f"   - {path}: {count}")
+    print("📊 Search attempts per request:")
+    for count, frequency in sorted(attempts.items()):
+        print(f"   - {count} attempts: {frequency}")
+    print("📊 Selected candidate reasons:")
+    for reason, count in reasons.most_common():
+        print(f"   - {reason}: {count}")
+
+    print(f"🔥 Top {top} queries by total fallback attempts:")
+    ranked = sorted(by_query.values(), key=lambda s: s["attempts"], reverse=True)
+    for stats in ranked[:top]:
+        average = stats["attempts"] / stats["count"]
+        print(f"   - {stats['query']} (requests: {stats['count']}, avg attempts: {average:.2f})")
+
+    for stage in ['opensearch', 'llm_keyword', 'llm_response', 'total']:
+        values = [e['t'][stage] for e in entries if stage in e.get('t', {})]
+        if values:
+            print(f"⏱️ {stage}: p50 {percentile(values, 0.5):.1f}ms, p95 {percentile(values, 0.95):.1f}ms, p99 {percentile(values, 0.99):.1f}ms")
+
+def request_body(entry):
+    """ログの1件から元のリクエスト（質問文・対象イベント・構造化フィルタ）を組み立てる"""
+    body = {"message": entry['q']}
+    if entry.get('ev'):
+        body["events"] = entry['ev']
+    if entry.get('flt'):
+        body["filters"] = entry['flt']
+    return body
+
+def send_request(url, body, timeout):
+    body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    start = time.time()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception as e:
+        print(f"❌ Request failed: {e}")
+        status = 0
+    return status, time.time() - start
+
+async def replay(entries, url, speed, concurrency, timeout):
+    """元の到着間隔（speed倍速）でリクエストを再送する。speed=0 は間隔なしで送信"""
+    replayable = [e for e in entries if e.get('q')]
+    if len(replayable) < len(entries):
+        print(f"⚠️ {len(entries) - len(replayable)} entries have no query text and are skipped (logged without QUERY_LOG_STORE_TEXT=true)")
+    if not replayable:
+        return
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+    base_ts = replayable[0]['ts']
+    replay_start = time.time()
+
+    async def run(entry):
+        if speed > 0:
+            delay = (entry['ts'] - base_ts) / speed - (time.time() - replay_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        async with semaphore:
+            status, latency = await asyncio.to_thread(send_request, url, request_body(entry), timeout)
+            results.append((status, latency))
+
+    print(f"🚀 Replaying {len(replayable)} requests to {url} (speed: {speed or 'max'}x, concurrency: {concurrency})")
+    await asyncio.gather(*(run(entry) for entry in replayable))
+
+    elapsed = time.time() - replay_start
+    latencies = [latency * 1000 for _, latency in results]
+    statuses = Counter(status for status, _ in results)
+    print("=" * 60)
+    print(f"📊 Replay Summary:")
+    print(f"   - Requests: {len(results)} in {elapsed:.1f}s ({len(results) / elapsed:.2f} req/s)")
+    print(f"   - Status: {dict(statuses)}")
+    print(f"   - Latency: p50 {percentile(latencies, 0.5):.1f}ms, p95 {percentile(latencies, 0.95):.1f}ms, p99 {percentile(latencies, 0.99):.1f}ms")
+
+async def main():
+    parser = argparse.ArgumentParser(description="クエリログの分析と再送（ベンチマーク・キャッシュ事前ウォームアップ用）")
+    parser.add_argument('logs', nargs='+', help="クエリログのパス（glob可、ワーカーごとのファイルは例: /var/log/rag/query.*.log*）")
+    parser.add_argument('--url', default="http://localhost:8000/api/v2/chat")
+    parser.add_argument('--speed', type=float, default=1.0, help="再送速度の倍率（0 は待ち時間なし）")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--limit', type=int, default=0, help="先頭から再送する件数（0 は全件）")
+    parser.add_argument('--report', action='store_true', help="再送せずに分析のみ行う")
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    entries = load_entries(args.logs)
+    if args.limit:
+        entries = entries[:args.limit]
+
+    if args.report:
+        print_report(entries, args.top)
+        return
+
+    await replay(entries, args.url, args.speed, args.concurrency, args.timeout)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+import asyncio
+
+# プロジェクトのルートパスを追加（インポートエラー回避）
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+from app.services import ingestion
+from app.services.change_feed import ChangeFeed, ChangeFeedTailer
+from app.services.session_store import session_store
+from app.services.shared_cache import shared_cache
+from app.services.vector_store import vector_store
+
+INDEX = session_store.index_name
+
+class FakeIndices:
+    def get_mapping(self, index):
+        return {index: {"mappings": {"properties": {"session_id": {"type": "keyword"}}}}}
+
+class FakeClient:
+    """session_id で検索し、_id 指定の delete と ID なしの index を受け付ける OpenSearch の代わり"""
+    def __init__(self, documents):
+        self.documents = dict(documents)
+        self.written = []
+        self.indices = FakeIndices()
+
+    def search(self, index, body):
+        session_ids = body["query"]["bool"]["filter"][0]["terms"]["session_id"]
+        hits = [
+            {"_id": doc_id, "_source": {"session_id": source["session_id"]}, "sort": [doc_id]}
+            for doc_id, source in sorted(self.documents.items())
+            if source["session_id"] in session_ids and (not body.get("search_after") or doc_id > body["search_after"][0])
+        ]
+        return {"hits": {"hits": hits[:body["size"]]}}
+
+    def bulk(self, body):
+        items = []
+        actions = iter(body)
+        for action in actions:
+            if "index" in action:
+                # ID なしの index 操作（ドキュメントは次の行）
+                doc_id = f"new-{len(self.written)}"
+                self.written.append((action["index"]["_index"], next(actions)))
+                items.append({"index": {"_id": doc_id, "status": 201}})
+                continue
+            doc_id = action["delete"]["_id"]
+            items.append({"delete": {"_id": doc_id, "status": 200 if self.documents.pop(doc_id, None) else 404}})
+        return {"items": items}
+
+@pytest.fixture
+def feed(tmp_path, monkeypatch):
+    feed = ChangeFeed(str(tmp_path / "change_feed.sqlite3"))
+    tailer = ChangeFeedTailer(feed)
+    cleared = []
+    monkeypatch.setattr(ingestion, "change_feed", feed)
+    monkeypatch.setattr(ingestion, "change_feed_tailer", tailer)
+    monkeypatch.setattr(ingestion, "INGEST_INDEX_PASSAGES", False)
+    monkeypatch.setattr(shared_cache, "clear", cleared.append)
+    monkeypatch.setattr(vector_store, "load", lambda force=False: False)
+    monkeypatch.setattr(session_store, "documents", {})
+    yield feed, tailer, cleared
+
+def test_delete_removes_session_from_worker_map(feed, monkeypatch):
+    change_feed, tailer, cleared = feed
+    original = {"session_id": "AWS-01", "title": "元データ"}
+    enhanced = {**original, "has_detailed_content": True, "enhanced_timestamp": 1.0}
+    client = FakeClient({"doc-1": original, "doc-2": enhanced, "doc-3": {"session_id": "AWS-02", "title": "別"}})
+    monkeypatch.setattr(ingestion.opensearch_client, "client", client)
+    for doc_id, source in client.documents.items():
+        session_store.upsert(doc_id, source)
+
+    writer = ingestion.BulkWriter(index_name=INDEX)
+    deleted = asyncio.run(writer.delete(["AWS-01"]))
+
+    assert deleted == 2
+    assert sorted(client.documents) == ["doc-3"]
+    assert [change["op"] for change in change_feed.read_since(0)] == ["delete", "delete"]
+    assert session_store.get("AWS-01") is None
+    assert session_store.get("AWS-02") is not None
+    assert {"search", "negative", "keywords"} <= set(cleared)
+
+def test_stale_delete_keeps_newer_document(feed):
+    change_feed, tailer, _ = feed
+    session_store.upsert("doc-2", {"session_id": "AWS-01", "has_detailed_content": True, "enhanced_timestamp": 1.0})
+    change_feed.record("delete", INDEX, "doc-1", {"session_id": "AWS-01"})
+
+    assert asyncio.run(tailer.poll()) == 1
+    assert session_store.get("AWS-01").id == "doc-2"
+
+def test_flush_writes_each_index_separately(feed, monkeypatch):
+    change_feed, _, _ = feed
+    client = FakeClient({})
+    monkeypatch.setattr(ingestion.opensearch_client, "client", client)
+    batch = [
+        ingestion.PendingDocument("AWS-01", source={"session_id": "AWS-01", "title": "既定"}),
+        ingestion.PendingDocument("AWS-01", source={"session_id": "AWS-01", "title": "前年"}, index_name="sessions_2024"),
+    ]
+
+    asyncio.run(ingestion.BulkWriter(index_name=INDEX).flush(batch, "interval"))
+
+    assert [(index, source["title"]) for index, source in client.written] == [(INDEX, "既定"), ("sessions_2024", "前年")]
+    assert [change["index_name"] for change in change_feed.read_since(0)] == [INDEX, "sessions_2024"]
+    # セッションマップには既定のイベントのみ反映する
+    assert session_store.get("AWS-01").session.title == "既定"
+
+def test_stop_finishes_in_flight_flush(feed, monkeypatch):
+    change_feed, _, _ = feed
+    monkeypatch.setattr(ingestion.opensearch_client, "client", FakeClient({}))
+    monkeypatch.setattr(ingestion, "INGEST_FLUSH_SECONDS", 0.01)
+    writer = ingestion.BulkWriter(index_name=INDEX)
+    bulk = writer._bulk_with_retry
+
+    def slow_bulk(index_name, sources):
+        time.sleep(0.2)
+        return bulk(index_name, sources)
+    monkeypatch.setattr(writer, "_bulk_with_retry", slow_bulk)
+
+    async def scenario():
+        writer.start()
+        writer.submit([ingestion.PendingDocument("AWS-01", source={"session_id": "AWS-01", "title": "停止中"})])
+        while writer.in_flight is None:
+            await asyncio.sleep(0.01)
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert [change["session_id"] for change in change_feed.read_since(0)] == ["AWS-01"]
+    assert writer.stats["indexed"] == 1
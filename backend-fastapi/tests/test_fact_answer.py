@@ -0,0 +1,67 @@
+import os
+import sys
+
+# プロジェクトのルートパスを追加（インポートエラー回避）
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+from app.services.fact_answer import answer_from_fields, detect_intents
+
+SOURCE = {
+    "session_id": "AWS-12",
+    "title": "生成AIの本番運用",
+    "date": "2025-06-25",
+    "start_time": "13:00",
+    "end_time": "13:40",
+    "duration": 40,
+    "speakers": [{"name": "山田 太郎", "title": "SA", "company": "アマゾン ウェブ サービス ジャパン合同会社"}],
+}
+
+@pytest.mark.parametrize("message, expected", [
+    ("AWS-12の講演者は？", ["speakers"]),
+    ("AWS-12はいつ？", ["schedule"]),
+    ("AWS-12は何時何分から？", ["schedule"]),
+    ("AWS-12の開始時間は？", ["schedule"]),
+    ("AWS-12の講演時間は？", ["duration"]),
+    ("AWS-12は何分？", ["duration"]),
+    ("AWS-12の長さは？", ["duration"]),
+    ("AWS-12の所要時間は？", ["duration"]),
+    ("AWS-12は何時間？", ["duration"]),
+    ("AWS-12は誰が登壇しますか？", ["speakers"]),
+    ("AWS-12はどこで開催されますか", ["room"]),
+    ("AWS-12の日時と会場を教えてください", ["schedule", "room"]),
+])
+def test_detect_intents(message, expected):
+    assert detect_intents(message) == expected
+
+@pytest.mark.parametrize("message", [
+    "AWS-12の講演者の経歴は？",
+    "AWS-12の講演者のプロフィールを教えて",
+    "AWS-12の内容は？",
+    # 意図の一語（誰・いつ・どこで）を含むが、セッションの項目を聞いていない質問
+    "AWS-08は誰向けのセッション？",
+    "AWS-08のスライドはどこで見られる？",
+    "AWS-08の録画はいつ公開？",
+])
+def test_open_ended_questions_go_to_llm(message):
+    hit = {"id": "doc-1", "score": 1.0, "source": SOURCE}
+    assert detect_intents(message) == []
+    assert answer_from_fields(message, [hit], ["AWS-12"]) is None
+
+def test_hours_question_is_not_schedule():
+    hit = {"id": "doc-1", "score": 1.0, "source": SOURCE}
+    answer = answer_from_fields("AWS-12は何時間？", [hit], ["AWS-12"])
+    assert answer.intents == ["duration"]
+    assert "40分" in answer.text
+
+def test_duration_answer():
+    hit = {"id": "doc-1", "score": 1.0, "source": SOURCE}
+    answer = answer_from_fields("AWS-12の講演時間は？", [hit], ["AWS-12"])
+    assert answer.intents == ["duration"]
+    assert "40分" in answer.text
+
+def test_schedule_answer_for_clock_time():
+    hit = {"id": "doc-1", "score": 1.0, "source": SOURCE}
+    answer = answer_from_fields("AWS-12は何時何分から？", [hit], ["AWS-12"])
+    assert answer.intents == ["schedule"]
+    assert "13:00〜13:40" in answer.text
@@ -0,0 +1,21 @@
+import os
+import sys
+
+# プロジェクトのルートパスを追加（インポートエラー回避）
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.federated_search import merge_results
+
+def hits(*entries):
+    return [{"id": doc_id, "score": score, "source": {"session_id": session_id, "title": doc_id}}
+            for doc_id, session_id, score in entries]
+
+def test_duplicates_within_an_event_are_removed_regardless_of_other_events():
+    entries = [("original", "AWS-01", 9.0), ("enhanced", "AWS-01", 8.0), ("other", "AWS-02", 4.0)]
+    alone = merge_results({"2025": hits(*entries)}, 10)
+    with_other_event = merge_results({"2025": hits(*entries), "2024": hits(("past", "AWS-01", 5.0))}, 10)
+
+    assert [hit["id"] for hit in alone] == ["original", "other"]
+    assert [hit["id"] for hit in with_other_event if hit["event"] == "2025"] == ["original", "other"]
+    # 別のイベントの同じセッションIDは残す
+    assert [hit["id"] for hit in with_other_event if hit["event"] == "2024"] == ["past"]
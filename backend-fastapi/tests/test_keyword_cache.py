@@ -0,0 +1,62 @@
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+
+# プロジェクトのルートパスを追加（インポートエラー回避）
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+from app.api import chat
+from app.services.deadline import current_deadline, start_deadline
+
+LLM_RESULT = "ソニーグループ(固有名詞・企業名)\n取り組み(名詞)"
+
+@pytest.fixture
+def cache_writes(monkeypatch):
+    writes = []
+
+    async def fake_generate(prompt, stage=None):
+        return SimpleNamespace(text=LLM_RESULT)
+
+    monkeypatch.setattr(chat.bedrock_client, "generate_guarded_response", fake_generate)
+    async def fake_get(namespace, key):
+        return None
+
+    async def fake_set(namespace, key, value, ttl=None):
+        writes.append((namespace, value))
+
+    monkeypatch.setattr(chat.shared_cache, "get_async", fake_get)
+    monkeypatch.setattr(chat.shared_cache, "set_async", fake_set)
+    yield writes
+    current_deadline.set(None)
+
+def fake_fallback(reason, degradation=None):
+    async def search(query, keywords_with_scores, profile_log, trace, events, filters):
+        if degradation:
+            chat.get_deadline().degrade(degradation)
+        keyword = query if reason == 'deadline_capped' else keywords_with_scores[0]['keyword']
+        trace['selected_candidate'] = {'keyword': keyword, 'position': 0, 'reason': reason}
+        return [], keyword, 0.0
+    return search
+
+def run(query):
+    async def main():
+        start_deadline(30)
+        return await chat.extract_search_keywords_with_llm(query, trace={})
+    return asyncio.run(main())
+
+def test_selected_keyword_is_cached(cache_writes, monkeypatch):
+    monkeypatch.setattr(chat, "search_with_score_based_fallback", fake_fallback('primary'))
+    keyword, _ = run("ソニーグループの取り組み")
+    assert cache_writes == [("keywords", keyword)]
+
+@pytest.mark.parametrize("reason, degradation", [
+    ('deadline_capped', 'capped_fallback_attempts'),
+    ('deadline_capped', None),
+    ('final_fallback', 'partial_federated_search'),
+])
+def test_degraded_selection_is_not_cached(cache_writes, monkeypatch, reason, degradation):
+    monkeypatch.setattr(chat, "search_with_score_based_fallback", fake_fallback(reason, degradation))
+    run("ソニーグループの取り組み")
+    assert cache_writes == []
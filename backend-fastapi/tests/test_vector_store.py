@@ -0,0 +1,42 @@
+import os
+import sys
+
+# プロジェクトのルートパスを追加（インポートエラー回避）
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+from app.services.vector_store import VectorStore
+
+def vectors(count, dim=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dim)).tolist()
+
+def test_append_after_interrupted_write(tmp_path):
+    store = VectorStore(str(tmp_path))
+    store.append(["a", "b"], vectors(2), [{"session_id": "AWS-01"}, {"session_id": "AWS-02"}])
+
+    # meta.json を書く前に落ちた追記の書きかけ（meta.json の件数を超える部分）
+    for name in ("vectors.bin", "ids.jsonl", "ids.offsets", "ivf_assign.bin"):
+        with open(tmp_path / name, "ab") as f:
+            f.write(b"\x01partial")
+
+    added = vectors(1, seed=1)
+    store.append(["c"], added, [{"session_id": "AWS-03"}])
+
+    reader = VectorStore(str(tmp_path))
+    reader.load()
+    assert reader.meta["count"] == 3
+    assert [reader.entry(row)["id"] for row in range(3)] == ["a", "b", "c"]
+    assert reader.search_brute_force(added[0], k=1)[0]["id"] == "c"
+    assert os.path.getsize(tmp_path / "vectors.bin") == 3 * 8 * 2
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+def test_delete_and_index_keep_committed_rows(tmp_path):
+    store = VectorStore(str(tmp_path))
+    store.append([f"v{i}" for i in range(20)], vectors(20), [{"session_id": f"AWS-{i:02d}"} for i in range(20)])
+    store.build_index(nlist=4)
+    assert store.delete(["v3", "v7"]) == 2
+
+    reader = VectorStore(str(tmp_path))
+    assert reader.live_ids() == {f"v{i}" for i in range(20)} - {"v3", "v7"}
+    assert reader.meta["nlist"] == 4
+    assert all(result["id"] not in ("v3", "v7") for result in reader.search(vectors(1, seed=2)[0], k=20, nprobe=4))